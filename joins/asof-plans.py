@@ -1,9 +1,17 @@
 #!./.venv/bin/python
 
 import argparse
-import csv
+from datetime import datetime
 import duckdb
+import functools
+import json
+import math
+import multiprocessing
 import os
+import resource
+import statistics
+import sys
+import tempfile
 import time
 
 timeout = 600
@@ -57,44 +65,150 @@ def generate_times(con, sizes):
         """
         con.sql(sql)
 
-def build_dict(record, key, dflt):
-    if key not in record:
-        record[key] = dflt
-    return record[key]
-
-def read_history(path):
-    history = {}
+def summarize(timings):
+    # Robust statistics of the timed runs
+    median = statistics.median(timings)
+    mean = statistics.mean(timings)
+    return {
+        'median': median,
+        'min': min(timings),
+        'mad': statistics.median([abs(timing - median) for timing in timings]),
+        'cv': statistics.stdev(timings) / mean if len(timings) > 1 and mean else 0.0,
+    }
+
+def read_results(path):
+    # The latest result of each (threads, build, algorithm, probe) configuration
+    results = {}
     if os.path.exists(path):
-        with open(path, "r" , newline='') as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=',')
-            for row in reader:
-                record = history
-                record = build_dict(record, int(row['threads']), {})
-                record = build_dict(record, int(row['build']), {})
-                record = build_dict(record, row['algorithm'], {})
-                runs = build_dict(record, int(row['probe']), [])
-                runs.append(float(row['timing']))
+        with open(path, "r") as jsonfile:
+            for line in jsonfile:
+                result = json.loads(line)
+                results[(result['threads'], result['build'], result['algorithm'], result['probe'],)] = result
+
+    return results
+
+def write_result(path, result):
+    # One JSON object per line, appended as soon as the configuration finishes
+    with open(path, "a") as jsonfile:
+        jsonfile.write(json.dumps(result) + "\n")
+
+# Results warehouse
+# Every result is also kept in a DuckDB table, stamped with the DuckDB version
+# and source hash that produced it, the host core count and the time,
+# so that results can be compared across releases.
+# Versions are kept without the leading 'v' that DuckDB reports,
+# so they can be asked for as either '1.5.6' or 'v1.5.6'.
+
+warehouse_schema = """
+    CREATE TABLE IF NOT EXISTS results (
+        duckdb_version VARCHAR,
+        git_hash VARCHAR,
+        cores INTEGER,
+        recorded TIMESTAMP,
+        threads INTEGER,
+        build BIGINT,
+        algorithm VARCHAR,
+        probe BIGINT,
+        status VARCHAR,
+        warmup DOUBLE,
+        timings DOUBLE[],
+        median DOUBLE,
+        min DOUBLE,
+        mad DOUBLE,
+        cv DOUBLE,
+        peak_rss BIGINT,
+        profiles JSON
+    );
+"""
+
+# The latest successful result of each configuration for each version and host.
+# Older warehouses stored the version with its 'v'.
+latest_results = """
+    SELECT * REPLACE (ltrim(duckdb_version, 'v') AS duckdb_version)
+    FROM results
+    WHERE status = 'ok'
+    QUALIFY ROW_NUMBER() OVER (
+        PARTITION BY ltrim(duckdb_version, 'v'), git_hash, cores, threads, build, algorithm, probe
+        ORDER BY recorded DESC) = 1
+"""
+
+def version_key(version):
+    # A version without its leading 'v' (git hashes are left alone)
+    return version.removeprefix('v')
+
+def check_versions(con, *versions):
+    # Fail on versions or git hashes that have no results in the warehouse
+    sql = f"SELECT COUNT(*) FROM ({latest_results}) WHERE ? IN (duckdb_version, git_hash)"
+    missing = [version for version in versions if not con.execute(sql, [version]).fetchone()[0]]
+    if missing:
+        raise ValueError(f"No results in the warehouse for {', '.join(missing)}")
+
+@functools.cache
+def environment():
+    # The DuckDB library that runs the benchmarks and the host it runs on
+    version, source = duckdb.connect().sql("SELECT library_version, source_id FROM pragma_version()").fetchone()
+    return version_key(version), source, os.cpu_count()
+
+def store_result(warehouse, result):
+    version, source, cores = environment()
+    with duckdb.connect(warehouse) as con:
+        con.sql(warehouse_schema)
+        con.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [
+            version, source, cores, datetime.now(),
+            result['threads'], result['build'], result['algorithm'], result['probe'],
+            result['status'], result['warmup'], result['timings'],
+            result.get('median'), result.get('min'), result.get('mad'), result.get('cv'),
+            result['peak_rss'], json.dumps(result['profiles']) if 'profiles' in result else None,
+        ])
+
+def compare_versions(warehouse, base, new, noise=0.05):
+    # Configurations whose median regressed from base to new (each a version or git hash).
+    # A regression must exceed both the relative noise threshold
+    # and three times the larger median absolute deviation.
+    sql = f"""
+        WITH latest AS ({latest_results})
+        SELECT b.threads, b.build, b.algorithm, b.probe, b.median, n.median, n.median / b.median AS ratio,
+            n.median - b.median > GREATEST(? * b.median, 3 * GREATEST(b.mad, n.mad)) AS regressed
+        FROM latest b JOIN latest n
+          ON b.cores = n.cores AND b.threads = n.threads AND b.build = n.build
+         AND b.algorithm = n.algorithm AND b.probe = n.probe
+        WHERE ? IN (b.duckdb_version, b.git_hash)
+          AND ? IN (n.duckdb_version, n.git_hash)
+        ORDER BY b.threads DESC, b.build, b.algorithm, b.probe
+    """
+    base, new = version_key(base), version_key(new)
+    with duckdb.connect(warehouse, read_only=True) as con:
+        check_versions(con, base, new)
+        rows = con.execute(sql, [noise, base, new]).fetchall()
 
-    return history
+    print("threads,build,algorithm,probe,base,new,ratio,regressed", flush=True)
+    for row in rows:
+        print(','.join(str(value) for value in row), flush=True)
 
-def run_benchmark(con, history, threads, algorithm, build, probe, cutoff, runs=5):
-    worst = 0
+    regressions = sum(1 for row in rows if row[-1])
+    print(f"{regressions} of {len(rows)} configurations regressed from {base} to {new}", file=sys.stderr, flush=True)
+    return regressions
 
-    # Check history for this run and just echo it if we already have it
-    record = history
-    for key in (threads, build, algorithm, probe,):
-        if key in record:
-            record = record[key]
-        else:
-            record = None
-            break
+def scaling_curves(warehouse, version):
+    # Median timings and speedups over the fewest threads for each configuration
+    sql = f"""
+        WITH latest AS ({latest_results})
+        SELECT build, algorithm, probe, threads, median,
+            FIRST(median) OVER (PARTITION BY cores, build, algorithm, probe ORDER BY threads) / median AS speedup
+        FROM latest
+        WHERE ? IN (duckdb_version, git_hash)
+        ORDER BY build, algorithm, probe, threads
+    """
+    version = version_key(version)
+    with duckdb.connect(warehouse, read_only=True) as con:
+        check_versions(con, version)
+        rows = con.execute(sql, [version]).fetchall()
 
-    if record:
-        for run, timing in enumerate(record):
-            worst = max(worst, timing)
-            print(f"{algorithm},{build},{probe},{run+1},{timing},{threads}", flush=True)
-        return worst
+    print("build,algorithm,probe,threads,median,speedup", flush=True)
+    for row in rows:
+        print(','.join(str(value) for value in row), flush=True)
 
+def configure(con, algorithm, threads):
     iejoin = 'True' if algorithm == 'iejoin' else 'False'
 
     threshold = 0
@@ -107,7 +221,8 @@ def run_benchmark(con, history, threads, algorithm, build, probe, cutoff, runs=5
     con.sql(f"PRAGMA asof_loop_join_threshold={threshold};")
     con.sql(f"PRAGMA threads={threads};")
 
-    sql = f"""
+def asof_query(build, probe):
+    return f"""
         SELECT COUNT(*) FROM (
             SELECT
               t.probe,
@@ -118,37 +233,274 @@ def run_benchmark(con, history, threads, algorithm, build, probe, cutoff, runs=5
             ) t
     """
 
-    # Warmup
+def time_query(con, sql):
+    start = time.perf_counter()
+    con.execute(sql)
+    end = time.perf_counter()
+    return end - start
+
+def parse_profile(profile, depth=0, operators=None):
+    # Flatten a JSON profile into its operators in depth first order
+    if operators is None: operators = []
+    for child in profile.get('children', []):
+        operators.append({
+            'operator': child.get('operator_name', child.get('name')),
+            'depth': depth,
+            'timing': child.get('operator_timing', child.get('timing', 0.0)),
+            'cardinality': child.get('operator_cardinality', child.get('cardinality', 0)),
+        })
+        parse_profile(child, depth + 1, operators)
+    return operators
+
+def peak_rss():
+    # The peak resident set of this process in bytes (macOS reports bytes, Linux KiB)
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def benchmark_worker(database, threads, algorithm, build, probe, runs, pipe, profile=False):
+    # Runs in a child process: the warmup (run 0) and the timed runs,
+    # sending each timing back as soon as it is known, then the peak RSS.
+    # If profile is set, as many extra runs write JSON profiles
+    # and their operators are sent after each one,
+    # so the profiling overhead stays out of the timings.
+    con = duckdb.connect(database, read_only=True)
+    configure(con, algorithm, threads)
+    sql = asof_query(build, probe)
+    pipe.send(('ready',))
+    for run in range(runs + 1):
+        pipe.send(('timing', run, time_query(con, sql),))
+    if profile:
+        with tempfile.TemporaryDirectory() as scratch:
+            output = os.path.join(scratch, "profile.json")
+            con.sql("PRAGMA enable_profiling='json';")
+            con.sql(f"PRAGMA profiling_output='{output}';")
+            for run in range(1, runs + 1):
+                # The profile is written when the result is consumed
+                con.execute(sql).fetchall()
+                with open(output, "r") as jsonfile:
+                    pipe.send(('profile', run, parse_profile(json.load(jsonfile)),))
+    pipe.send(('rss', peak_rss(),))
+    con.close()
+
+def run_isolated(database, threads, algorithm, build, probe, runs=5, limit=timeout, abandon=None, startup=60, profile=False):
+    # Time one configuration in a child process.
+    # The child is killed when it takes more than startup seconds to connect,
+    # more than limit seconds to run a single query,
+    # or when the warmup is slower than abandon seconds.
+    result = {
+        'threads': threads,
+        'build': build,
+        'algorithm': algorithm,
+        'probe': probe,
+        'status': 'ok',
+        'warmup': None,
+        'timings': [],
+        'peak_rss': None,
+    }
+    if profile: result['profiles'] = []
+
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    child = context.Process(target=benchmark_worker, args=(database, threads, algorithm, build, probe, runs, sender, profile,))
+    child.start()
+    sender.close()
+
     try:
-        start = time.time()
-        con.execute(sql)
-        end = time.time()
-        timing = end - start
-        worst = max(worst, timing)
-
-        # If the timing is too long, just write out this one example
-        if timing > timeout:
-            print(f"{algorithm},{build},{probe},0,{timing},{threads}", flush=True)
-            return worst
-
-        # Abort if the time is twice as slow as the cutoff
-        if algorithm == 'nlj' and worst > 2 * cutoff:
-            return worst
-    except:
-        print(sql)
-        raise
-
-    # Timed runs
-    for run in range(runs):
-        start = time.time()
-        con.execute(sql)
-        end = time.time()
-        timing = end - start
-        worst = max(worst, timing)
+        wait = startup
+        warming = False
+        while True:
+            if not receiver.poll(wait):
+                # A warmup still running after abandon seconds is abandoned without its timing
+                result['status'] = 'abandoned' if warming and wait < limit else 'timeout'
+                break
+
+            try:
+                message = receiver.recv()
+            except EOFError:
+                result['status'] = 'error'
+                break
+
+            if message[0] == 'ready':
+                warming = True
+                wait = limit if abandon is None else min(limit, abandon)
+                continue
+
+            if message[0] == 'profile':
+                result['profiles'].append(message[2])
+                continue
+
+            if message[0] == 'rss':
+                result['peak_rss'] = message[1]
+                break
+
+            _, run, timing = message
+            if run:
+                result['timings'].append(timing)
+                continue
+
+            result['warmup'] = timing
+            if abandon is not None and timing > abandon:
+                result['status'] = 'abandoned'
+                break
+            warming = False
+            wait = limit
+    finally:
+        if child.is_alive(): child.kill()
+        child.join()
+        receiver.close()
+
+    if result['timings']:
+        result.update(summarize(result['timings']))
+
+    return result
+
+def worst_timing(result):
+    if result['status'] in ('timeout', 'error',) or result['warmup'] is None:
+        return math.inf
+    return max([result['warmup']] + result['timings'])
+
+def run_benchmark(database, history, path, threads, algorithm, build, probe, cutoff, runs=5, limit=timeout, profile=False, warehouse=None):
+    # Check history for this run and just echo it if we already have it
+    key = (threads, build, algorithm, probe,)
+    if key in history:
+        result = history[key]
+    else:
+        # Abort if nlj is twice as slow as the cutoff
+        abandon = 2 * cutoff if algorithm == 'nlj' else None
+        result = run_isolated(database, threads, algorithm, build, probe, runs, limit, abandon, profile=profile)
+        write_result(path, result)
+        if warehouse: store_result(warehouse, result)
+
+    # If the timing is too long, just write out the warmup
+    if result['status'] in ('timeout', 'abandoned',):
+        timing = math.inf if result['status'] == 'timeout' or result['warmup'] is None else result['warmup']
+        print(f"{algorithm},{build},{probe},0,{timing},{threads}", flush=True)
+
+    for run, timing in enumerate(result['timings']):
         print(f"{algorithm},{build},{probe},{run+1},{timing},{threads}", flush=True)
-        if worst > timeout: break
 
-    return worst
+    return worst_timing(result)
+
+def summarize_profiles(profiles):
+    # The median time and cardinality of each operator over the profiled runs.
+    # Operators that appear more than once in a plan are added up per run,
+    # and runs whose plan lacks an operator count it as 0.
+    operators = {}
+    for run in profiles:
+        for operator in run:
+            operators.setdefault(operator['operator'], {'timings': [], 'cardinalities': []})
+
+    for run in profiles:
+        totals = {name: [0.0, 0] for name in operators}
+        for operator in run:
+            totals[operator['operator']][0] += operator['timing']
+            totals[operator['operator']][1] += operator['cardinality']
+        for name, (timing, cardinality) in totals.items():
+            operators[name]['timings'].append(timing)
+            operators[name]['cardinalities'].append(cardinality)
+
+    return {name: (statistics.median(operator['timings']), statistics.median(operator['cardinalities']),)
+            for name, operator in operators.items()}
+
+def profile_report(results):
+    # Where the time goes, by algorithm and size
+    print("threads,build,algorithm,probe,operator,timing,share,cardinality", flush=True)
+    for key in sorted(results):
+        result = results[key]
+        if not result.get('profiles'): continue
+
+        threads, build, algorithm, probe = key
+        operators = summarize_profiles(result['profiles'])
+        total = sum(timing for timing, _ in operators.values()) or 1.0
+        for name, (timing, cardinality) in sorted(operators.items(), key=lambda item: -item[1][0]):
+            print(f"{threads},{build},{algorithm},{probe},{name},{timing},{timing / total:.3f},{cardinality}", flush=True)
+
+def confidence_interval(timings, confidence):
+    # Normal approximation to the confidence interval of the mean timing
+    mean = statistics.mean(timings)
+    if len(timings) < 2: return mean, mean
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    half = z * statistics.stdev(timings) / math.sqrt(len(timings))
+    return mean - half, mean + half
+
+def time_once(database, threads, algorithm, build, probe, limit=timeout, abandon=None):
+    # One isolated timed run (after its warmup), or infinity if it didn't finish
+    result = run_isolated(database, threads, algorithm, build, probe, 1, limit, abandon)
+    if result['status'] != 'ok':
+        return math.inf
+    return result['timings'][0]
+
+def race(database, threads, algorithm, build, probe, confidence=0.95, min_runs=3, max_runs=15, slowdown=10, limit=timeout):
+    # Alternate asof and algorithm runs at one size until their confidence intervals separate.
+    # Returns whether algorithm beats asof and the median timings of both.
+    # An algorithm that is slowdown times slower than asof loses without repetitions,
+    # and one that can't be separated after max_runs does not count as beating asof.
+    max_runs = max(max_runs, min_runs)
+
+    baselines = [time_once(database, threads, 'asof', build, probe, limit)]
+    challengers = [time_once(database, threads, algorithm, build, probe, limit, slowdown * baselines[0])]
+    if math.isinf(baselines[0]) or math.isinf(challengers[0]):
+        return challengers[0] < baselines[0], baselines[0], challengers[0]
+
+    while len(baselines) < max_runs:
+        baselines.append(time_once(database, threads, 'asof', build, probe, limit))
+        challengers.append(time_once(database, threads, algorithm, build, probe, limit))
+        if math.isinf(baselines[-1]) or math.isinf(challengers[-1]):
+            return challengers[-1] < baselines[-1], statistics.median(baselines), statistics.median(challengers)
+        if len(baselines) < min_runs: continue
+
+        lo, hi = confidence_interval(baselines, confidence)
+        clo, chi = confidence_interval(challengers, confidence)
+        if chi < lo or clo > hi: break
+
+    beats = (chi < lo)
+    return beats, statistics.median(baselines), statistics.median(challengers)
+
+def find_crossover(sizes, beats):
+    # The index of the first size where beats(size) is false,
+    # assuming the alternative only wins below some size.
+    # Gallop up from the smallest size, then bisect the last step.
+    lo = -1
+    hi = 0
+    step = 1
+    while hi < len(sizes) and beats(sizes[hi]):
+        lo = hi
+        hi = lo + step
+        step *= 2
+    hi = min(hi, len(sizes))
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if beats(sizes[mid]):
+            lo = mid
+        else:
+            hi = mid
+
+    return hi
+
+def search_crossovers(database, threads, prices, times, algorithms, confidence, max_runs, limit=timeout):
+    # For each thread count, build size and alternative,
+    # the largest probe size where the alternative still beats asof
+    print("threads,build,algorithm,crossover,loses,asof,timing", flush=True)
+    for thread in threads:
+        for build in prices:
+            for algorithm in algorithms:
+                if algorithm == 'asof': continue
+
+                raced = {}
+                def beats(probe):
+                    raced[probe] = race(database, thread, algorithm, build, probe, confidence, max_runs=max_runs, limit=limit)
+                    print(f"{thread},{build},{algorithm},{probe},{raced[probe]}", file=sys.stderr, flush=True)
+                    return raced[probe][0]
+
+                first = find_crossover(times, beats)
+                crossover = times[first - 1] if first else 0
+                if first < len(times):
+                    loses = times[first]
+                    _, baseline, challenger = raced[loses]
+                    print(f"{thread},{build},{algorithm},{crossover},{loses},{baseline},{challenger}", flush=True)
+                else:
+                    print(f"{thread},{build},{algorithm},{crossover},,,", flush=True)
 
 def main():
     arg_parser = argparse.ArgumentParser(
@@ -202,11 +554,93 @@ def main():
         "-l",
         "--history",
         type=str,
-        default="asof.csv",
+        default="asof.jsonl",
         help="Results of previoud runs",
     )
+    arg_parser.add_argument(
+        "-x",
+        "--timeout",
+        type=float,
+        default=timeout,
+        help="Seconds before a single query is killed",
+    )
+    arg_parser.add_argument(
+        "-s",
+        "--search",
+        default=False,
+        action="store_true",
+        help="Search for the probe size where each algorithm stops beating asof instead of running the full grid",
+    )
+    arg_parser.add_argument(
+        "-c",
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Confidence level separating two algorithms in the search",
+    )
+    arg_parser.add_argument(
+        "-r",
+        "--max-runs",
+        type=int,
+        default=15,
+        help="Maximum runs of each algorithm per probe size in the search",
+    )
+    arg_parser.add_argument(
+        "-o",
+        "--profile",
+        default=False,
+        action="store_true",
+        help="Capture JSON operator profiles in extra runs after the timed ones",
+    )
+    arg_parser.add_argument(
+        "-R",
+        "--report",
+        default=False,
+        action="store_true",
+        help="Summarise the operator profiles in the history instead of running anything",
+    )
+    arg_parser.add_argument(
+        "-w",
+        "--warehouse",
+        type=str,
+        default="asof-results.db",
+        help="DuckDB database that accumulates the results of every version",
+    )
+    arg_parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASE", "NEW"),
+        help="Flag the configurations that regressed between two versions or git hashes in the warehouse",
+    )
+    arg_parser.add_argument(
+        "--noise",
+        type=float,
+        default=0.05,
+        help="Relative slowdown below which a comparison is noise",
+    )
+    arg_parser.add_argument(
+        "--scaling",
+        type=str,
+        metavar="VERSION",
+        help="Print the thread scaling curves of a version or git hash in the warehouse",
+    )
     args = arg_parser.parse_args()
 
+    try:
+        if args.compare:
+            compare_versions(args.warehouse, *args.compare, args.noise)
+            return
+
+        if args.scaling:
+            scaling_curves(args.warehouse, args.scaling)
+            return
+    except ValueError as error:
+        arg_parser.error(str(error))
+
+    if args.report:
+        profile_report(read_results(args.history))
+        return
+
     if not os.path.exists(args.database):
         args.generate = True
 
@@ -235,7 +669,14 @@ def main():
         generate_prices(con, prices)
         generate_times(con, times)
 
-    history = read_history(args.history)
+    # The timed runs open the database read only in child processes
+    con.close()
+
+    if args.search:
+        search_crossovers(args.database, threads, prices, times, algorithms, args.confidence, args.max_runs, args.timeout)
+        return
+
+    history = read_results(args.history)
 
     print("algorithm,build,probe,run,timing,threads", flush=True)
     for thread in threads:
@@ -243,11 +684,11 @@ def main():
             cutoff = 0
             for algorithm in algorithms:
                 for probe in times:
-                    worst = run_benchmark(con, history, thread, algorithm, build, probe, cutoff)
+                    worst = run_benchmark(args.database, history, args.history, thread, algorithm, build, probe, cutoff, limit=args.timeout, profile=args.profile, warehouse=args.warehouse)
                     if algorithm == 'asof':
                         cutoff = max(cutoff, worst)
                     elif algorithm == 'iejoin':
-                        if worst > cutoff and worst > timeout:
+                        if worst > cutoff and worst > args.timeout:
                             break
                     elif worst > cutoff:
                         break
@@ -0,0 +1,274 @@
+# encoding=utf8
+
+import datetime
+import operator
+import random
+import unittest
+
+import numpy as np
+
+from iejoin import EqualityPartitions, ExtractColumn, FormatPredicates, JoinResult, NoOffsets, equalities, ops
+from sweep import Endpoints
+
+# AsOf joins
+# Each probe row is matched with the one build row in its partition
+# whose value is nearest on the side allowed by the inequality:
+#     probe ≥ time: the latest time at or before the probe
+#     probe > time: the latest time strictly before the probe
+#     probe ≤ time: the earliest time at or after the probe
+#     probe < time: the earliest time strictly after the probe
+# Any equality predicates partition the inputs (ASOF JOIN ... ON p.key = t.key AND ...).
+# Ties between build rows with the same time go to the lowest row id.
+# Probes without a match are dropped (an inner ASOF JOIN).
+#
+# The inputs follow the schema generated by asof-plans.py:
+#     prices_N(id, time, price) is the build side
+#     times_N(id, probe) is the probe side
+
+probe_time = {'op': operator.ge, 'lhs': 'probe', 'rhs': 'time'}
+
+def Prices(n, days=365):
+    # prices_n: random times over a year
+    start = datetime.datetime(2021, 1, 1)
+    return [{'id': r,
+             'time': start + datetime.timedelta(seconds=random.random() * 60 * 60 * 24 * days),
+             'price': random.randint(0, 100000)}
+            for r in range(n)]
+
+def Times(n, days=365):
+    # times_n: random whole second probes over a year
+    start = datetime.datetime(2021, 1, 1)
+    return [{'id': r,
+             'probe': start + datetime.timedelta(seconds=random.randint(0, 60 * 60 * 24 * days))}
+            for r in range(n)]
+
+def AsOfPredicates(preds):
+    # The (inequality, keys) of an AsOf join
+    inequalities = [pred for pred in preds if pred['op'] in ops]
+    keys = [pred for pred in preds if pred['op'] in equalities]
+    if len(inequalities) != 1 or len(keys) + 1 != len(preds):
+        raise ValueError(f"AsOf joins need one inequality and any number of equalities: {FormatPredicates(preds)}")
+    NoOffsets('AsOf joins', preds)
+    return inequalities[0], keys
+
+def AsOfPartitions(T, Tr, keys):
+    # The (probe rids, build rids) of each partition that exists on both sides
+    if not keys:
+        yield np.arange(len(T)), np.arange(len(Tr))
+        return
+
+    partitions = EqualityPartitions(T, [pred['lhs'] for pred in keys])
+    partitions_r = EqualityPartitions(Tr, [pred['rhs'] for pred in keys])
+    for key, rids in partitions.items():
+        if key in partitions_r:
+            yield np.array(rids, dtype=np.int64), np.array(partitions_r[key], dtype=np.int64)
+
+def Ordinals(A):
+    # Integer or floating point values with the same order, for the ufunc reductions
+    if A.dtype.kind in 'mM': return A.view(np.int64)
+    return A
+
+def AsOfLoop(T, Tr, preds, trace=0, rowids=False):
+    # The nested loop reference
+    inequality, keys = AsOfPredicates(preds)
+    op = inequality['op']
+    X = inequality['lhs']
+    Y = inequality['rhs']
+
+    # The nearest time is the largest one for ≥/> and the smallest one for ≤/<
+    nearer = operator.gt if op in (operator.gt, operator.ge,) else operator.lt
+
+    if trace: print("AsOfLoop:", len(T), len(Tr), FormatPredicates(preds))
+
+    join_result = JoinResult(T, Tr, rowids)
+    for l, t in enumerate(T):
+        best = None
+        for r, p in enumerate(Tr):
+            if not all(t[key['lhs']] == p[key['rhs']] for key in keys): continue
+            if not op(t[X], p[Y]): continue
+            if best is None or nearer(p[Y], Tr[best][Y]):
+                best = r
+        if best is not None:
+            join_result.Emit(l, best)
+
+    return join_result
+
+def AsOfMergePartition(op, X, Y):
+    # Sort-merge sweep of one partition: both sides are sorted
+    # and a single cursor moves forward through the build side.
+    # Returns the matching (probe, build) positions into X and Y.
+    probes = np.argsort(X, kind='stable')
+    builds = np.argsort(Y, kind='stable')
+    X = X[probes].tolist()
+    Y = Y[builds].tolist()
+    n = len(Y)
+
+    left = []
+    right = []
+    j = 0
+    if op in (operator.gt, operator.ge,):
+        # The cursor passes every time the probe can see;
+        # the match is the first row of the last run of equal times passed.
+        run = 0
+        for i, x in enumerate(X):
+            while j < n and op(x, Y[j]):
+                if Y[j] != Y[run]: run = j
+                j += 1
+            if j:
+                left.append(probes[i])
+                right.append(builds[run])
+    else:
+        # The cursor stops at the first time the probe can see
+        for i, x in enumerate(X):
+            while j < n and not op(x, Y[j]):
+                j += 1
+            if j < n:
+                left.append(probes[i])
+                right.append(builds[j])
+
+    return np.array(left, dtype=np.int64), np.array(right, dtype=np.int64)
+
+def AsOfSearchPartition(op, X, Y):
+    # Vectorised search of one partition for a small probe side.
+    # Only the probes are sorted: each build time is searched in the sorted probes,
+    # which puts it in the bucket of probes it is nearest for.
+    # The nearest time of each bucket is reduced with ufunc.at
+    # and carried across the buckets with accumulate,
+    # so the cost is O(n log m) for n build rows and m probes.
+    m = len(X)
+    probes = np.argsort(X, kind='stable')
+    X = X[probes]
+    Y = Ordinals(Y)
+    X = Ordinals(X)
+    builds = np.arange(len(Y))
+
+    if op in (operator.gt, operator.ge,):
+        # Time y is visible to the probes from bucket b on
+        b = np.searchsorted(X, Y, side='left' if op == operator.ge else 'right')
+        sentinel = np.iinfo(Y.dtype).min if Y.dtype.kind == 'i' else -np.inf
+        nearest = np.full(m + 1, sentinel, dtype=Y.dtype)
+        np.maximum.at(nearest, b, Y)
+        nearest = nearest[:m]
+        running = np.maximum.accumulate(nearest)
+    else:
+        # Time y is visible to the probes up to bucket b
+        b = np.searchsorted(X, Y, side='right' if op == operator.le else 'left') - 1
+        sentinel = np.iinfo(Y.dtype).max if Y.dtype.kind == 'i' else np.inf
+        nearest = np.full(m + 1, sentinel, dtype=Y.dtype)
+        np.minimum.at(nearest, b, Y)
+        nearest = nearest[:m]
+        running = np.minimum.accumulate(nearest[::-1])[::-1]
+
+    # The lowest build row holding the nearest time of each bucket
+    # (b = m or -1 is the overflow bucket of times no probe can see)
+    hit = np.zeros(m + 1, dtype=bool)
+    hit[b] = True
+    hit = hit[:m]
+    holders = np.full(m + 1, len(Y), dtype=np.int64)
+    tied = (Y == np.append(nearest, sentinel)[b]) & (b < m) & (b >= 0)
+    np.minimum.at(holders, b[tied], builds[tied])
+
+    # The bucket holding the nearest visible time of each probe
+    if op in (operator.gt, operator.ge,):
+        bucket = np.where(hit & (nearest == running), np.arange(m), -1)
+        bucket = np.maximum.accumulate(bucket)
+        matched = (bucket >= 0)
+    else:
+        bucket = np.where(hit & (nearest == running), np.arange(m), m)
+        bucket = np.minimum.accumulate(bucket[::-1])[::-1]
+        matched = (bucket < m)
+
+    return probes[matched], holders[bucket[matched]]
+
+def AsOfPartitioned(T, Tr, preds, partition, join_result):
+    inequality, keys = AsOfPredicates(preds)
+    X = Endpoints(ExtractColumn(T, inequality['lhs']))
+    Y = Endpoints(ExtractColumn(Tr, inequality['rhs']))
+
+    for rids, rids_r in AsOfPartitions(T, Tr, keys):
+        left, right = partition(inequality['op'], X[rids], Y[rids_r])
+        join_result.EmitBlock(rids[left], rids_r[right])
+
+    return join_result
+
+def AsOfMerge(T, Tr, preds, trace=0, rowids=False):
+    if trace: print("AsOfMerge:", len(T), len(Tr), FormatPredicates(preds))
+    return AsOfPartitioned(T, Tr, preds, AsOfMergePartition, JoinResult(T, Tr, rowids))
+
+def AsOfSearch(T, Tr, preds, trace=0, rowids=False):
+    if trace: print("AsOfSearch:", len(T), len(Tr), FormatPredicates(preds))
+    return AsOfPartitioned(T, Tr, preds, AsOfSearchPartition, JoinResult(T, Tr, rowids))
+
+def AsOfJoin(T, Tr, preds, threshold=64, trace=0, rowids=False):
+    # Search for up to threshold probes, like DuckDB's asof_loop_join_threshold
+    if len(T) <= threshold:
+        return AsOfSearch(T, Tr, preds, trace, rowids)
+    return AsOfMerge(T, Tr, preds, trace, rowids)
+
+class TestAsOf(unittest.TestCase):
+
+    algorithms = (AsOfMerge, AsOfSearch, AsOfJoin,)
+
+    def assertAsOf(self, T, Tr, preds, msg=None):
+        expected = list(AsOfLoop(T, Tr, preds, rowids=True))
+        for algorithm in self.algorithms:
+            actual = algorithm(T, Tr, preds, rowids=True)
+            self.assertEqual(sorted(expected), sorted(actual), f"{algorithm.__name__} {msg}")
+
+    def test_predicates(self):
+        key = {'op': operator.eq, 'lhs': 'key', 'rhs': 'key'}
+        self.assertEqual((probe_time, [key],), AsOfPredicates((key, probe_time,)))
+
+        with self.assertRaises(ValueError):
+            AsOfPredicates((key,))
+        with self.assertRaises(ValueError):
+            AsOfPredicates((probe_time, probe_time,))
+        with self.assertRaises(ValueError):
+            AsOfPredicates(({**probe_time, 'offset': datetime.timedelta(minutes=5)},))
+
+    def test_prices(self):
+        prices = Prices(200)
+        times = Times(50)
+        self.assertAsOf(times, prices, (probe_time,))
+
+        # Probes before the first price have no match
+        early = [{'id': 0, 'probe': datetime.datetime(2020, 1, 1)}]
+        for algorithm in self.algorithms:
+            self.assertEqual(0, len(algorithm(early, prices, (probe_time,), rowids=True)))
+
+        # Materialised rows
+        pairs = AsOfMerge(times, prices, (probe_time,))
+        self.assertEqual(len(pairs), len(AsOfSearch(times, prices, (probe_time,))))
+        for t, p in pairs:
+            self.assertTrue(t['probe'] >= p['time'])
+
+    def test_ties(self):
+        # Equal times go to the lowest build row
+        prices = [{'time': 5}, {'time': 3}, {'time': 5}, {'time': 3}]
+        times = [{'probe': 4}, {'probe': 5}, {'probe': 6}]
+        for op, expected in ((operator.ge, [(0, 1), (1, 0), (2, 0)]),
+                             (operator.gt, [(0, 1), (1, 1), (2, 0)]),
+                             (operator.le, [(0, 0), (1, 0)]),
+                             (operator.lt, [(0, 0)]),):
+            preds = ({'op': op, 'lhs': 'probe', 'rhs': 'time'},)
+            for algorithm in (AsOfLoop,) + self.algorithms:
+                actual = sorted(algorithm(times, prices, preds, rowids=True))
+                self.assertEqual(expected, actual, f"{algorithm.__name__} {FormatPredicates(preds)}")
+
+    def test_random(self):
+        for repeat in range(50):
+            T = [{'probe': random.randint(0, 30), 'key': random.randint(0, 2)} for _ in range(random.randint(1, 20))]
+            Tr = [{'time': random.randint(0, 30), 'key': random.randint(0, 2)} for _ in range(random.randint(1, 40))]
+            for op in ops:
+                inequality = {'op': op, 'lhs': 'probe', 'rhs': 'time'}
+                for preds in ((inequality,), (inequality, {'op': operator.eq, 'lhs': 'key', 'rhs': 'key'},),):
+                    self.assertAsOf(T, Tr, preds, FormatPredicates(preds))
+
+    def test_floats(self):
+        T = [{'probe': random.random()} for _ in range(20)]
+        Tr = [{'time': random.random()} for _ in range(50)]
+        for op in ops:
+            self.assertAsOf(T, Tr, ({'op': op, 'lhs': 'probe', 'rhs': 'time'},))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!./.venv/bin/python
+
+import argparse
+import operator
+import random
+import statistics
+import time
+
+from bitarray import bitarray
+
+import iejoin
+from iejoin import IESelfJoinColumnar, SummaryBitmap
+
+class NativeBitmap:
+    """The SummaryBitmap interface over a bare bitarray."""
+    def __init__(self, n):
+        self._bits = bitarray(n)
+        self._bits.setall(False)
+
+    def __len__(self):
+        return len(self._bits)
+
+    def Set(self, pos):
+        self._bits[pos] = True
+
+    def Find(self, off):
+        return self._bits.find(1, off)
+
+    def Search(self, off):
+        return list(self._bits.search(1, off))
+
+bitmaps = {
+    'native': lambda n, profile=None: NativeBitmap(n),
+    'summary': lambda n, profile=None: SummaryBitmap(n),
+}
+
+def timed(f, repeats):
+    times = []
+    for r in range(repeats):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def bench_bitmap(args):
+    n = args.bits
+    offsets = [random.randrange(n) for _ in range(100)]
+    for density in args.densities:
+        ones = random.sample(range(n), int(n * density))
+        row = [f"{density:g}"]
+        for method in ('Search', 'Find',):
+            for name, Bitmap in bitmaps.items():
+                B = Bitmap(n)
+                for pos in ones: B.Set(pos)
+                search = getattr(B, method)
+                seconds = timed(lambda: [search(off) for off in offsets], args.repeats) / len(offsets)
+                row.append(f"{method} {name} {seconds * 1e3:.4f}ms")
+        print(*row, sep='\t')
+
+def dense_table(n):
+    # Random points: about a quarter of the pairs match
+    return [{'x': random.randrange(n), 'y': random.randrange(n)} for _ in range(n)]
+
+def containment_table(n):
+    # Short intervals spread over a long domain: few containments
+    T = []
+    for _ in range(n):
+        start = random.randrange(n * 100)
+        T.append({'start': start, 'end': start + random.randrange(1, 1000)})
+    return T
+
+workloads = {
+    'dense': (dense_table, (
+        {'op': operator.lt, 'lhs': 'x', 'rhs': 'x'},
+        {'op': operator.lt, 'lhs': 'y', 'rhs': 'y'},
+    )),
+    'containment': (containment_table, (
+        {'op': operator.le, 'lhs': 'start', 'rhs': 'start'},
+        {'op': operator.ge, 'lhs': 'end', 'rhs': 'end'},
+    )),
+}
+
+def bench_joins(args):
+    for workload, rows in zip(workloads, (args.dense, args.containment,)):
+        generate, preds = workloads[workload]
+        T = generate(rows)
+        row = [workload, rows]
+        for name, Bitmap in bitmaps.items():
+            iejoin.Bitmap = Bitmap
+            matches = len(IESelfJoinColumnar(T, preds, rowids=True))
+            seconds = timed(lambda: IESelfJoinColumnar(T, preds, rowids=True), args.repeats)
+            row.append(f"{name} {seconds:.3f}s")
+        row.append(f"{matches} matches")
+        print(*row, sep='\t')
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Compare SummaryBitmap with bare bitarray scans.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    arg_parser.add_argument(
+        '--bits',
+        type=int,
+        default=1 << 20,
+        help='Bit-array size for the find and search timings',
+    )
+    arg_parser.add_argument(
+        '--densities',
+        type=float,
+        nargs='+',
+        default=(0.5, 0.01, 1e-4, 1e-6,),
+        help='Fractions of set bits',
+    )
+    arg_parser.add_argument(
+        '--dense',
+        type=int,
+        default=5000,
+        help='Rows in the dense self-join',
+    )
+    arg_parser.add_argument(
+        '--containment',
+        type=int,
+        default=300000,
+        help='Rows in the selective containment self-join',
+    )
+    arg_parser.add_argument(
+        '--repeats',
+        type=int,
+        default=3,
+        help='Timings per measurement (the median is reported)',
+    )
+    args = arg_parser.parse_args()
+
+    random.seed(0)
+    bench_bitmap(args)
+    bench_joins(args)
+
+if __name__ == "__main__":
+    main()
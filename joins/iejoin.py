@@ -1,12 +1,24 @@
 # encoding=utf8
 
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import contextlib
 import copy
+import itertools
+import json
+import mmap
 import operator
+import os
 import random
 import sys
+import tempfile
+import time
+import tracemalloc
 import unittest
 
 from bitarray import bitarray
+import numpy as np
 
 ops = {
     operator.lt: "<",
@@ -15,12 +27,324 @@ ops = {
     operator.ge: "≥",
 }
 
-# Bloom filter equivalent (64 bit blocks internally)
-one_bit = bitarray(1)
-one_bit.setall(1)
+# Equality predicates only partition the inputs
+equalities = {
+    operator.eq: "=",
+}
+
+# Exclusions only filter
+exclusions = {
+    operator.ne: "≠",
+}
+
+symbols = {**ops, **equalities, **exclusions}
+
+# Swapping the sides of a predicate: x op y ⇔ y mirrors[op] x
+mirrors = {
+    operator.lt: operator.gt,
+    operator.le: operator.ge,
+    operator.gt: operator.lt,
+    operator.ge: operator.le,
+    operator.eq: operator.eq,
+    operator.ne: operator.ne,
+}
+
+# Bloom filter equivalent (64 bit blocks internally).
+# The summary has one bit per region of 64**(levels-1) bits, set when any bit in the region is set.
+# bitarray's native find and search already scan a word at a time,
+# so a Python step only pays for itself when it skips thousands of words:
+# the summary is only used to jump over long runs of empty regions (at least GAP_BITS)
+# and each stretch in between is extracted with one native search.
+# Dense bit-arrays have no such gaps and take a single native search.
+# Searching for the integer 1 rather than a one bit bitarray
+# keeps bitarray on its word-at-a-time path.
+GAP_BITS = 1 << 16
+
+class SummaryBitmap:
+    """A bit-array with a summary bit per 64**(levels-1) bit region.
+
+    The bit-array can live in a zero filled buffer (e.g. a memory-mapped file)
+    of at least (n + 7) // 8 bytes; the summary is much smaller and stays in memory.
+    """
+    def __init__(self, n, levels=3, buffer=None):
+        self._n = n
+        if buffer is None:
+            self._bits = bitarray(n)
+            self._bits.setall(False)
+        else:
+            self._bits = bitarray(buffer=buffer)
+
+        self._shift = 6 * (levels - 1)
+        self._summary = bitarray((n + (1 << self._shift) - 1) >> self._shift)
+        self._summary.setall(False)
+
+        # The shortest run of empty regions worth a Python step to skip
+        self._gap = bitarray(max(1, GAP_BITS >> self._shift))
+        self._gap.setall(False)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, pos):
+        return self._bits[pos]
+
+    def Set(self, pos):
+        self._bits[pos] = True
+        self._summary[pos >> self._shift] = True
+
+    def Find(self, off):
+        # The first set bit at or after off, or -1
+        if off >= self._n: return -1
+        B = self._bits
+        S = self._summary
+        shift = self._shift
+
+        # The rest of the region of off
+        region = off >> shift
+        if S[region]:
+            pos = B.find(1, off, min(self._n, (region + 1) << shift))
+            if pos >= 0: return pos
+
+        # The first bit of the next non-empty region
+        region = S.find(1, region + 1)
+        if region < 0: return -1
+        return B.find(1, region << shift, self._n)
+
+    def Ranges(self, off):
+        # The [start, end) ranges at or after off that are not in a long empty gap
+        S = self._summary
+        shift = self._shift
+        region = off >> shift
+        while off < self._n:
+            region = S.find(1, region)
+            if region < 0: return
+            gap = S.find(self._gap, region)
+            end = self._n if gap < 0 else min(self._n, gap << shift)
+            yield max(off, region << shift), end
+            if gap < 0: return
+            region = gap + len(self._gap)
+
+    def Search(self, off):
+        # All the set bits at or after off
+        if off >= self._n: return []
+
+        # Without a long gap ahead, one native search does it
+        if self._summary.find(self._gap, off >> self._shift) < 0:
+            return list(self._bits.search(1, off, self._n))
+
+        B = self._bits
+        result = []
+        for start, end in self.Ranges(off):
+            result.extend(B.search(1, start, end))
+        return result
+
+    def Chunks(self, off, size):
+        # The set bits at or after off, in lists of about size positions
+        B = self._bits
+        for start, end in self.Ranges(off):
+            hits = B.search(1, start, end)
+            while True:
+                result = list(itertools.islice(hits, size))
+                if not result: break
+                yield result
+
+# Instrumentation
+# A Profile records the wall time, the allocations (from tracemalloc)
+# and the number of calls of each phase of a join,
+# plus counters of the bit-array finds, the bits set and the matches emitted.
+# The joins take profile=None: without a profile each phase is a shared null context
+# and the plain bitmap and join result are used, so nothing is counted.
+# Emitting happens during the scan, so the emit time is also part of the scan time.
+
+class Profile:
+    """Per phase timings, allocations and counters of one or more joins.
+
+    Allocations are only recorded while tracemalloc is tracing,
+    e.g. inside a with block on the profile.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.counters = collections.Counter()
+        self._started = False
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+        return self
+
+    def __exit__(self, *exc):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def _Record(self, name):
+        return self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0, 'allocated': 0, 'peak': 0})
+
+    @contextlib.contextmanager
+    def Phase(self, name):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            record = self._Record(name)
+            record['seconds'] += seconds
+            record['calls'] += 1
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                record['allocated'] += current - before
+                record['peak'] = max(record['peak'], peak - before)
+
+    def Time(self, name, seconds):
+        # Accumulate a phase that is too fine grained for Phase
+        record = self._Record(name)
+        record['seconds'] += seconds
+        record['calls'] += 1
+
+    def Count(self, name, n=1):
+        self.counters[name] += n
+
+    def Dict(self):
+        return {'phases': self.phases, 'counters': dict(self.counters)}
+
+    def Json(self, indent=None):
+        return json.dumps(self.Dict(), indent=indent)
+
+NO_PHASE = contextlib.nullcontext()
+
+def Phase(profile, name):
+    # A context that times a phase if there is a profile
+    return NO_PHASE if profile is None else profile.Phase(name)
+
+class CountingBitmap(SummaryBitmap):
+    """A SummaryBitmap that counts its finds and set bits in a profile."""
+    def __init__(self, n, profile, levels=3, buffer=None):
+        super().__init__(n, levels, buffer)
+        self._profile = profile
+
+    def Set(self, pos):
+        self._profile.counters['bits set'] += 1
+        super().Set(pos)
+
+    def Find(self, off):
+        self._profile.counters['find calls'] += 1
+        return super().Find(off)
+
+    def Search(self, off):
+        self._profile.counters['find calls'] += 1
+        return super().Search(off)
+
+def Bitmap(n, profile=None):
+    return SummaryBitmap(n) if profile is None else CountingBitmap(n, profile)
+
+class ProfiledResult:
+    """A join result wrapper that times the emits and counts the matches."""
+    def __init__(self, join_result, profile):
+        self._result = join_result
+        self._profile = profile
+
+    def __len__(self):
+        return len(self._result)
+
+    def Emit(self, l, r):
+        start = time.perf_counter()
+        self._result.Emit(l, r)
+        self._profile.Time('emit', time.perf_counter() - start)
+        self._profile.Count('matches')
+
+    def EmitBlock(self, left, right):
+        start = time.perf_counter()
+        self._result.EmitBlock(left, right)
+        self._profile.Time('emit', time.perf_counter() - start)
+        self._profile.Count('matches', len(left))
+
+def Profiled(join_result, profile=None):
+    return join_result if profile is None else ProfiledResult(join_result, profile)
+
+# Normalized keys
+# Each sort column is encoded as an order-preserving unsigned 64 bit key:
+# integers, datetimes and timedeltas flip their sign bit (NaT sorts last, as in np.sort),
+# floats flip their sign bit (or all their bits if negative)
+# and anything else is replaced by its dense rank.
+# A sequence that mixes floats with integers beyond +/-2**53 would be rounded
+# when numpy converts it to float64, so it is ranked with Python comparisons instead.
+# Descending columns invert every bit.
+# Keys are rebased to start at zero, so narrow columns can be packed
+# side by side into a single integer and sorted with one stable argsort;
+# wider combinations fall back to a stable lexsort over the columns.
+# Stability breaks ties by position, i.e. by row id.
+
+SIGN_BIT = np.uint64(1 << 63)
+EXACT_FLOAT_INT = 1 << 53
+
+def RoundsToFloat(values, A):
+    # Did converting the Python values to float64 round some integer?
+    return (A.dtype.kind == 'f' and not isinstance(values, np.ndarray)
+            and any(isinstance(value, (int, np.integer)) and not -EXACT_FLOAT_INT <= value <= EXACT_FLOAT_INT
+                    for value in values))
+
+def ExactRanks(values):
+    # Dense ranks from Python comparisons, NaNs last
+    values = list(values)
+    order = sorted(range(len(values)), key=lambda i: (values[i] != values[i], values[i]))
+    key = np.empty(len(values), dtype=np.uint64)
+    rank = 0
+    for k, i in enumerate(order):
+        if k and values[i] != values[order[k - 1]]: rank += 1
+        key[i] = rank
+    return key
+
+def NormalizedKey(values, descending=False):
+    A = np.asarray(values)
+    if RoundsToFloat(values, A):
+        key = ExactRanks(values)
+    elif A.dtype.kind == 'b':
+        key = A.astype(np.uint64)
+    elif A.dtype.kind == 'u':
+        key = A.astype(np.uint64)
+    elif A.dtype.kind == 'i':
+        key = A.astype(np.int64).view(np.uint64) ^ SIGN_BIT
+    elif A.dtype.kind in 'mM':
+        key = A.view(np.int64).view(np.uint64) ^ SIGN_BIT
+        key[np.isnat(A)] = ~np.uint64(0)
+    elif A.dtype.kind == 'f':
+        # Adding 0.0 turns -0.0 into 0.0 so the two zeros stay ties
+        bits = (A.astype(np.float64) + 0.0).view(np.uint64)
+        key = np.where(bits & SIGN_BIT, ~bits, bits | SIGN_BIT)
+    else:
+        key = np.unique(A, return_inverse=True)[1].astype(np.uint64).reshape(A.shape)
+
+    if descending: key = ~key
+    if len(key): key = key - key.min()
+    return key
+
+def SortOrder(columns, descending):
+    # The stable permutation that sorts the rows on the columns, first column first.
+    # descending is a flag per column.
+    keys = [NormalizedKey(values, desc) for values, desc in zip(columns, descending)]
+    if not keys or not len(keys[0]):
+        return np.arange(len(keys[0]) if keys else 0)
+
+    widths = [int(key.max()).bit_length() for key in keys]
+    if sum(widths) > 64:
+        return np.lexsort(keys[::-1])
+
+    packed = np.zeros(len(keys[0]), dtype=np.uint64)
+    for key, width in zip(keys, widths):
+        packed = (packed << np.uint64(width)) | key
+    return np.argsort(packed, kind='stable')
+
+def SortRows(L, cols, descending=False):
+    # Sort a list of rows in place on some of their fields, all in the same direction
+    order = SortOrder([[r[c] for r in L] for c in cols], [descending] * len(cols))
+    L[:] = [L[i] for i in order.tolist()]
+    return L
 
-# Multi-field sorting
-# From https://stackoverflow.com/questions/55866762/how-to-sort-a-list-of-strings-in-reverse-order-without-using-reverse-true-parame/55866810#55866810
 def order_by(sequence, *sort_order):
     """Sort a sequence by multiple criteria.
 
@@ -29,45 +353,67 @@ def order_by(sequence, *sort_order):
     from the input sequence, and reverse is a boolean dictating if
     this value is sorted in ascending or descending order.
 
+    Ties on every key keep their order in the sequence.
     """
-    from functools import reduce
-    return reduce(
-        lambda s, order: sorted(s, key=order[0], reverse=order[1]),
-        reversed(sort_order),
-        sequence
-    )
+    sequence = list(sequence)
+    columns = [[key(s) for s in sequence] for key, reverse in sort_order]
+    order = SortOrder(columns, [reverse for key, reverse in sort_order])
+    return [sequence[i] for i in order.tolist()]
 
 def FormatPredicate(pred):
-    return f"{pred['lhs']} {ops[pred['op']]} {pred['rhs']}"
+    if 'offset' in pred:
+        offset = pred['offset']
+        sign = '-' if offset < type(offset)() else '+'
+        return f"{pred['lhs']} {symbols[pred['op']]} {pred['rhs']} {sign} {abs(offset)}"
+    return f"{pred['lhs']} {symbols[pred['op']]} {pred['rhs']}"
 
 def FormatPredicates(preds):
     return ' AND '.join([FormatPredicate(pred) for pred in preds])
 
-def LoopJoin(left, right, preds):
-    result = []
+def LoopJoin(left, right, preds, rowids=False):
+    result = JoinResult(left, right, rowids)
 
-    for l in left:
-        for r in right:
+    for i, l in enumerate(left):
+        for k, r in enumerate(right):
             matching = True
             for p in preds:
-                if not p['op'](l[p['lhs']], r[p['rhs']]):
+                rhs = r[p['rhs']] + p['offset'] if 'offset' in p else r[p['rhs']]
+                if not p['op'](l[p['lhs']], rhs):
                     matching = False
                     break
             if matching:
-                result.append((l, r, ))
+                result.Emit(i, k)
 
     return result
 
+# Offsets
+# A predicate's 'offset' is added to its right hand side: l.X op r.Y + offset.
+# The two table joins project the right hand side as the column spec (Y, offset),
+# which the projections below add while extracting the values,
+# so the sorts, scans and cached sides all see the offset column.
+# Self-joins compare a column with itself, so they reject offsets.
+
+def Rhs(pred):
+    # The right hand side column spec of a predicate
+    return (pred['rhs'], pred['offset'],) if 'offset' in pred else pred['rhs']
+
+def NoOffsets(name, preds):
+    for pred in preds:
+        if 'offset' in pred:
+            raise ValueError(f"{name} does not support offsets: {FormatPredicate(pred)}")
+
 def ExtractColumn(table, c):
+    if isinstance(c, tuple):
+        c, offset = c
+        return [row[c] + offset for row in table]
     return [row[c] for row in table]
 
 def ArrayOf(T, cols, identifier=lambda rid: rid):
     # Project the predicate columns and a row id as tuples: (rid, X, ...)
-    L = []
-    for rid, row in enumerate(T):
-        t = [identifier(rid),]
-        t.extend([row[C] for C in cols])
-        L.append(t)
+    L = [[identifier(rid),] for rid in range(len(T))]
+    for C in cols:
+        for t, value in zip(L, ExtractColumn(T, C)):
+            t.append(value)
     return L
 
 def Mark(L):
@@ -76,6 +422,98 @@ def Mark(L):
         l.append(p)
     return L
 
+class RowPairs(list):
+    """Materialised join output: a list of (left row, right row) tuples."""
+    def __init__(self, T, Tr):
+        super().__init__()
+        self._T = T
+        self._Tr = Tr
+
+    def Emit(self, l, r):
+        self.append((self._T[l], self._Tr[r],))
+
+    def EmitBlock(self, left, right):
+        T = self._T
+        Tr = self._Tr
+        self.extend([(T[l], Tr[r],) for l, r in zip(left.tolist(), right.tolist())])
+
+    def EmitUnmatched(self, left):
+        # Outer join rows: the right row is NULL
+        T = self._T
+        self.extend([(T[l], None,) for l in left.tolist()])
+
+# The right row id of an unmatched outer join row
+NULL_ROWID = -1
+
+class RowIdPairs:
+    """Late materialised join output.
+
+    The matching left and right row ids are kept in two int64 buffers
+    instead of a tuple of row references per match.
+    Rows are only touched again by Materialize or Project.
+    """
+    def __init__(self):
+        self.left = array('q')
+        self.right = array('q')
+
+    def __len__(self):
+        return len(self.left)
+
+    def __iter__(self):
+        return zip(self.left, self.right)
+
+    def Emit(self, l, r):
+        self.left.append(l)
+        self.right.append(r)
+
+    def EmitBlock(self, left, right):
+        self.left.frombytes(np.asarray(left, dtype=np.int64).tobytes())
+        self.right.frombytes(np.asarray(right, dtype=np.int64).tobytes())
+
+    def EmitUnmatched(self, left):
+        # Outer join rows: the right row id is NULL_ROWID
+        self.left.frombytes(np.asarray(left, dtype=np.int64).tobytes())
+        self.right.extend([NULL_ROWID] * len(left))
+
+    def Arrays(self):
+        # Zero copy int64 views of the row id buffers
+        return np.frombuffer(self.left, dtype=np.int64), np.frombuffer(self.right, dtype=np.int64)
+
+    def Materialize(self, T, Tr):
+        return [(T[l], Tr[r] if r != NULL_ROWID else None,) for l, r in self]
+
+    def Mirrored(self):
+        # Lazily expand unordered pairs from a symmetric join into both orders
+        for l, r in self:
+            yield l, r
+            if l != r:
+                yield r, l
+
+    def Project(self, T, Tr, lcols=(), rcols=()):
+        # Gather only the requested columns, left columns first
+        columns = [[T[l][c] for l in self.left] for c in lcols]
+        columns.extend([[Tr[r][c] if r != NULL_ROWID else None for r in self.right] for c in rcols])
+        return columns
+
+def JoinResult(T, Tr, rowids=False):
+    # The output buffer for a join: row id pairs or materialised row pairs
+    return RowIdPairs() if rowids else RowPairs(T, Tr)
+
+def Batches(pairs, T, Tr, batch=1024, limit=None, rowids=False):
+    # Cut a lazy stream of row id pairs into join results of at most batch matches.
+    # The scan that produces the pairs is abandoned once limit matches have been emitted.
+    join_result = JoinResult(T, Tr, rowids)
+    for l, r in itertools.islice(pairs, limit):
+        join_result.Emit(l, r)
+        if len(join_result) >= batch:
+            yield join_result
+            join_result = JoinResult(T, Tr, rowids)
+
+    if len(join_result):
+        yield join_result
+
+    pairs.close()
+
 def OffsetArray(L, Lr, op):
     # The offset is the first position where the op holds
     O = [len(Lr)] * len(L)
@@ -103,7 +541,8 @@ west = (
     {'row': 's4', 't_id': 742, 'time':  90, 'cost':  5, 'cores': 4},
 )
 
-def IESingleSelf(T, pred, trace=0):
+def IESingleSelf(T, pred, trace=0, rowids=False):
+    NoOffsets('IESingleSelf', (pred,))
     op1 = pred['op']
     X = pred['lhs']
 
@@ -116,30 +555,30 @@ def IESingleSelf(T, pred, trace=0):
     # 3. if (op1 ∈ {>, ≥}) sort L1  in descending order
     # 4. else if (op1 ∈ {<, ≤}) sort L1 in ascending order
     descending1 = (op1 in (operator.gt, operator.ge,))
-    L.sort(key=lambda r: (r[1], r[0],), reverse=descending1)
+    SortRows(L, (1, 0,), descending1)
     L1 = ExtractColumn(L, 1)
     if trace: print("L1:", L1, file=sys.stderr)
 
     Li = ExtractColumn(L, 0)
 
     # 12. initialize join result as an empty list for tuple pairs
-    join_result = []
+    join_result = JoinResult(T, T, rowids)
 
-    # 15. for(i←1 to m) do
+    # 15. for(i←1 to n) do
     j = 0
-    for i in range(m):
+    for i in range(n):
         while j < n and not op1(L1[i], L1[j]): j += 1
         for k in range(j,n):
             # 22. add tuples w.r.t. (L1[i],L1[k]) to join result
-            join_result.append((T[Li[i]], T[Li[k]],))
+            join_result.Emit(Li[i], Li[k])
 
     # 23. return join result
     return join_result
 
-def IESingle(T, Tr, pred, trace=0):
+def IESinglePairs(T, Tr, pred, trace=0):
     op1 = pred['op']
     X = pred['lhs']
-    Xr = pred['rhs']
+    Xr = Rhs(pred)
 
     m = len(T)
     n = len(Tr)
@@ -155,34 +594,38 @@ def IESingle(T, Tr, pred, trace=0):
     # 3. if (op1 ∈ {>, ≥}) sort L1 , Lr1 in descending order
     # 4. else if (op1 ∈ {<, ≤}) sort L1 , Lr1 in ascending order
     descending1 = (op1 in (operator.gt, operator.ge,))
-    L.sort(key=lambda r: (r[1], r[0],), reverse=descending1)
+    SortRows(L, (1, 0,), descending1)
     L1 = ExtractColumn(L, 1)
     if trace: print("L1:", L1, file=sys.stderr)
 
-    Lr.sort(key=lambda r: (r[1], r[0],), reverse=descending1)
+    SortRows(Lr, (1, 0,), descending1)
     Lr1 = ExtractColumn(Lr, 1)
     if trace: print("L1':", Lr1, file=sys.stderr)
 
     Li = ExtractColumn(L, 0)
     Lk = ExtractColumn(Lr, 0)
 
-    # 12. initialize join result as an empty list for tuple pairs
-    join_result = []
-
     # 15. for(i←1 to m) do
     j = 0
     for i in range(m):
         while j < n and not op1(L1[i], Lr1[j]): j += 1
         for k in range(j,n):
             # 22. add tuples w.r.t. (L1[i],Lr1[k]) to join result
-            join_result.append((T[Li[i]], Tr[Lk[k]],))
+            yield Li[i], Lk[k]
 
-    # 23. return join result
+def IESingle(T, Tr, pred, trace=0, rowids=False):
+    join_result = JoinResult(T, Tr, rowids)
+    for l, r in IESinglePairs(T, Tr, pred, trace):
+        join_result.Emit(l, r)
     return join_result
 
-def IESelfJoin(T, preds, trace=0):
+def IESingleBatches(T, Tr, pred, batch=1024, limit=None, trace=0, rowids=False):
+    return Batches(IESinglePairs(T, Tr, pred, trace), T, Tr, batch, limit, rowids)
+
+def IESelfJoinPairs(T, preds, trace=0):
     # input : query Q with 2 join predicates t1.X op1 t2.X and t1.Y op2 t2.Y , table T of size n
-    # output: a list of tuple pairs (ti , tj )
+    # output: a stream of row id pairs (i, j)
+    NoOffsets('IESelfJoin', preds)
     op1 = preds[0]['op']
     X = preds[0]['lhs']
 
@@ -199,7 +642,7 @@ def IESelfJoin(T, preds, trace=0):
     # 2. if (op1 ∈ {>, ≥}) sort L1 in descending order
     # 3.  else if (op1 ∈ {<, ≤}) sort L1 in ascending order
     descending1 = (op1 in (operator.gt, operator.ge,))
-    L.sort(key=lambda r: (r[1], r[0],), reverse=descending1)
+    SortRows(L, (1, 0,), descending1)
     L1 = ExtractColumn(L, 1)
     if trace: print("L1:", L1, file=sys.stderr)
     L = Mark(L)
@@ -208,7 +651,7 @@ def IESelfJoin(T, preds, trace=0):
     # 4. if (op2 ∈ {>, ≥}) sort L2 in ascending order
     # 5.  else if (op2 ∈ {<, ≤}) sort L2 in descending order
     descending2 = (op2 in (operator.lt, operator.le,))
-    L.sort(key=lambda r: (r[2], r[0],), reverse=descending2)
+    SortRows(L, (2, 0,), descending2)
     L2 = ExtractColumn(L, 2)
     if trace: print("L2:", L2, file=sys.stderr)
     if trace: print("Li:", Li, file=sys.stderr)
@@ -218,11 +661,7 @@ def IESelfJoin(T, preds, trace=0):
     if trace: print("P:", P, file=sys.stderr)
 
     # 7. initialize bit-array B (|B| = n), and set all bits to 0
-    B = bitarray(n)
-    B.setall(False)
-
-    # 8. initialize join result as an empty list for tuple pairs
-    join_result = []
+    B = SummaryBitmap(n)
 
     # 11. for(i←1 to n) do
     off2 = 0
@@ -231,7 +670,7 @@ def IESelfJoin(T, preds, trace=0):
         # This has to come first or we will never join the first tuple.
         while off2 < n:
             if not op2(L2[i], L2[off2]): break
-            B[P[off2]] = True
+            B.Set(P[off2])
             off2 += 1
         if trace: print("B:", i, B, file=sys.stderr)
 
@@ -249,28 +688,34 @@ def IESelfJoin(T, preds, trace=0):
         # 13. for (j ← pos+eqOff to n) do
         while True:
             # 14. if B[j] = 1 then
-            j = B.find(one_bit, off1)
+            j = B.Find(off1)
             if j < 0: break
 
             # 15. add tuples w.r.t. (L1[j], L1[i]) to join result
             if trace: print("j,i':", j, i)
-            join_result.append((T[Li[pos]], T[Li[j]],))
+            yield Li[pos], Li[j]
 
             off1 = j + 1
 
-    # 17. return join result
+def IESelfJoin(T, preds, trace=0, rowids=False):
+    join_result = JoinResult(T, T, rowids)
+    for l, r in IESelfJoinPairs(T, preds, trace):
+        join_result.Emit(l, r)
     return join_result
 
-def IEJoin(T, Tr, preds, trace=0):
+def IESelfJoinBatches(T, preds, batch=1024, limit=None, trace=0, rowids=False):
+    return Batches(IESelfJoinPairs(T, preds, trace), T, T, batch, limit, rowids)
+
+def IEJoinPairs(T, Tr, preds, trace=0):
     # input : query Q with 2 join predicates t1.X op1 t2.Xr and t1.Y op2 t2.Yr, tables T, Tr of sizes m and n resp.
-    # output: a list of tuple pairs (ti , tj)
+    # output: a stream of row id pairs (i, j)
     op1 = preds[0]['op']
     X = preds[0]['lhs']
-    Xr = preds[0]['rhs']
+    Xr = Rhs(preds[0])
 
     op2 = preds[1]['op']
     Y = preds[1]['lhs']
-    Yr = preds[1]['rhs']
+    Yr = Rhs(preds[1])
 
     m = len(T)
     n = len(Tr)
@@ -286,12 +731,12 @@ def IEJoin(T, Tr, preds, trace=0):
     # 3. if (op1 ∈ {>, ≥}) sort L1 , Lr1 in descending order
     # 4. else if (op1 ∈ {<, ≤}) sort L1 , Lr1 in ascending order
     descending1 = (op1 in (operator.gt, operator.ge,))
-    L.sort(key=lambda r: (r[1], r[0],), reverse=descending1)
+    SortRows(L, (1, 0,), descending1)
     L1 = ExtractColumn(L, 1)
     if trace: print("L1:", L1, file=sys.stderr)
     L = Mark(L)
 
-    Lr.sort(key=lambda r: (r[1], r[0],), reverse=descending1)
+    SortRows(Lr, (1, 0,), descending1)
     Lr1 = ExtractColumn(Lr, 1)
     if trace: print("L1':", Lr1, file=sys.stderr)
     Lr = Mark(Lr)
@@ -299,14 +744,14 @@ def IEJoin(T, Tr, preds, trace=0):
     # 5. if (op2 ∈ {>, ≥}) sort L2 , L_2 in ascending order
     # 6. else if (op2 ∈ {<, ≤}) sort L2 , L_2 in descending order
     descending2 = (op2 in (operator.lt, operator.le,))
-    L.sort(key=lambda r: (r[2], r[0],), reverse=descending2)
+    SortRows(L, (2, 0,), descending2)
     L2 = ExtractColumn(L, 2)
     if trace: print("L2:", L2, file=sys.stderr)
 
     Li = ExtractColumn(L, 0)
     Lk = ExtractColumn(Lr, 0)
 
-    Lr.sort(key=lambda r: (r[2], r[0],), reverse=descending2)
+    SortRows(Lr, (2, 0,), descending2)
     L_2 = ExtractColumn(Lr, 2)
     if trace: print("L2':", L_2, file=sys.stderr)
 
@@ -326,11 +771,7 @@ def IEJoin(T, Tr, preds, trace=0):
     # Not needed - just scan ahead
 
     # 11. initialize bit-array Br (|Br| = n), and set all bits to 0
-    Br = bitarray(n)
-    Br.setall(False)
-
-    # 12. initialize join result as an empty list for tuple pairs
-    join_result = []
+    Br = SummaryBitmap(n)
 
     # 13. if (op1 ∈ {≤,≥} and op2 ∈ {≤,≥}) eqOff = 0
     # else eqOff = 1
@@ -344,7 +785,7 @@ def IEJoin(T, Tr, preds, trace=0):
         while off2 < n:
             if not op2(L2[i], L_2[off2]): break
             # 18. Br[Pr[j]] ← 1
-            Br[Pr[off2]] = True
+            Br.Set(Pr[off2])
             off2 += 1
         if trace: print("B':", i, Br, file=sys.stderr)
 
@@ -357,17 +798,23 @@ def IEJoin(T, Tr, preds, trace=0):
         # 20. for (k ← off1 + eqOff to n) do
         while True:
             # 21. if Br[k] = 1 then
-            k = Br.find(one_bit, off1)
+            k = Br.Find(off1)
             if k < 0: break
 
             # 22. add tuples w.r.t. (L2[i],Lr1[k]) to join result
-            join_result.append((T[Li[i]], Tr[Lk[k]],))
+            yield Li[i], Lk[k]
 
             off1 = k + 1
 
-    # 23. return join result
+def IEJoin(T, Tr, preds, trace=0, rowids=False):
+    join_result = JoinResult(T, Tr, rowids)
+    for l, r in IEJoinPairs(T, Tr, preds, trace):
+        join_result.Emit(l, r)
     return join_result
 
+def IEJoinBatches(T, Tr, preds, batch=1024, limit=None, trace=0, rowids=False):
+    return Batches(IEJoinPairs(T, Tr, preds, trace), T, Tr, batch, limit, rowids)
+
 def lower_bound(L1, pos, op1, trace=0):
     lo = 0
     hi = len(L1)
@@ -427,16 +874,16 @@ def SearchL1(L1, pos, op1, off1, trace=0):
 
     return lo
 
-def IEJoinUnion(T, Tr, preds, trace=0):
+def IEJoinUnionPairs(T, Tr, preds, trace=0):
     # input : query Q with 2 join predicates t1.X op1 t2.Xr and t1.Y op2 t2.Yr, tables T, T' of sizes m and n resp.
-    # output: a list of tuple pairs (ti , tj)
+    # output: a stream of row id pairs (i, j)
     op1 = preds[0]['op']
     X = preds[0]['lhs']
-    Xr = preds[0]['rhs']
+    Xr = Rhs(preds[0])
 
     op2 = preds[1]['op']
     Y = preds[1]['lhs']
-    Yr = preds[1]['rhs']
+    Yr = Rhs(preds[1])
 
     m = len(T)
     n = len(Tr)
@@ -481,11 +928,7 @@ def IEJoinUnion(T, Tr, preds, trace=0):
     if trace: print("P:", P, file=sys.stderr)
 
     # 7. initialize bit-array B (|B| = n), and set all bits to 0
-    B = bitarray(n)
-    B.setall(False)
-
-    # 8. initialize join result as an empty list for tuple pairs
-    join_result = []
+    B = SummaryBitmap(n)
 
     # 11. for(i←1 to n) do
     off1 = 0
@@ -504,7 +947,7 @@ def IEJoinUnion(T, Tr, preds, trace=0):
             # Filter out tuples with the same sign (they come from the same table)
             p2 = P[off2]
             if Li[p2] < 0:
-                B[p2] = True
+                B.Set(p2)
             off2 += 1
         if trace: print("B:", i, off2, B, file=sys.stderr)
 
@@ -522,145 +965,2619 @@ def IEJoinUnion(T, Tr, preds, trace=0):
         j = off1
         while True:
             # 14. if B[j] = 1 then
-            j = B.find(one_bit, j)
+            j = B.Find(j)
             if j < 0: break
 
             rid_= Li[j]
 
             # 15. add tuples w.r.t. (L1[j], L1[i]) to join result
             if trace: print("rid:", j, rid, rid_, file=sys.stderr)
-            join_result.append((T[rid-1], Tr[-rid_-1],))
+            yield rid-1, -rid_-1
 
             j = j + 1
 
+def IEJoinUnion(T, Tr, preds, trace=0, rowids=False):
+    join_result = JoinResult(T, Tr, rowids)
+    for l, r in IEJoinUnionPairs(T, Tr, preds, trace):
+        join_result.Emit(l, r)
+    return join_result
+
+def IEJoinUnionBatches(T, Tr, preds, batch=1024, limit=None, trace=0, rowids=False):
+    return Batches(IEJoinUnionPairs(T, Tr, preds, trace), T, Tr, batch, limit, rowids)
+
+# Columnar execution
+# The joins above build a Python list per row and sort them with tuple keys.
+# The columnar versions keep each projection in a typed array,
+# derive L1/L2 and the permutation arrays from argsort,
+# compute the offset arrays with searchsorted
+# and extract the matches from the bit-array a block at a time.
+
+def ColumnOf(T, C):
+    # Project a single column (or column spec) as a typed array
+    return np.array(ExtractColumn(T, C))
+
+def ArgSort(values, descending=False):
+    # Stable sort permutation: ties stay in row order in both directions
+    return SortOrder((values,), (descending,))
+
+def Permutation(order1, order2):
+    # P[i] is the position in L1 of the row at position i in L2
+    rank = np.empty_like(order1)
+    rank[order1] = np.arange(len(order1))
+    return rank[order2]
+
+def Inverse(P):
+    # Q[P[i]] = i, e.g. the position in L2 of the row at position i in L1
+    Q = np.empty_like(P)
+    Q[P] = np.arange(len(P))
+    return Q
+
+def SearchSorted(A, values, op, descending):
+    # For each value, the boundary in A between the positions
+    # where op(value, A[j]) holds and those where it does not.
+    # A must be sorted in the direction used for op.
+    if descending:
+        side = 'left' if op in (operator.gt, operator.le,) else 'right'
+        return len(A) - np.searchsorted(A[::-1], values, side=side)
+
+    side = 'right' if op in (operator.lt, operator.ge,) else 'left'
+    return np.searchsorted(A, values, side=side)
+
+class IESide:
+    """The sorted projections of one join input.
+
+    L1 (resp. L2) holds the X (resp. Y) values in op1 (resp. op2) order,
+    rid1 (resp. rid2) the row ids in that order
+    and P the permutation array of L2 w.r.t. L1.
+    """
+    def __init__(self, X, Y, descending1, descending2, profile=None, presorted=False):
+        # presorted: X is already in op1 order, ties in row order
+        with Phase(profile, 'sort 1'):
+            self.rid1 = np.arange(len(X)) if presorted else ArgSort(X, descending1)
+            self.L1 = X[self.rid1]
+
+        with Phase(profile, 'sort 2'):
+            self.rid2 = ArgSort(Y, descending2)
+            self.L2 = Y[self.rid2]
+
+        with Phase(profile, 'permutation'):
+            self.P = Permutation(self.rid1, self.rid2)
+
+    def __len__(self):
+        return len(self.rid1)
+
+    def Merge(self, other, descending1, descending2):
+        # Merge the sorted projections of other, whose row ids follow ours
+        at1 = MergePositions(self.L1, other.L1, descending1)
+        self.L1 = Merged(self.L1, other.L1, at1)
+        self.rid1 = Merged(self.rid1, other.rid1, at1)
+
+        at2 = MergePositions(self.L2, other.L2, descending2)
+        self.L2 = Merged(self.L2, other.L2, at2)
+        self.rid2 = Merged(self.rid2, other.rid2, at2)
+
+        self.P = Permutation(self.rid1, self.rid2)
+
+    def Bytes(self):
+        return self.rid1.nbytes + self.L1.nbytes + self.rid2.nbytes + self.L2.nbytes + self.P.nbytes
+
+class SideCache:
+    """An LRU cache of prepared join sides, bounded by a memory budget.
+
+    Sides are keyed on the table and the (X, Y, op1, op2) they were sorted for.
+    Tables are assumed to be append only: a side is rebuilt
+    when its table has grown since it was prepared.
+    """
+    def __init__(self, budget=1<<30):
+        self.budget = budget
+        self.used = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def Side(self, T, X, Y, op1, op2):
+        key = (id(T), X, Y, op1, op2,)
+        entry = self._entries.get(key)
+        if entry is not None:
+            table, side = entry
+            if table is T and len(side) == len(T):
+                self._entries.move_to_end(key)
+                return side
+            self._Remove(key)
+
+        descending1 = (op1 in (operator.gt, operator.ge,))
+        descending2 = (op2 in (operator.lt, operator.le,))
+        side = IESide(ColumnOf(T, X), ColumnOf(T, Y), descending1, descending2)
+
+        # Sides that could never fit are not worth evicting everything for
+        if side.Bytes() <= self.budget:
+            self._entries[key] = (T, side,)
+            self.used += side.Bytes()
+            while self.used > self.budget:
+                self._Remove(next(iter(self._entries)))
+
+        return side
+
+    def Invalidate(self, T):
+        # Drop every side prepared for T
+        for key in [key for key, (table, side) in self._entries.items() if table is T]:
+            self._Remove(key)
+
+    def _Remove(self, key):
+        table, side = self._entries.pop(key)
+        self.used -= side.Bytes()
+
+def PrepareSide(T, X, Y, op1, op2, cache=None, profile=None):
+    # Sort the X and Y projections of T for op1 and op2, reusing cached sides
+    if cache is not None:
+        return cache.Side(T, X, Y, op1, op2)
+
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+    with Phase(profile, 'projection'):
+        Xs = ColumnOf(T, X)
+        Ys = ColumnOf(T, Y)
+    return IESide(Xs, Ys, descending1, descending2, profile)
+
+def IESelfJoinColumnar(T, preds, trace=0, rowids=False, cache=None, profile=None):
+    NoOffsets('IESelfJoinColumnar', preds)
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+
+    n = len(T)
+
+    if trace: print("IESelfJoinColumnar:", n, FormatPredicates(preds))
+
+    # 1-6. sort L1 and L2 and compute the permutation array P of L2 w.r.t. L1
+    L = PrepareSide(T, X, Y, op1, op2, cache, profile)
+    if trace: print("L1:", L.L1, file=sys.stderr)
+    if trace: print("L2:", L.L2, file=sys.stderr)
+    if trace: print("P:", L.P, file=sys.stderr)
+
+    join_result = JoinResult(T, T, rowids)
+    IESelfJoinSide(L, op1, op2, Profiled(join_result, profile), trace, profile)
+    return join_result
+
+def IESelfJoinSide(L, op1, op2, join_result, trace=0, profile=None):
+    # The IESelfJoin scan over a prepared side.
+    # Matches are emitted as positions in the columns the side was built from.
+    n = len(L)
+
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+
+    with Phase(profile, 'offset array'):
+        # The first position in L1 that satisfies op1 for each L1 value
+        O1 = SearchSorted(L.L1, L.L1, op1, descending1).tolist()
+
+        # The end of the L2 prefix that satisfies op2 for each L2 value
+        O2 = SearchSorted(L.L2, L.L2, op2, descending2).tolist()
+
+    # 7. initialize bit-array B (|B| = n), and set all bits to 0
+    B = Bitmap(n, profile)
+
+    P = L.P.tolist()
+    Li = L.rid1
+
+    # 11. for(i←1 to n) do
+    with Phase(profile, 'scan'):
+        off2 = 0
+        for i in range(n):
+            # 16. B[pos] ← 1
+            for p in P[off2:O2[i]]:
+                B.Set(p)
+            off2 = max(off2, O2[i])
+
+            # 12. pos ← P[i]
+            pos = P[i]
+
+            # 13. for (j ← pos+eqOff to n) do
+            # 14. if B[j] = 1 then
+            hits = B.Search(O1[pos])
+            if hits:
+                join_result.EmitBlock(np.full(len(hits), Li[pos]), Li[hits])
+
     # 17. return join result
     return join_result
 
-class TestIEJoin(unittest.TestCase):
+def IEJoinSides(L, Lr, op1, op2, join_result, trace=0, diagonal=None, profile=None):
+    # The IEJoin scan over two prepared sides.
+    # Matches are emitted as positions in the columns the sides were built from.
+    # If L2 and L1' have the same order, diagonal restricts the scan
+    # for L2[i] to the positions k ≥ i + diagonal of L1'.
+    m = len(L)
+    n = len(Lr)
 
-    def makePairs(self, pairs):
-        return [(l['row'], r['row']) for (l,r) in pairs]
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
 
-    def expectedPairs(self, left, right, preds, trace=0):
-        expected = self.makePairs(LoopJoin(left, right, preds))
-        if trace: print("Expected:", expected)
-        return expected
+    with Phase(profile, 'offset array'):
+        # 9. compute the offset array O1 of L1 w.r.t. Lr1
+        O1 = SearchSorted(Lr.L1, L.L1, op1, descending1).tolist()
 
-    def assertJoinPairs(self, expected, actual, msg=None):
-        self.assertEqual(set(expected), set(actual), msg)
+        # 10. compute the offset array O2 of L2 w.r.t. L_2
+        # Each entry is the end of the L_2 prefix that satisfies op2
+        O2 = SearchSorted(Lr.L2, L.L2, op2, descending2).tolist()
+    if trace: print("O1:", O1, file=sys.stderr)
+    if trace: print("O2:", O2, file=sys.stderr)
 
-    def assertIEJoin(self, left, right, preds, trace=0):
-        expected = self.expectedPairs(left, right, preds, trace)
+    # 11. initialize bit-array Br (|Br| = n), and set all bits to 0
+    Br = Bitmap(n, profile)
 
-        actual = self.makePairs(IEJoin(left, right, preds, trace))
-        if trace: print("Actual (IEJoin):", actual)
-        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+    P = L.P.tolist()
+    Pr = Lr.P.tolist()
+    Li = L.rid2
+    Lk = Lr.rid1
 
-        actual = self.makePairs(IEJoinUnion(left, right, preds, trace))
-        if trace: print("Actual (IEJoinUnion):", actual)
-        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+    # 15. for(i←1 to m) do
+    with Phase(profile, 'scan'):
+        off2 = 0
+        for i in range(m):
+            # 17. for j ← O2[i-1] to O2[i] do
+            # 18. Br[Pr[j]] ← 1
+            for p in Pr[off2:O2[i]]:
+                Br.Set(p)
+            off2 = max(off2, O2[i])
 
-    def assertIESingle(self, left, right, preds, trace=0):
-        expected = self.expectedPairs(left, right, preds, trace)
+            # 19. off1 ← O1[P[i]]
+            # 20. for (k ← off1 + eqOff to n) do
+            # 21. if Br[k] = 1 then
+            off1 = O1[P[i]]
+            if diagonal is not None: off1 = max(off1, i + diagonal)
+            hits = Br.Search(off1)
+            if hits:
+                join_result.EmitBlock(np.full(len(hits), Li[i]), Lk[hits])
 
-        actual = self.makePairs(IESingle(left, right, preds[0], trace))
-        if trace: print("Actual (IESingle):", actual)
-        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+    # 23. return join result
+    return join_result
 
-    def assertIESelfJoin(self, table, preds, trace=0):
-        expected = self.expectedPairs(table, table, preds, trace)
+def IEJoinColumnar(T, Tr, preds, trace=0, rowids=False, cache=None, profile=None):
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+    Xr = Rhs(preds[0])
 
-        actual = self.makePairs(IESelfJoin(table, preds, trace))
-        if trace: print("Actual (IESelfJoin):", actual)
-        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+    Yr = Rhs(preds[1])
 
-    def assertIEJoinUnion(self, left, right, preds, trace=0):
-        expected = self.expectedPairs(left, right, preds, trace)
+    m = len(T)
+    n = len(Tr)
 
-        actual = self.makePairs(IEJoinUnion(left, right, preds, trace))
-        if trace: print("Actual (IEJoinUnion):", actual)
-        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+    if trace: print("IEJoinColumnar:", m, n, FormatPredicates(preds))
 
-    def assertEastWest(self, op1, op2, trace=0):
-        preds = (
-            {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
-            {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
-        )
-        self.assertIEJoin(east, west, preds, trace)
+    # 1-8. sort L1, L2, L1', L2' and compute the permutation arrays P and P'
+    L = PrepareSide(T, X, Y, op1, op2, cache, profile)
+    Lr = PrepareSide(Tr, Xr, Yr, op1, op2, cache, profile)
+    if trace: print("L1:", L.L1, file=sys.stderr)
+    if trace: print("L1':", Lr.L1, file=sys.stderr)
+    if trace: print("L2:", L.L2, file=sys.stderr)
+    if trace: print("L2':", Lr.L2, file=sys.stderr)
+    if trace: print("P:", L.P, file=sys.stderr)
+    if trace: print("P':", Lr.P, file=sys.stderr)
 
-    def assertWest(self, op1, op2, trace=0):
-        preds = (
-            {'op': op1, 'lhs': 'time', 'rhs': 'time'},
-            {'op': op2, 'lhs': 'cost', 'rhs': 'cost'},
-        )
-        self.assertIESelfJoin(west, preds, trace)
+    join_result = JoinResult(T, Tr, rowids)
+    IEJoinSides(L, Lr, op1, op2, Profiled(join_result, profile), trace, profile=profile)
+    return join_result
 
-        s = list(west)
-        s.sort(key=lambda r: r[preds[0]['lhs']], reverse=True)
-        self.assertIEJoin(s, s, preds, trace)
+def IEJoinUnionColumnar(T, Tr, preds, trace=0, rowids=False):
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+    Xr = Rhs(preds[0])
 
-    def test_example_1(self):
-        # Qs : SELECT s1.t id, s2.t id FROM west s1, west s2
-        # WHERE s1.time > s2.time
-        # [('s1', 's3'), ('s1', 's4'), ('s2', 's1'), ('s2', 's3'), ('s2', 's4'), ('s4', 's3')]
-        preds = ({'op': operator.gt, 'lhs': 'time', 'rhs': 'time'}, )
-        self.assertIESingle(west, west, preds)
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+    Yr = Rhs(preds[1])
 
-    def test_example_2(self):
-        # Qp : SELECT s1.t id, s2.t id FROM west s1, west s2
-        # WHERE s1.time > s2.time AND s1.cost < s2.cost
-        # [('s1', 's3'), ('s4', 's3')]
-        self.assertWest(operator.gt, operator.lt)
+    m = len(T)
+    n = len(Tr)
 
-    def test_west(self):
-        for op1 in ops:
-            for op2 in ops:
-                self.assertWest(op1, op2)
+    if trace: print("IEJoinUnionColumnar:", m, n, FormatPredicates(preds))
 
-    def test_example_3(self):
-        # Qt : SELECT east.id, west.t id FROM east, west
-        # WHERE east.dur < west.time AND east.rev > west.cost;
-        # [('r2', 's2')]
-        self.assertEastWest(operator.lt, operator.gt)
+    # 1. let L1 (resp. L2) be the array of column X (resp. Y ) over both tables
+    # Positions below m are rows of T, the rest are rows of Tr
+    X = np.concatenate((ColumnOf(T, X), ColumnOf(Tr, Xr),))
+    Y = np.concatenate((ColumnOf(T, Y), ColumnOf(Tr, Yr),))
+    n += m
 
-    def test_east_west(self):
-        for op1 in ops:
-            for op2 in ops:
-                self.assertEastWest(op1, op2)
+    # 2-6. sort L1 and L2 and compute the permutation array P of L2 w.r.t. L1
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+    L = IESide(X, Y, descending1, descending2)
+    if trace: print("L1:", L.L1, file=sys.stderr)
+    if trace: print("L2:", L.L2, file=sys.stderr)
+    if trace: print("P:", L.P, file=sys.stderr)
 
-    def test_random(self):
-        for repeat in range(100):
-            # Left table
-            m = random.randint(3,20)
-            T = []
-            id_ = 100
-            for r in range(m):
-                row = {'row': f"r{r+1}", 'id': id_}
-                row['dur'] = random.randint(50, 150)
-                row['rev'] = random.randint(3, 15)
-                row['cores'] = 2 ** random.randint(0,5)
-                T.append(row)
-                id_ += random.randint(1,3)
+    O1 = SearchSorted(L.L1, L.L1, op1, descending1).tolist()
+    O2 = SearchSorted(L.L2, L.L2, op2, descending2).tolist()
 
-            # Right table
-            n = random.randint(3, 20)
-            Tr = []
-            id_ = 400
-            for r in range(n):
-                row = {'row': f"s{r+1}", 't_id': id_}
-                row['time'] = random.randint(50, 150)
-                row['cost'] = random.randint(3, 15)
-                row['cores'] = 2 ** random.randint(0,5)
-                Tr.append(row)
-                id_ += random.randint(50, 150)
+    # 7. initialize bit-array B (|B| = n), and set all bits to 0
+    B = SummaryBitmap(n)
 
-            for op1 in ops:
-                for op2 in ops:
-                    preds = (
-                        {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
-                        {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
-                    )
-                    self.assertIEJoin(T, Tr, preds)
+    P = L.P.tolist()
+    Li = L.rid1
+    right = (Li >= m).tolist()
+
+    join_result = JoinResult(T, Tr, rowids)
+
+    # 11. for(i←1 to n) do
+    off2 = 0
+    for i in range(n):
+        # 12. pos ← P[i]
+        pos = P[i]
+        if right[pos]: continue
+
+        # 16. B[pos] ← 1
+        # Only rows from Tr go into the bit array
+        for p in P[off2:O2[i]]:
+            if right[p]:
+                B.Set(p)
+        off2 = max(off2, O2[i])
+
+        # 13. for (j ← pos+eqOff to n) do
+        # 14. if B[j] = 1 then
+        hits = B.Search(O1[pos])
+        if hits:
+            join_result.EmitBlock(np.full(len(hits), Li[pos]), Li[hits] - m)
+
+    # 17. return join result
+    return join_result
+
+# Counting
+# COUNT(*) over an IE join only needs to know how many set bits
+# lie to the right of the offset for each row, not where they are.
+# A binary indexed tree over the bit-array positions answers that
+# in O(log n) per row, regardless of the number of matches.
+
+class FenwickTree:
+    """Binary indexed tree of counts over positions [0, n)."""
+    def __init__(self, n):
+        self._tree = [0] * (n + 1)
+
+    def Add(self, pos, delta=1):
+        tree = self._tree
+        pos += 1
+        while pos < len(tree):
+            tree[pos] += delta
+            pos += pos & -pos
+
+    def Prefix(self, pos):
+        # The sum of the counts in [0, pos)
+        tree = self._tree
+        total = 0
+        while pos > 0:
+            total += tree[pos]
+            pos -= pos & -pos
+        return total
+
+def IESelfJoinCount(T, preds, per_row=False, trace=0):
+    # Returns the number of matching pairs,
+    # or the number of matches for each row of T if per_row is set.
+    NoOffsets('IESelfJoinCount', preds)
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+
+    n = len(T)
+
+    if trace: print("IESelfJoinCount:", n, FormatPredicates(preds))
+
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+    L = IESide(ColumnOf(T, X), ColumnOf(T, Y), descending1, descending2)
+
+    O1 = SearchSorted(L.L1, L.L1, op1, descending1).tolist()
+    O2 = SearchSorted(L.L2, L.L2, op2, descending2).tolist()
+
+    # The tree replaces the bit-array B
+    F = FenwickTree(n)
+
+    P = L.P.tolist()
+    Li = L.rid1.tolist()
+
+    counts = np.zeros(n, dtype=np.int64) if per_row else None
+    total = 0
+
+    off2 = 0
+    for i in range(n):
+        for p in P[off2:O2[i]]:
+            F.Add(p)
+        off2 = max(off2, O2[i])
+
+        # All off2 inserted positions, less those before the first match
+        pos = P[i]
+        c = off2 - F.Prefix(O1[pos])
+        total += c
+        if per_row: counts[Li[pos]] = c
+
+    return counts if per_row else total
+
+def IEJoinCount(T, Tr, preds, per_row=False, trace=0):
+    # Returns the number of matching pairs,
+    # or the number of matches for each row of T if per_row is set.
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+    Xr = Rhs(preds[0])
+
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+    Yr = Rhs(preds[1])
+
+    m = len(T)
+    n = len(Tr)
+
+    if trace: print("IEJoinCount:", m, n, FormatPredicates(preds))
+
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+    L = IESide(ColumnOf(T, X), ColumnOf(T, Y), descending1, descending2)
+    Lr = IESide(ColumnOf(Tr, Xr), ColumnOf(Tr, Yr), descending1, descending2)
+
+    O1 = SearchSorted(Lr.L1, L.L1, op1, descending1).tolist()
+    O2 = SearchSorted(Lr.L2, L.L2, op2, descending2).tolist()
+
+    # The tree replaces the bit-array Br
+    F = FenwickTree(n)
+
+    P = L.P.tolist()
+    Pr = Lr.P.tolist()
+    Li = L.rid2.tolist()
+
+    counts = np.zeros(m, dtype=np.int64) if per_row else None
+    total = 0
+
+    off2 = 0
+    for i in range(m):
+        for p in Pr[off2:O2[i]]:
+            F.Add(p)
+        off2 = max(off2, O2[i])
+
+        # All off2 inserted positions, less those before the first match
+        c = off2 - F.Prefix(O1[P[i]])
+        total += c
+        if per_row: counts[Li[i]] = c
+
+    return counts if per_row else total
+
+# Existence execution
+# Semi and anti joins only ask whether a left row has a match, not which ones.
+# The scan for each row stops at the first set bit past its offset
+# (a Find instead of a Search) and records the answer in a bitmap over the left rows,
+# so the cost no longer depends on the number of matching pairs.
+# Residual predicates are checked against the set bits in order until one holds.
+# A left outer join still enumerates the matches
+# and uses the bitmap to pad the rows without any with NULLs.
+
+def IEJoinMatched(T, Tr, preds, trace=0):
+    # Returns a bitarray over T, set for the rows with at least one match in Tr.
+    # The first two predicates must be inequalities; the rest are residuals.
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+    Xr = Rhs(preds[0])
+
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+    Yr = Rhs(preds[1])
+
+    m = len(T)
+    n = len(Tr)
+
+    if trace: print("IEJoinMatched:", m, n, FormatPredicates(preds))
+
+    residuals = [(pred['op'], ColumnOf(T, pred['lhs']), ColumnOf(Tr, Rhs(pred))) for pred in preds[2:]]
+
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+    L = IESide(ColumnOf(T, X), ColumnOf(T, Y), descending1, descending2)
+    Lr = IESide(ColumnOf(Tr, Xr), ColumnOf(Tr, Yr), descending1, descending2)
+
+    O1 = SearchSorted(Lr.L1, L.L1, op1, descending1).tolist()
+    O2 = SearchSorted(Lr.L2, L.L2, op2, descending2).tolist()
+
+    Br = SummaryBitmap(n)
+
+    P = L.P.tolist()
+    Pr = Lr.P.tolist()
+    Li = L.rid2.tolist()
+    Lk = Lr.rid1.tolist()
+
+    matched = bitarray(m)
+    matched.setall(False)
+
+    off2 = 0
+    for i in range(m):
+        for p in Pr[off2:O2[i]]:
+            Br.Set(p)
+        off2 = max(off2, O2[i])
+
+        # The first set bit whose row also satisfies the residuals
+        k = Br.Find(O1[P[i]])
+        l = Li[i]
+        while k >= 0 and not all(op(lhs[l], rhs[Lk[k]]) for op, lhs, rhs in residuals):
+            k = Br.Find(k + 1)
+        if k >= 0: matched[l] = True
+
+    return matched
+
+def SemiJoinResult(T, rows, rowids=False):
+    # The row ids of the selected rows of T, or the rows themselves
+    if rowids: return np.array(rows, dtype=np.int64)
+    return [T[l] for l in rows]
+
+def IEJoinSemi(T, Tr, preds, trace=0, rowids=False):
+    # The rows of T with at least one match in Tr, in row order
+    matched = IEJoinMatched(T, Tr, preds, trace)
+    return SemiJoinResult(T, list(matched.search(1)), rowids)
+
+def IEJoinAnti(T, Tr, preds, trace=0, rowids=False):
+    # The rows of T without any match in Tr, in row order
+    matched = IEJoinMatched(T, Tr, preds, trace)
+    return SemiJoinResult(T, list((~matched).search(1)), rowids)
+
+def IEJoinLeftOuter(T, Tr, preds, trace=0, rowids=False):
+    # The matching pairs, followed by the unmatched rows of T paired with NULL
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+    Xr = Rhs(preds[0])
+
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+    Yr = Rhs(preds[1])
+
+    m = len(T)
+    n = len(Tr)
+
+    if trace: print("IEJoinLeftOuter:", m, n, FormatPredicates(preds))
+
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+    L = IESide(ColumnOf(T, X), ColumnOf(T, Y), descending1, descending2)
+    Lr = IESide(ColumnOf(Tr, Xr), ColumnOf(Tr, Yr), descending1, descending2)
+    candidates = IEJoinSides(L, Lr, op1, op2, RowIdPairs(), trace)
+    left, right = ResidualFilter(T, Tr, preds[2:], *candidates.Arrays())
+
+    matched = bitarray(m)
+    matched.setall(False)
+    for l in np.unique(left).tolist():
+        matched[l] = True
+
+    join_result = JoinResult(T, Tr, rowids)
+    join_result.EmitBlock(left, right)
+    join_result.EmitUnmatched(np.array(list((~matched).search(1)), dtype=np.int64))
+    return join_result
+
+# Partitioned execution
+# The distributed IEJoin sorts both inputs on X, cuts them into blocks
+# and keeps the min/max of X and Y for each block.
+# Only the block pairs whose ranges can satisfy both predicates are joined,
+# and those pairs are spread over a process pool.
+
+class IEBlock:
+    """A block of one join input: the row ids and sorted projections
+    of a contiguous X range, with min/max summaries for pruning.
+
+    The side is prepared once, however many block pairs the block is joined in.
+    """
+    def __init__(self, rids, X, Y, op1, op2, presorted=False):
+        self.rids = rids
+        descending1 = (op1 in (operator.gt, operator.ge,))
+        descending2 = (op2 in (operator.lt, operator.le,))
+        self.side = IESide(X, Y, descending1, descending2, presorted=presorted)
+
+        self.minX = X.min()
+        self.maxX = X.max()
+        self.minY = Y.min()
+        self.maxY = Y.max()
+
+    def __len__(self):
+        return len(self.rids)
+
+def PartitionBlocks(X, Y, op1, op2, block_size):
+    # Sort on X in op1 order and cut into blocks of at most block_size rows,
+    # so the blocks' X projections are already sorted
+    order = ArgSort(X, op1 in (operator.gt, operator.ge,))
+    return [IEBlock(order[b:b+block_size], X[order[b:b+block_size]], Y[order[b:b+block_size]],
+                    op1, op2, presorted=True)
+            for b in range(0, len(order), block_size)]
+
+def MayJoin(lo, hi, lo_r, hi_r, op):
+    # Can some value in [lo, hi] satisfy op against some value in [lo_r, hi_r]?
+    if op in (operator.lt, operator.le,):
+        return op(lo, hi_r)
+    return op(hi, lo_r)
+
+def BlockPairs(blocks, blocks_r, op1, op2):
+    # The (block, block_r) positions that survive min/max pruning on both predicates
+    return [(b, b_r,)
+            for b, block in enumerate(blocks)
+            for b_r, block_r in enumerate(blocks_r)
+            if MayJoin(block.minX, block.maxX, block_r.minX, block_r.maxX, op1)
+            and MayJoin(block.minY, block.maxY, block_r.minY, block_r.maxY, op2)]
+
+def IEJoinBlock(op1, op2, block, block_r):
+    # Join one block pair and translate the matches back to row ids
+    left, right = IEJoinSides(block.side, block_r.side, op1, op2, RowIdPairs()).Arrays()
+    return block.rids[left], block_r.rids[right]
+
+# The blocks of a pool worker, sent once when it starts rather than with every pair
+worker_blocks = None
+
+def ShareBlocks(blocks, blocks_r, op1, op2):
+    global worker_blocks
+    worker_blocks = (blocks, blocks_r, op1, op2,)
+
+def IEJoinSharedBlock(b, b_r):
+    blocks, blocks_r, op1, op2 = worker_blocks
+    return IEJoinBlock(op1, op2, blocks[b], blocks_r[b_r])
+
+def JoinBlocks(blocks, blocks_r, pairs, op1, op2, join_result, workers=None):
+    # Join the block pairs, merging the results in block order.
+    # workers=None uses every core; workers=1 joins the blocks in this process
+    lefts = [b for b, b_r in pairs]
+    rights = [b_r for b, b_r in pairs]
+
+    if workers == 1:
+        for b, b_r in pairs:
+            join_result.EmitBlock(*IEJoinBlock(op1, op2, blocks[b], blocks_r[b_r]))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=ShareBlocks,
+                                 initargs=(blocks, blocks_r, op1, op2,)) as executor:
+            for left, right in executor.map(IEJoinSharedBlock, lefts, rights):
+                join_result.EmitBlock(left, right)
+
+    return join_result
+
+def IEJoinParallel(T, Tr, preds, block_size=1<<16, workers=None, trace=0, rowids=False):
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+    Xr = Rhs(preds[0])
+
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+    Yr = Rhs(preds[1])
+
+    m = len(T)
+    n = len(Tr)
+
+    if trace: print("IEJoinParallel:", m, n, FormatPredicates(preds))
+
+    blocks = PartitionBlocks(ColumnOf(T, X), ColumnOf(T, Y), op1, op2, block_size)
+    blocks_r = PartitionBlocks(ColumnOf(Tr, Xr), ColumnOf(Tr, Yr), op1, op2, block_size)
+
+    pairs = BlockPairs(blocks, blocks_r, op1, op2)
+    if trace: print("Blocks:", len(blocks), len(blocks_r), "joined:", len(pairs), file=sys.stderr)
+
+    return JoinBlocks(blocks, blocks_r, pairs, op1, op2, JoinResult(T, Tr, rowids), workers)
+
+# Hybrid execution
+# Equality predicates hash partition both inputs on their keys
+# and the inequalities are IE joined independently in each partition,
+# so the sorts and bit-arrays only ever cover one partition.
+
+def EqualityPartitions(T, cols):
+    # Hash partition the row ids of T on the values of cols
+    partitions = {}
+    keys = zip(*[ExtractColumn(T, C) for C in cols]) if cols else itertools.repeat(())
+    for rid, key in zip(range(len(T)), keys):
+        partitions.setdefault(key, []).append(rid)
+    return partitions
+
+def IEJoinHybrid(T, Tr, preds, workers=1, trace=0, rowids=False):
+    # Any number of equality predicates plus one or two inequalities.
+    # The partitions are joined in this process unless workers is not 1.
+    keys = [pred for pred in preds if pred['op'] in equalities]
+    inequalities = [pred for pred in preds if pred['op'] in ops]
+    if len(inequalities) not in (1, 2,) or len(keys) + len(inequalities) != len(preds):
+        raise ValueError(f"IEJoinHybrid needs one or two inequality predicates: {FormatPredicates(preds)}")
+
+    # A single inequality is just repeated
+    if len(inequalities) == 1:
+        inequalities *= 2
+
+    op1 = inequalities[0]['op']
+    op2 = inequalities[1]['op']
+
+    m = len(T)
+    n = len(Tr)
+
+    if trace: print("IEJoinHybrid:", m, n, FormatPredicates(preds))
+
+    partitions = EqualityPartitions(T, [pred['lhs'] for pred in keys])
+    partitions_r = EqualityPartitions(Tr, [Rhs(pred) for pred in keys])
+
+    X = ColumnOf(T, inequalities[0]['lhs'])
+    Y = ColumnOf(T, inequalities[1]['lhs'])
+    Xr = ColumnOf(Tr, Rhs(inequalities[0]))
+    Yr = ColumnOf(Tr, Rhs(inequalities[1]))
+
+    # Each matching partition pair is one block pair
+    blocks = []
+    blocks_r = []
+    for key, rids in partitions.items():
+        if key not in partitions_r: continue
+        rids = np.array(rids)
+        rids_r = np.array(partitions_r[key])
+        # Prune on the ranges before preparing the sides
+        if not (MayJoin(X[rids].min(), X[rids].max(), Xr[rids_r].min(), Xr[rids_r].max(), op1)
+                and MayJoin(Y[rids].min(), Y[rids].max(), Yr[rids_r].min(), Yr[rids_r].max(), op2)):
+            continue
+        blocks.append(IEBlock(rids, X[rids], Y[rids], op1, op2))
+        blocks_r.append(IEBlock(rids_r, Xr[rids_r], Yr[rids_r], op1, op2))
+
+    joined = [(b, b,) for b in range(len(blocks))]
+    if trace: print("Partitions:", len(partitions), len(partitions_r), "joined:", len(joined), file=sys.stderr)
+
+    return JoinBlocks(blocks, blocks_r, joined, op1, op2, JoinResult(T, Tr, rowids), workers)
+
+# N-predicate execution
+# The IEJoin core handles two inequalities.
+# With more predicates, the two most selective inequalities (estimated from a sample)
+# drive the IEJoin and the rest are applied as a vectorised filter
+# over the candidate pairs, most selective first.
+
+def SampleMasks(T, Tr, preds, sample=64):
+    # Evaluate each predicate over the cross product of a sample of each side
+    rows = [T[r] for r in random.sample(range(len(T)), min(sample, len(T)))]
+    rows_r = [Tr[r] for r in random.sample(range(len(Tr)), min(sample, len(Tr)))]
+    masks = []
+    for pred in preds:
+        lhs = ColumnOf(rows, pred['lhs'])
+        rhs = ColumnOf(rows_r, Rhs(pred))
+        masks.append(np.asarray(pred['op'](lhs[:, None], rhs[None, :]), dtype=bool).reshape(len(rows), len(rows_r)))
+    return masks
+
+def Selectivity(mask):
+    return float(np.mean(mask)) if mask.size else 0.0
+
+def Selectivities(T, Tr, preds, sample=64):
+    # Estimate the fraction of pairs that satisfy each predicate
+    return [Selectivity(mask) for mask in SampleMasks(T, Tr, preds, sample)]
+
+def ResidualFilter(T, Tr, preds, left, right):
+    # Keep the row id pairs that satisfy every predicate
+    for pred in preds:
+        if not len(left): break
+        keep = pred['op'](ColumnOf(T, pred['lhs'])[left], ColumnOf(Tr, Rhs(pred))[right])
+        left = left[keep]
+        right = right[keep]
+    return left, right
+
+def IEJoinN(T, Tr, preds, sample=64, trace=0, rowids=False):
+    m = len(T)
+    n = len(Tr)
+
+    if trace: print("IEJoinN:", m, n, FormatPredicates(preds))
+
+    # Order the predicates by estimated selectivity
+    selectivities = Selectivities(T, Tr, preds, sample)
+    order = sorted(range(len(preds)), key=lambda p: selectivities[p])
+    ordered = [preds[p] for p in order]
+    if trace: print("Selectivities:", sorted(selectivities), file=sys.stderr)
+
+    # The two most selective inequalities drive the join
+    inequalities = [pred for pred in ordered if pred['op'] in ops][:2]
+    if not inequalities:
+        raise ValueError(f"IEJoinN needs an inequality predicate: {FormatPredicates(preds)}")
+    residuals = [pred for pred in ordered if not any(pred is ie for ie in inequalities)]
+    if trace: print("IEJoin:", FormatPredicates(inequalities), "Residual:", FormatPredicates(residuals), file=sys.stderr)
+
+    # A single inequality is just repeated
+    if len(inequalities) == 1:
+        inequalities *= 2
+
+    op1 = inequalities[0]['op']
+    op2 = inequalities[1]['op']
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+    L = IESide(ColumnOf(T, inequalities[0]['lhs']), ColumnOf(T, inequalities[1]['lhs']), descending1, descending2)
+    Lr = IESide(ColumnOf(Tr, Rhs(inequalities[0])), ColumnOf(Tr, Rhs(inequalities[1])), descending1, descending2)
+    candidates = IEJoinSides(L, Lr, op1, op2, RowIdPairs(), trace)
+    if trace: print("Candidates:", len(candidates), file=sys.stderr)
+
+    join_result = JoinResult(T, Tr, rowids)
+    join_result.EmitBlock(*ResidualFilter(T, Tr, residuals, *candidates.Arrays()))
+    return join_result
+
+# Join planning
+# Rough costs (µs) of the Python implementations
+# per pair compared, per input row projected, sorted and scanned,
+# and per match emitted.
+# The nested loop wins for small probe sides; the IE joins pay for their sorts up front.
+# IEJoinUnion skips the offset array and the separate right side sorts,
+# so it wins when the left side and the output are both small.
+plan_costs = {
+    'LoopJoin': {'pair': 0.35, 'left': 0.0, 'right': 0.0, 'match': 0.3},
+    'IESingle': {'pair': 0.0, 'left': 3.0, 'right': 3.0, 'match': 1.0},
+    'IEJoin': {'pair': 0.0, 'left': 3.0, 'right': 3.0, 'match': 1.6},
+    'IEJoinUnion': {'pair': 0.0, 'left': 3.5, 'right': 2.5, 'match': 1.9},
+    'IEJoinN': {'pair': 0.0, 'left': 3.0, 'right': 3.0, 'match': 1.6},
+}
+
+def PlanCost(algorithm, m, n, matches):
+    costs = plan_costs[algorithm]
+    return costs['pair'] * m * n + costs['left'] * m + costs['right'] * n + costs['match'] * matches
+
+def PlanJoin(T, Tr, preds, sample=64):
+    # Choose the cheapest algorithm for the inputs and predicates.
+    # Returns the plan as a dict of the algorithm, the estimated output cardinality
+    # and the estimated cost of each candidate.
+    m = len(T)
+    n = len(Tr)
+
+    masks = SampleMasks(T, Tr, preds, sample)
+    estimate = m * n * Selectivity(np.logical_and.reduce(masks)) if masks else m * n
+
+    inequalities = [p for p, pred in enumerate(preds) if pred['op'] in ops]
+
+    costs = {'LoopJoin': PlanCost('LoopJoin', m, n, estimate)}
+    if len(preds) == 1 and inequalities:
+        costs['IESingle'] = PlanCost('IESingle', m, n, estimate)
+    elif len(preds) == 2 and len(inequalities) == 2:
+        costs['IEJoin'] = PlanCost('IEJoin', m, n, estimate)
+        costs['IEJoinUnion'] = PlanCost('IEJoinUnion', m, n, estimate)
+    elif inequalities:
+        # IEJoinN emits the matches of its two most selective inequalities
+        # and filters them by the rest
+        driving = sorted(inequalities, key=lambda p: Selectivity(masks[p]))[:2]
+        candidates = m * n * Selectivity(np.logical_and.reduce([masks[p] for p in driving]))
+        costs['IEJoinN'] = PlanCost('IEJoinN', m, n, candidates)
+
+    return {
+        'algorithm': min(costs, key=costs.get),
+        'estimate': estimate,
+        'costs': costs,
+    }
+
+def PlannedJoin(T, Tr, preds, sample=64, trace=0, rowids=False):
+    # Plan and run the join. Returns the join result and the plan.
+    plan = PlanJoin(T, Tr, preds, sample)
+    algorithm = plan['algorithm']
+    if trace: print("Plan:", algorithm, f"~{plan['estimate']:.0f} rows", FormatPredicates(preds), file=sys.stderr)
+
+    if algorithm == 'LoopJoin':
+        join_result = LoopJoin(T, Tr, preds, rowids)
+    elif algorithm == 'IESingle':
+        join_result = IESingle(T, Tr, preds[0], trace, rowids)
+    elif algorithm == 'IEJoin':
+        join_result = IEJoin(T, Tr, preds, trace, rowids)
+    elif algorithm == 'IEJoinUnion':
+        join_result = IEJoinUnion(T, Tr, preds, trace, rowids)
+    else:
+        join_result = IEJoinN(T, Tr, preds, sample, trace, rowids)
+
+    return join_result, plan
+
+# Run-length execution
+# With few distinct values, the sorted projections are mostly ties.
+# Keeping them as runs of equal values means the tie boundaries are looked up
+# once per distinct value, the bits are inserted once per L2 run,
+# rows with the same boundary share one scan,
+# and the bit-array has one bit per L1 run instead of one per row.
+
+class Runs:
+    """The runs of equal values in a sorted array:
+    the distinct values with the start and length of each run."""
+    def __init__(self, L):
+        n = len(L)
+        if n:
+            self.starts = np.flatnonzero(np.concatenate(([True], L[1:] != L[:-1])))
+        else:
+            self.starts = np.empty(0, dtype=np.intp)
+        self.values = L[self.starts]
+        self.lengths = np.diff(np.append(self.starts, n))
+
+        # The run containing each position
+        self.run_of = np.repeat(np.arange(len(self.starts)), self.lengths)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def RunAt(self, boundaries):
+        # The runs starting at each boundary position (len(self) past the end)
+        return np.searchsorted(self.starts, boundaries)
+
+def IEJoinRunSides(L, Lr, op1, op2, join_result, trace=0):
+    # The IEJoin scan over two prepared sides, one run at a time.
+    # Matches are emitted as positions in the columns the sides were built from.
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+
+    # The bit-array has one bit per L1' run
+    runs1 = Runs(Lr.L1)
+
+    # The bits are inserted once per L2 run
+    runs2 = Runs(L.L2)
+
+    # The first L1' run that satisfies op1 for each distinct L1 value
+    left1 = Runs(L.L1)
+    O1 = runs1.RunAt(SearchSorted(Lr.L1, left1.values, op1, descending1))[left1.run_of]
+    if trace: print("Runs:", len(left1), len(runs2), len(runs1), file=sys.stderr)
+
+    # The end of the L2' prefix that satisfies op2 for each L2 run
+    O2 = SearchSorted(Lr.L2, runs2.values, op2, descending2).tolist()
+
+    B = SummaryBitmap(len(runs1))
+    members = [[] for run in range(len(runs1))]
+
+    run_of = runs1.run_of.tolist()
+    P = L.P
+    Pr = Lr.P.tolist()
+    Li = L.rid2
+    Lk = Lr.rid1
+
+    off2 = 0
+    for r, (start, length) in enumerate(zip(runs2.starts.tolist(), runs2.lengths.tolist())):
+        for k in Pr[off2:O2[r]]:
+            run = run_of[k]
+            members[run].append(k)
+            B.Set(run)
+        off2 = max(off2, O2[r])
+
+        # Rows of the run with the same first L1' run have the same matches
+        rows = np.arange(start, start + length)
+        firsts = O1[P[rows]]
+        for first in np.unique(firsts).tolist():
+            hits = [k for run in B.Search(first) for k in members[run]]
+            if not hits: continue
+            group = Li[rows[firsts == first]]
+            join_result.EmitBlock(np.repeat(group, len(hits)), np.tile(Lk[hits], len(group)))
+
+    return join_result
+
+def IEJoinRuns(T, Tr, preds, trace=0, rowids=False, cache=None):
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+    Xr = Rhs(preds[0])
+
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+    Yr = Rhs(preds[1])
+
+    if trace: print("IEJoinRuns:", len(T), len(Tr), FormatPredicates(preds))
+
+    L = PrepareSide(T, X, Y, op1, op2, cache)
+    Lr = PrepareSide(Tr, Xr, Yr, op1, op2, cache)
+
+    return IEJoinRunSides(L, Lr, op1, op2, JoinResult(T, Tr, rowids), trace)
+
+def IESelfJoinRuns(T, preds, trace=0, rowids=False, cache=None):
+    NoOffsets('IESelfJoinRuns', preds)
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+
+    if trace: print("IESelfJoinRuns:", len(T), FormatPredicates(preds))
+
+    # A self-join is an IEJoin of the side with itself
+    L = PrepareSide(T, X, Y, op1, op2, cache)
+
+    return IEJoinRunSides(L, L, op1, op2, JoinResult(T, T, rowids), trace)
+
+# Symmetric execution
+# A self-join whose inequalities are mirror images of each other,
+# like the overlap test r.start ≤ s.end AND r.end ≥ s.start,
+# matches (s, r) whenever it matches (r, s).
+# Then L2 and L1' are the same ordering of the same column,
+# so the scan for L2[i] can stop at the diagonal and find each unordered pair once.
+# An r.C ≠ s.C exclusion can never match a row with itself,
+# so the diagonal is skipped at scan time.
+
+def IsMirrored(pred, other):
+    return (pred['lhs'] == other['rhs'] and pred['rhs'] == other['lhs']
+            and mirrors[pred['op']] == other['op'])
+
+def IESymmetricSelfJoin(T, preds, trace=0, rowids=False):
+    # Returns each matching unordered pair once, as (l, r) with l first in L2 order.
+    # Use RowIdPairs.Mirrored to expand them into ordered pairs.
+    NoOffsets('IESymmetricSelfJoin', preds)
+    inequalities = [pred for pred in preds if pred['op'] in ops]
+    residuals = [pred for pred in preds if pred['op'] not in ops]
+    if len(inequalities) != 2 or not IsMirrored(*inequalities):
+        raise ValueError(f"IESymmetricSelfJoin needs two mirrored inequalities: {FormatPredicates(preds)}")
+    for pred in residuals:
+        if not IsMirrored(pred, pred):
+            raise ValueError(f"IESymmetricSelfJoin residual is not symmetric: {FormatPredicate(pred)}")
+
+    op1 = inequalities[0]['op']
+    X = inequalities[0]['lhs']
+    Y = inequalities[0]['rhs']
+    op2 = inequalities[1]['op']
+
+    n = len(T)
+
+    if trace: print("IESymmetricSelfJoin:", n, FormatPredicates(preds))
+
+    # The right side projects (Y, X), so its L1' is the left L2
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+    Xs = ColumnOf(T, X)
+    Ys = ColumnOf(T, Y)
+    L = IESide(Xs, Ys, descending1, descending2)
+    Lr = IESide(Ys, Xs, descending1, descending2)
+
+    diagonal = 1 if any(pred['op'] in exclusions for pred in residuals) else 0
+    candidates = IEJoinSides(L, Lr, op1, op2, RowIdPairs(), trace, diagonal)
+
+    join_result = JoinResult(T, T, rowids)
+    join_result.EmitBlock(*ResidualFilter(T, T, residuals, *candidates.Arrays()))
+    return join_result
+
+# Band execution
+# A band join bounds one column by another plus constant offsets on both sides:
+#     r.X ≥ s.Y + lo AND r.X ≤ s.Y + hi
+# Predicates can carry an 'offset' added to their right hand side.
+# After a single sort of s.Y, the matches of each r are one contiguous window
+# whose ends only move forward as r.X grows, so both ends of every window
+# come from one vectorised searchsorted and the output is written as ranges.
+
+def BandPredicates(lhs, rhs, lo, hi, strict=False):
+    # Declare lhs BETWEEN rhs + lo AND rhs + hi (exclusive if strict)
+    return (
+        {'op': operator.gt if strict else operator.ge, 'lhs': lhs, 'rhs': rhs, 'offset': lo},
+        {'op': operator.lt if strict else operator.le, 'lhs': lhs, 'rhs': rhs, 'offset': hi},
+    )
+
+def BandOf(preds):
+    # The (lower, upper) predicates if preds describe a band, otherwise None
+    if len(preds) != 2: return None
+    if preds[0]['lhs'] != preds[1]['lhs'] or preds[0]['rhs'] != preds[1]['rhs']: return None
+
+    lower = [pred for pred in preds if pred['op'] in (operator.gt, operator.ge,)]
+    upper = [pred for pred in preds if pred['op'] in (operator.lt, operator.le,)]
+    if len(lower) != 1 or len(upper) != 1: return None
+
+    return lower[0], upper[0]
+
+def BandWindows(Y, X, lower, upper):
+    # The [begin, end) window of sorted Y values in the band of each X
+    lo = lower['offset'] if 'offset' in lower else 0
+    hi = upper['offset'] if 'offset' in upper else 0
+
+    # x ≤ y + hi ⇔ y ≥ x - hi; x < y + hi ⇔ y > x - hi
+    begin = np.searchsorted(Y, X - hi, side='left' if upper['op'] == operator.le else 'right')
+
+    # x ≥ y + lo ⇔ y ≤ x - lo; x > y + lo ⇔ y < x - lo
+    end = np.searchsorted(Y, X - lo, side='right' if lower['op'] == operator.ge else 'left')
+
+    return begin, np.maximum(begin, end)
+
+def ExpandWindows(begin, end):
+    # The (owner, position) pairs covered by the [begin, end) window of each owner
+    counts = np.maximum(end - begin, 0)
+    owners = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    positions = np.arange(len(owners)) - np.repeat(starts, counts) + np.repeat(begin, counts)
+    return owners, positions
+
+def BandJoin(T, Tr, preds, trace=0, rowids=False):
+    band = BandOf(preds)
+    if band is None:
+        raise ValueError(f"BandJoin needs a lower and an upper bound on the same columns: {FormatPredicates(preds)}")
+    lower, upper = band
+
+    m = len(T)
+    n = len(Tr)
+
+    if trace: print("BandJoin:", m, n, FormatPredicates(preds))
+
+    # The only sort
+    Yr = ColumnOf(Tr, lower['rhs'])
+    order = ArgSort(Yr)
+    Yr = Yr[order]
+
+    begin, end = BandWindows(Yr, ColumnOf(T, lower['lhs']), lower, upper)
+    if trace: print("Windows:", begin, end, file=sys.stderr)
+
+    left, positions = ExpandWindows(begin, end)
+
+    join_result = JoinResult(T, Tr, rowids)
+    join_result.EmitBlock(left, order[positions])
+    return join_result
+
+# External execution
+# Inputs that don't fit in memory are streamed once to project X and Y to disk.
+# The projections are sorted into runs of a budgeted size,
+# and the runs are merged into memory-mapped L1, L2 and row id arrays.
+# P, the offset arrays and the bit-array are memory-mapped files too.
+# Every pass works a block of rows at a time and drops the mapped pages it touched,
+# so the resident set stays within the budget whatever the input size.
+# (The summary of the bit-array, 1/4096 of its size, stays in memory.)
+
+def Release(A):
+    # Write back and drop the resident pages of a memory-mapped array
+    if isinstance(A, np.memmap) and A._mmap is not None:
+        A.flush()
+        A._mmap.madvise(mmap.MADV_DONTNEED)
+
+def Random(A):
+    # Random access to a memory-mapped array: no read-ahead around each fault
+    if isinstance(A, np.memmap) and A._mmap is not None:
+        A._mmap.madvise(mmap.MADV_RANDOM)
+
+def Gather(A, index, pages):
+    # A[index] for a memory-mapped A, touching at most pages pages at a time
+    Random(A)
+    result = np.empty(len(index), dtype=A.dtype)
+    for start in range(0, len(index), pages):
+        result[start:start+pages] = A[index[start:start+pages]]
+        Release(A)
+    return result
+
+def Scatter(A, index, values, pages):
+    # A[index] = values for a memory-mapped A, touching at most pages pages at a time
+    Random(A)
+    for start in range(0, len(index), pages):
+        A[index[start:start+pages]] = values[start:start+pages]
+        Release(A)
+
+class ExternalStore:
+    """A scratch directory of memory-mapped arrays.
+
+    The directory is removed with the store,
+    so results that live in it keep a reference to it.
+    """
+    def __init__(self, directory=None):
+        self._scratch = tempfile.TemporaryDirectory(dir=directory)
+        self._files = 0
+
+    def Path(self, name):
+        self._files += 1
+        return os.path.join(self._scratch.name, f"{self._files}-{name}")
+
+    def Create(self, name, dtype, n):
+        return np.lib.format.open_memmap(self.Path(name + '.npy'), mode='w+', dtype=dtype, shape=(n,))
+
+    def Remove(self, *arrays):
+        for A in arrays:
+            if isinstance(A, np.memmap) and A.filename:
+                os.remove(A.filename)
+
+class RowIdFiles:
+    """Join output spilled to a pair of int64 files.
+
+    Matches are buffered in memory up to the buffer size
+    and read back as memory-mapped arrays.
+    """
+    def __init__(self, store, buffer=1<<20):
+        self._store = store
+        self._buffer = buffer
+        self._pending = RowIdPairs()
+        self._count = 0
+        self._paths = (store.Path('left.bin'), store.Path('right.bin'),)
+        for path in self._paths:
+            open(path, 'wb').close()
+
+    def __len__(self):
+        return self._count + len(self._pending)
+
+    def __iter__(self):
+        left, right = self.Arrays()
+        for start in range(0, len(left), self._buffer):
+            yield from zip(left[start:start+self._buffer].tolist(), right[start:start+self._buffer].tolist())
+
+    def Emit(self, l, r):
+        self._pending.Emit(l, r)
+        if len(self._pending) >= self._buffer: self.Flush()
+
+    def EmitBlock(self, left, right):
+        self._pending.EmitBlock(left, right)
+        if len(self._pending) >= self._buffer: self.Flush()
+
+    def Flush(self):
+        for path, ids in zip(self._paths, (self._pending.left, self._pending.right,)):
+            with open(path, 'ab') as ids_file:
+                ids.tofile(ids_file)
+        self._count += len(self._pending)
+        self._pending = RowIdPairs()
+
+    def Arrays(self):
+        self.Flush()
+        if not self._count:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return tuple(np.memmap(path, dtype=np.int64, mode='r', shape=(self._count,)) for path in self._paths)
+
+def TypedColumn(values, dtype=None):
+    # A column that can be written to disk: datetimes become datetime64
+    A = np.array(values, dtype=dtype)
+    if A.dtype == object: A = A.astype('datetime64[us]')
+    return A
+
+def Promoted(dtype, other):
+    # A dtype that holds both without loss.
+    # Strings at least double in width, so a column is only rewritten O(log width) times.
+    result = np.result_type(dtype, other)
+    if result.kind in 'SU' and result.kind == dtype.kind and result.itemsize > dtype.itemsize:
+        width = np.dtype(result.kind + '1').itemsize
+        result = np.dtype(f"{result.kind}{max(result.itemsize, 2 * dtype.itemsize) // width}")
+    return result
+
+def Widen(store, path, dtype, promoted, n, chunk):
+    # Rewrite the n values of dtype in path as promoted, chunk values at a time
+    widened = store.Path(os.path.basename(path))
+    if n:
+        A = np.memmap(path, dtype=dtype, mode='r', shape=(n,))
+        with open(widened, 'wb') as projection:
+            for start in range(0, n, chunk):
+                A[start:start+chunk].astype(promoted).tofile(projection)
+        del A
+    os.remove(path)
+    return widened
+
+def ExternalProjection(store, T, cols, chunk, dtypes=None):
+    # Stream the rows of T once, appending each column of cols to its own file.
+    # Columns without an explicit dtype take the first chunk's dtype
+    # and are widened (rewriting what was already written) when a later chunk needs more,
+    # e.g. longer strings or floats after integers.
+    # Offsets are added after parsing, as text values only parse to a dtype
+    specs = [C if isinstance(C, tuple) else (C, None,) for C in cols]
+    paths = [store.Path(f"{C}.bin") for C, offset in specs]
+    files = [open(path, 'wb') for path in paths]
+    fixed = [dtypes.get(C) if dtypes else None for C, offset in specs]
+    types = [None] * len(cols)
+
+    n = 0
+    rows = iter(T)
+    while True:
+        block = list(itertools.islice(rows, chunk))
+        if not block: break
+        for c, (C, offset) in enumerate(specs):
+            A = TypedColumn([row[C] for row in block], fixed[c])
+            if offset is not None: A = A + offset
+            if types[c] is None:
+                types[c] = A.dtype
+            elif A.dtype != types[c]:
+                promoted = Promoted(types[c], A.dtype)
+                if promoted != types[c]:
+                    files[c].close()
+                    paths[c] = Widen(store, paths[c], types[c], promoted, n, chunk)
+                    files[c] = open(paths[c], 'ab')
+                    types[c] = promoted
+                A = A.astype(types[c])
+            A.tofile(files[c])
+        n += len(block)
+
+    for projection in files:
+        projection.close()
+
+    return n, [np.memmap(path, dtype=dtype or np.int64, mode='r', shape=(n,)) if n else np.empty(0)
+               for path, dtype in zip(paths, types)]
+
+def Precedes(values, rids, value, rid, descending):
+    # Which (value, rid) come no later than (value, rid) in the merge order
+    before = (values > value) if descending else (values < value)
+    return before | ((values == value) & (rids <= rid))
+
+def ExternalSort(store, name, values, descending, run_rows, block):
+    # Sort a memory-mapped column into (sorted values, row ids), ties in row order.
+    # Runs of run_rows rows are sorted in memory,
+    # then merged from a head of each run at a time: everything up to the earliest
+    # last element of the heads can be written out.
+    # Half the block is shared evenly between the heads, so no head is so short that it
+    # holds the cut back, and the other half in proportion to what each run emitted last time,
+    # so a run that dominates the merge, as in presorted input, is emitted a block at a time.
+    n = len(values)
+    runs = store.Create(name + '-runs', values.dtype, n)
+    run_rids = store.Create(name + '-run-rids', np.int64, n)
+    bounds = []
+    for start in range(0, n, run_rows):
+        stop = min(start + run_rows, n)
+        order = ArgSort(np.asarray(values[start:stop]), descending)
+        runs[start:stop] = values[start:stop][order]
+        run_rids[start:stop] = order + start
+        bounds.append((start, stop,))
+        Release(runs)
+        Release(run_rids)
+    Release(values)
+
+    L = store.Create(name, values.dtype, n)
+    rids = store.Create(name + '-rids', np.int64, n)
+    heads = {r: max(1, block // max(1, len(bounds))) for r in range(len(bounds))}
+    cursors = [start for start, stop in bounds]
+    out = 0
+    while out < n:
+        blocks = {r: (runs[cursors[r]:min(cursors[r] + size, bounds[r][1])],
+                      run_rids[cursors[r]:min(cursors[r] + size, bounds[r][1])],) for r, size in heads.items()}
+
+        # The earliest last element of the heads
+        cut = next(iter(blocks))
+        cut_value, cut_rid = blocks[cut][0][-1], blocks[cut][1][-1]
+        for r, (head_values, head_rids) in blocks.items():
+            if Precedes(head_values[-1:], head_rids[-1:], cut_value, cut_rid, descending)[0]:
+                cut, cut_value, cut_rid = r, head_values[-1], head_rids[-1]
+
+        merged_values = []
+        merged_rids = []
+        emitted = {}
+        for r, (head_values, head_rids) in blocks.items():
+            taken = int(Precedes(head_values, head_rids, cut_value, cut_rid, descending).sum())
+            merged_values.append(head_values[:taken])
+            merged_rids.append(head_rids[:taken])
+            cursors[r] += taken
+            if cursors[r] < bounds[r][1]: emitted[r] = taken
+
+        # Size the next heads from this pass
+        if emitted:
+            even = max(1, block // (2 * len(emitted)))
+            total = max(1, sum(emitted.values()))
+            heads = {r: even + (block // 2) * taken // total for r, taken in emitted.items()}
+        else:
+            heads = {}
+
+        merged_values = np.concatenate(merged_values)
+        merged_rids = np.concatenate(merged_rids)
+        order = np.argsort(merged_rids, kind='stable')
+        order = order[ArgSort(merged_values[order], descending)]
+        L[out:out+len(order)] = merged_values[order]
+        rids[out:out+len(order)] = merged_rids[order]
+        out += len(order)
+        Release(L)
+        Release(rids)
+        Release(runs)
+        Release(run_rids)
+
+    store.Remove(runs, run_rids)
+    return L, rids
+
+class ExternalSide:
+    """The sorted projections of one join input in memory-mapped files.
+
+    The fields match IESide: L1, rid1, L2, rid2 and P.
+    """
+    def __init__(self, store, X, Y, descending1, descending2, run_rows, block, pages):
+        n = len(X)
+        self.L1, self.rid1 = ExternalSort(store, 'L1', X, descending1, run_rows, block)
+        self.L2, self.rid2 = ExternalSort(store, 'L2', Y, descending2, run_rows, block)
+
+        # P[i] is the position in L1 of the row at position i in L2.
+        # The row ids are random, so the rank array is accessed a few pages at a time.
+        rank = store.Create('rank', np.int64, n)
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            Scatter(rank, np.asarray(self.rid1[start:stop]), np.arange(start, stop), pages)
+            Release(self.rid1)
+
+        self.P = store.Create('P', np.int64, n)
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            self.P[start:stop] = Gather(rank, np.asarray(self.rid2[start:stop]), pages)
+            Release(self.P)
+            Release(self.rid2)
+        store.Remove(rank)
+
+    def __len__(self):
+        return len(self.rid1)
+
+def ExternalOffsets(store, name, A, values, op, descending, block):
+    # SearchSorted of a memory-mapped column, a block at a time
+    O = store.Create(name, np.int64, len(values))
+    for start in range(0, len(values), block):
+        O[start:start+block] = SearchSorted(A, np.asarray(values[start:start+block]), op, descending)
+        Release(O)
+        Release(A)
+        Release(values)
+    return O
+
+def IEJoinExternal(T, Tr, preds, budget=1<<28, directory=None, dtypes=None, trace=0):
+    # T and Tr are iterables of rows (e.g. csv.DictReader); each is read once.
+    # dtypes optionally maps column names to numpy dtypes for parsing text values.
+    # The matches are returned as row ids in a RowIdFiles.
+    op1 = preds[0]['op']
+    X = preds[0]['lhs']
+    Xr = Rhs(preds[0])
+
+    op2 = preds[1]['op']
+    Y = preds[1]['lhs']
+    Yr = Rhs(preds[1])
+
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+
+    # Rows are large while they are Python objects;
+    # sorted runs need a value, a row id and their sort temporaries per row;
+    # random accesses to a mapped file can touch a page per row.
+    chunk = max(1, budget // 1024)
+    run_rows = max(1, budget // 64)
+    block = max(64, budget // 64)
+    pages = max(64, budget // mmap.PAGESIZE)
+
+    store = ExternalStore(directory)
+
+    # 1-8. sort L1, L2, L1', L2' and compute the permutation arrays P and P'
+    m, (X, Y) = ExternalProjection(store, T, (X, Y,), chunk, dtypes)
+    n, (Xr, Yr) = ExternalProjection(store, Tr, (Xr, Yr,), chunk, dtypes)
+    if trace: print("IEJoinExternal:", m, n, FormatPredicates(preds), store.Path(''), file=sys.stderr)
+
+    join_result = RowIdFiles(store, block)
+    if not m or not n: return join_result
+
+    L = ExternalSide(store, X, Y, descending1, descending2, run_rows, block, pages)
+    Lr = ExternalSide(store, Xr, Yr, descending1, descending2, run_rows, block, pages)
+    store.Remove(X, Y, Xr, Yr)
+    del X, Y, Xr, Yr
+
+    # 9. compute the offset array O1 of L1 w.r.t. Lr1
+    O1 = ExternalOffsets(store, 'O1', Lr.L1, L.L1, op1, descending1, block)
+
+    # 10. compute the offset array O2 of L2 w.r.t. L_2
+    O2 = ExternalOffsets(store, 'O2', Lr.L2, L.L2, op2, descending2, block)
+
+    # Only the row ids and permutations are scanned
+    store.Remove(L.L1, L.L2, Lr.L1, Lr.L2)
+    del L.L1, L.L2, Lr.L1, Lr.L2
+
+    # 11. initialize bit-array Br (|Br| = n), and set all bits to 0
+    path = store.Path('Br.bits')
+    with open(path, 'wb') as bits:
+        bits.truncate((n + 7) // 8)
+    with open(path, 'r+b') as bits:
+        buffer = mmap.mmap(bits.fileno(), 0)
+    Br = SummaryBitmap(n, buffer=buffer)
+
+    # 15. for(i←1 to m) do
+    # (a chunk at a time, as the scan works with Python lists)
+    off2 = 0
+    for start in range(0, m, chunk):
+        stop = min(start + chunk, m)
+        O2b = O2[start:stop].tolist()
+        O1b = Gather(O1, np.asarray(L.P[start:stop]), pages).tolist()
+        Li = L.rid2[start:stop].tolist()
+        for i in range(stop - start):
+            # 17. for j ← O2[i-1] to O2[i] do
+            # 18. Br[Pr[j]] ← 1
+            while off2 < O2b[i]:
+                end = min(O2b[i], off2 + chunk)
+                for p in Lr.P[off2:end].tolist():
+                    Br.Set(p)
+                off2 = end
+
+            # 19. off1 ← O1[P[i]]
+            # 20. for (k ← off1 + eqOff to n) do
+            # 21. if Br[k] = 1 then
+            for hits in Br.Chunks(O1b[i], chunk):
+                join_result.EmitBlock(np.full(len(hits), Li[i]), Gather(Lr.rid1, hits, pages))
+
+        for A in (O1, O2, L.P, L.rid2, Lr.P, Lr.rid1,):
+            Release(A)
+        buffer.madvise(mmap.MADV_DONTNEED)
+
+    # 23. return join result
+    return join_result
+
+# Incremental execution
+# An append-only table keeps the sorted side of the rows it has already joined.
+# A refresh only sorts the appended rows and joins them three ways:
+# new × new with the self-join scan, new × old against the kept side,
+# and old × new against the kept side read backwards,
+# since o.X op1 d.X ⇔ d.X mirrors[op1] o.X reverses the sort orders.
+# An old row can only match if it is in the op1 suffix of L1' from the smallest offset
+# and in the op2 prefix of L2' up to the largest one.
+# The scans fill the bit-array from whichever of the two is shorter,
+# only set the bits of the old rows in both, and size the bit-array to that range.
+# So a refresh costs O(d log n) searches, vectorised O(n) copies
+# (the merge of the new rows into the kept side and its permutation arrays),
+# and Python work proportional to the reachable old rows and the new matches.
+
+class ReversedSide:
+    """An IESide read backwards, i.e. sorted for the mirrored predicates."""
+    def __init__(self, side):
+        n = len(side)
+        self.L1 = side.L1[::-1]
+        self.rid1 = side.rid1[::-1]
+        self.L2 = side.L2[::-1]
+        self.rid2 = side.rid2[::-1]
+        self.P = (n - 1) - side.P[::-1]
+
+    def __len__(self):
+        return len(self.rid1)
+
+def MergePositions(A, B, descending):
+    # The positions of the sorted B in the merge of A and B,
+    # with B after any equal values of A to keep ties in row order
+    op = operator.le if descending else operator.ge
+    return SearchSorted(A, B, op, descending) + np.arange(len(B))
+
+def Merged(A, B, at):
+    # Merge B into A at the positions from MergePositions
+    result = np.empty(len(A) + len(B), dtype=np.result_type(A, B))
+    old = np.ones(len(result), dtype=bool)
+    old[at] = False
+    result[at] = B
+    result[old] = A
+    return result
+
+def IEJoinDelta(L, Lr, op1, op2, join_result, mirrored=False, trace=0):
+    # The IEJoin scan of a small side L against a large prepared side Lr.
+    # Mirrored emits the matches as (Lr row, L row).
+    m = len(L)
+    n = len(Lr)
+    if not m or not n: return join_result
+
+    descending1 = (op1 in (operator.gt, operator.ge,))
+    descending2 = (op2 in (operator.lt, operator.le,))
+
+    # 9. compute the offset array O1 of L1 w.r.t. Lr1
+    O1 = SearchSorted(Lr.L1, L.L1, op1, descending1)
+    if trace: print("O1:", O1, file=sys.stderr)
+
+    # 10. compute the offset array O2 of L2 w.r.t. L_2
+    O2 = SearchSorted(Lr.L2, L.L2, op2, descending2)
+    if trace: print("O2:", O2, file=sys.stderr)
+
+    # Only Lr1[lo:] and Lr2[:hi] can match
+    lo = int(O1.min())
+    hi = int(O2.max())
+    if lo >= n or hi <= 0: return join_result
+
+    if n - lo < hi:
+        IEJoinDeltaSuffix(L, Lr, O1.tolist(), O2.tolist(), lo, hi, join_result, mirrored)
+    else:
+        IEJoinDeltaPrefix(L, Lr, O1.tolist(), O2.tolist(), lo, hi, join_result, mirrored)
+
+    # 23. return join result
+    return join_result
+
+def EmitDelta(join_result, l, right, mirrored):
+    left = np.full(len(right), l)
+    if mirrored:
+        join_result.EmitBlock(right, left)
+    else:
+        join_result.EmitBlock(left, right)
+
+def IEJoinDeltaPrefix(L, Lr, O1, O2, lo, hi, join_result, mirrored):
+    # The IEJoin scan: walk L in L2 order, setting the bits of the growing op2 prefix of Lr2.
+    # Bit k is position lo + k of Lr1.
+    Br = SummaryBitmap(len(Lr) - lo)
+
+    P = L.P.tolist()
+    Pr = Lr.P
+    Li = L.rid2
+    Lk = Lr.rid1[lo:]
+
+    # 15. for(i←1 to m) do
+    off2 = 0
+    for i in range(len(L)):
+        # 17. for j ← O2[i-1] to O2[i] do
+        # 18. Br[Pr[j]] ← 1
+        if O2[i] > off2:
+            ps = Pr[off2:O2[i]]
+            for p in (ps[ps >= lo] - lo).tolist():
+                Br.Set(p)
+            off2 = O2[i]
+
+        # 19. off1 ← O1[P[i]]
+        # 20. for (k ← off1 + eqOff to n) do
+        # 21. if Br[k] = 1 then
+        hits = Br.Search(O1[P[i]] - lo)
+        if hits:
+            EmitDelta(join_result, Li[i], Lk[hits], mirrored)
+
+def IEJoinDeltaSuffix(L, Lr, O1, O2, lo, hi, join_result, mirrored):
+    # The scan with the predicates' roles swapped: walk L in reverse L1 order,
+    # setting the bits of the growing op1 suffix of Lr1 by their Lr2 positions.
+    # Bit k is position hi - 1 - k of Lr2, so the op2 prefixes become suffixes of the bits.
+    Br = SummaryBitmap(hi)
+
+    Q = Inverse(L.P).tolist()
+    Qr = Inverse(Lr.P)
+    Li = L.rid1
+    Lk = Lr.rid2[:hi][::-1]
+
+    off1 = len(Lr)
+    for i in range(len(L) - 1, -1, -1):
+        if O1[i] < off1:
+            qs = Qr[O1[i]:off1]
+            for q in (hi - 1 - qs[qs < hi]).tolist():
+                Br.Set(q)
+            off1 = O1[i]
+
+        hits = Br.Search(hi - O2[Q[i]])
+        if hits:
+            EmitDelta(join_result, Li[i], Lk[hits], mirrored)
+
+class IncrementalSelfJoin:
+    """An IESelfJoin over an append-only table, maintained across refreshes.
+
+    The sorted side of the rows joined so far is kept between calls.
+    Each Refresh joins the rows appended since the previous one
+    and returns only the matches that involve them.
+    """
+    def __init__(self, preds, trace=0):
+        NoOffsets('IncrementalSelfJoin', preds)
+        self.preds = preds
+        self.trace = trace
+        self.side = None
+
+    def __len__(self):
+        return 0 if self.side is None else len(self.side)
+
+    def Refresh(self, T, rowids=False):
+        op1 = self.preds[0]['op']
+        X = self.preds[0]['lhs']
+
+        op2 = self.preds[1]['op']
+        Y = self.preds[1]['lhs']
+
+        n = len(self)
+        d = len(T) - n
+        trace = self.trace
+
+        if d < 0:
+            raise ValueError(f"IncrementalSelfJoin: table shrank from {n} to {len(T)} rows")
+
+        if trace: print("IncrementalSelfJoin:", n, d, FormatPredicates(self.preds))
+
+        join_result = JoinResult(T, T, rowids)
+        if not d: return join_result
+
+        # 1-6. sort the new rows, numbered after the old ones
+        descending1 = (op1 in (operator.gt, operator.ge,))
+        descending2 = (op2 in (operator.lt, operator.le,))
+        delta = T[n:]
+        D = IESide(ColumnOf(delta, X), ColumnOf(delta, Y), descending1, descending2)
+        D.rid1 += n
+        D.rid2 += n
+
+        # new × new
+        IESelfJoinSide(D, op1, op2, join_result, trace)
+
+        if self.side is None:
+            self.side = D
+            return join_result
+
+        # new × old
+        IEJoinDelta(D, self.side, op1, op2, join_result, trace=trace)
+
+        # old × new
+        IEJoinDelta(ReversedSide(D), ReversedSide(self.side), mirrors[op1], mirrors[op2],
+                    join_result, mirrored=True, trace=trace)
+
+        self.side.Merge(D, descending1, descending2)
+
+        return join_result
+
+class TestIEJoin(unittest.TestCase):
+
+    def makePairs(self, pairs):
+        return [(l['row'], r['row']) for (l,r) in pairs]
+
+    def expectedPairs(self, left, right, preds, trace=0):
+        expected = self.makePairs(LoopJoin(left, right, preds))
+        if trace: print("Expected:", expected)
+        return expected
+
+    def assertJoinPairs(self, expected, actual, msg=None):
+        self.assertEqual(set(expected), set(actual), msg)
+
+    def assertIEJoin(self, left, right, preds, trace=0):
+        expected = self.expectedPairs(left, right, preds, trace)
+
+        actual = self.makePairs(IEJoin(left, right, preds, trace))
+        if trace: print("Actual (IEJoin):", actual)
+        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+        actual = self.makePairs(IEJoinUnion(left, right, preds, trace))
+        if trace: print("Actual (IEJoinUnion):", actual)
+        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+        actual = self.makePairs(IEJoinColumnar(left, right, preds, trace))
+        if trace: print("Actual (IEJoinColumnar):", actual)
+        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+        actual = self.makePairs(IEJoinUnionColumnar(left, right, preds, trace))
+        if trace: print("Actual (IEJoinUnionColumnar):", actual)
+        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+    def assertIESingle(self, left, right, preds, trace=0):
+        expected = self.expectedPairs(left, right, preds, trace)
+
+        actual = self.makePairs(IESingle(left, right, preds[0], trace))
+        if trace: print("Actual (IESingle):", actual)
+        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+    def assertIESelfJoin(self, table, preds, trace=0):
+        expected = self.expectedPairs(table, table, preds, trace)
+
+        actual = self.makePairs(IESelfJoin(table, preds, trace))
+        if trace: print("Actual (IESelfJoin):", actual)
+        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+        actual = self.makePairs(IESelfJoinColumnar(table, preds, trace))
+        if trace: print("Actual (IESelfJoinColumnar):", actual)
+        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+    def assertIEJoinUnion(self, left, right, preds, trace=0):
+        expected = self.expectedPairs(left, right, preds, trace)
+
+        actual = self.makePairs(IEJoinUnion(left, right, preds, trace))
+        if trace: print("Actual (IEJoinUnion):", actual)
+        self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+    def assertRowIds(self, left, right, expected, actual, msg=None):
+        self.assertIsInstance(actual, RowIdPairs)
+        self.assertEqual(len(expected), len(actual), msg)
+        self.assertJoinPairs(expected, self.makePairs(actual.Materialize(left, right)), msg)
+
+    def assertExistence(self, left, right, preds, trace=0):
+        pairs = LoopJoin(left, right, preds, rowids=True)
+        hits = sorted(set(pairs.left))
+        misses = sorted(set(range(len(left))) - set(hits))
+        msg = FormatPredicates(preds)
+
+        self.assertEqual(hits, IEJoinSemi(left, right, preds, trace, rowids=True).tolist(), msg)
+        self.assertEqual([left[l]['row'] for l in hits], [l['row'] for l in IEJoinSemi(left, right, preds, trace)], msg)
+        self.assertEqual(misses, IEJoinAnti(left, right, preds, trace, rowids=True).tolist(), msg)
+
+        expected = set(pairs) | {(l, NULL_ROWID) for l in misses}
+        actual = IEJoinLeftOuter(left, right, preds, trace, rowids=True)
+        self.assertEqual(len(expected), len(actual), msg)
+        self.assertEqual(expected, set(actual), msg)
+
+        expected = self.makePairs(LoopJoin(left, right, preds)) + [(left[l]['row'], None) for l in misses]
+        actual = [(l['row'], r and r['row']) for l, r in IEJoinLeftOuter(left, right, preds, trace)]
+        self.assertJoinPairs(expected, actual, msg)
+
+    def assertEastWest(self, op1, op2, trace=0):
+        preds = (
+            {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+            {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+        )
+        self.assertIEJoin(east, west, preds, trace)
+
+    def assertWest(self, op1, op2, trace=0):
+        preds = (
+            {'op': op1, 'lhs': 'time', 'rhs': 'time'},
+            {'op': op2, 'lhs': 'cost', 'rhs': 'cost'},
+        )
+        self.assertIESelfJoin(west, preds, trace)
+
+        s = list(west)
+        s.sort(key=lambda r: r[preds[0]['lhs']], reverse=True)
+        self.assertIEJoin(s, s, preds, trace)
+
+    def test_example_1(self):
+        # Qs : SELECT s1.t id, s2.t id FROM west s1, west s2
+        # WHERE s1.time > s2.time
+        # [('s1', 's3'), ('s1', 's4'), ('s2', 's1'), ('s2', 's3'), ('s2', 's4'), ('s4', 's3')]
+        preds = ({'op': operator.gt, 'lhs': 'time', 'rhs': 'time'}, )
+        self.assertIESingle(west, west, preds)
+
+    def test_example_2(self):
+        # Qp : SELECT s1.t id, s2.t id FROM west s1, west s2
+        # WHERE s1.time > s2.time AND s1.cost < s2.cost
+        # [('s1', 's3'), ('s4', 's3')]
+        self.assertWest(operator.gt, operator.lt)
+
+    def test_west(self):
+        for op1 in ops:
+            for op2 in ops:
+                self.assertWest(op1, op2)
+
+    def test_example_3(self):
+        # Qt : SELECT east.id, west.t id FROM east, west
+        # WHERE east.dur < west.time AND east.rev > west.cost;
+        # [('r2', 's2')]
+        self.assertEastWest(operator.lt, operator.gt)
+
+    def test_east_west(self):
+        for op1 in ops:
+            for op2 in ops:
+                self.assertEastWest(op1, op2)
+
+    def test_rowids(self):
+        for op1 in ops:
+            preds = ({'op': op1, 'lhs': 'time', 'rhs': 'time'}, )
+            expected = self.expectedPairs(west, west, preds)
+            self.assertRowIds(west, west, expected, IESingle(west, west, preds[0], rowids=True))
+            self.assertRowIds(west, west, expected, IESingleSelf(west, preds[0], rowids=True))
+
+            for op2 in ops:
+                preds = (
+                    {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                )
+                expected = self.expectedPairs(east, west, preds)
+                for join in (IEJoin, IEJoinUnion, IEJoinColumnar, IEJoinUnionColumnar):
+                    actual = join(east, west, preds, rowids=True)
+                    self.assertRowIds(east, west, expected, actual, FormatPredicates(preds))
+
+                preds = (
+                    {'op': op1, 'lhs': 'time', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'cost', 'rhs': 'cost'},
+                )
+                expected = self.expectedPairs(west, west, preds)
+                for join in (IESelfJoin, IESelfJoinColumnar):
+                    actual = join(west, preds, rowids=True)
+                    self.assertRowIds(west, west, expected, actual, FormatPredicates(preds))
+
+    def test_project(self):
+        # Qt : SELECT east.id, west.t id FROM east, west
+        # WHERE east.dur < west.time AND east.rev > west.cost;
+        preds = (
+            {'op': operator.lt, 'lhs': 'dur', 'rhs': 'time'},
+            {'op': operator.gt, 'lhs': 'rev', 'rhs': 'cost'},
+        )
+        for join in (IEJoin, IEJoinUnion, IEJoinColumnar, IEJoinUnionColumnar):
+            actual = join(east, west, preds, rowids=True)
+            self.assertEqual([[101], [498]], actual.Project(east, west, ('id',), ('t_id',)))
+
+            left, right = actual.Arrays()
+            self.assertEqual([1], left.tolist())
+            self.assertEqual([1], right.tolist())
+
+    def assertBatches(self, left, right, expected, batches, batch, limit=None, msg=None):
+        actual = []
+        for join_result in batches:
+            self.assertLessEqual(len(join_result), batch, msg)
+            self.assertGreater(len(join_result), 0, msg)
+            actual.extend(self.makePairs(join_result))
+
+        if limit is None:
+            self.assertJoinPairs(expected, actual, msg)
+        else:
+            self.assertEqual(min(limit, len(expected)), len(actual), msg)
+            self.assertTrue(set(actual) <= set(expected), msg)
+
+    def test_batches(self):
+        for op1 in ops:
+            preds = ({'op': op1, 'lhs': 'time', 'rhs': 'time'}, )
+            expected = self.expectedPairs(west, west, preds)
+            for batch, limit in ((1, None), (2, 3), (1024, 1),):
+                batches = IESingleBatches(west, west, preds[0], batch, limit)
+                self.assertBatches(west, west, expected, batches, batch, limit)
+
+            for op2 in ops:
+                preds = (
+                    {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                )
+                msg = FormatPredicates(preds)
+                expected = self.expectedPairs(east, west, preds)
+                for batch, limit in ((1, None), (2, 3), (1024, 1),):
+                    batches = IEJoinBatches(east, west, preds, batch, limit)
+                    self.assertBatches(east, west, expected, batches, batch, limit, msg)
+                    batches = IEJoinUnionBatches(east, west, preds, batch, limit)
+                    self.assertBatches(east, west, expected, batches, batch, limit, msg)
+
+                preds = (
+                    {'op': op1, 'lhs': 'time', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'cost', 'rhs': 'cost'},
+                )
+                msg = FormatPredicates(preds)
+                expected = self.expectedPairs(west, west, preds)
+                for batch, limit in ((1, None), (2, 3), (1024, 1),):
+                    batches = IESelfJoinBatches(west, preds, batch, limit)
+                    self.assertBatches(west, west, expected, batches, batch, limit, msg)
+
+    def test_batches_rowids(self):
+        preds = (
+            {'op': operator.lt, 'lhs': 'dur', 'rhs': 'time'},
+            {'op': operator.gt, 'lhs': 'rev', 'rhs': 'cost'},
+        )
+        batches = list(IEJoinBatches(east, west, preds, rowids=True))
+        self.assertEqual(1, len(batches))
+        self.assertRowIds(east, west, [('r2', 's2')], batches[0])
+
+    def assertCounts(self, left, expected, total, counts, msg=None):
+        self.assertEqual(len(expected), total, msg)
+        rows = [row['row'] for row in left]
+        expected = [sum(1 for l, r in expected if l == row) for row in rows]
+        self.assertEqual(expected, counts.tolist(), msg)
+
+    def test_count(self):
+        for op1 in ops:
+            for op2 in ops:
+                preds = (
+                    {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                )
+                expected = self.expectedPairs(east, west, preds)
+                total = IEJoinCount(east, west, preds)
+                counts = IEJoinCount(east, west, preds, per_row=True)
+                self.assertCounts(east, expected, total, counts, FormatPredicates(preds))
+
+                preds = (
+                    {'op': op1, 'lhs': 'time', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'cost', 'rhs': 'cost'},
+                )
+                expected = self.expectedPairs(west, west, preds)
+                total = IESelfJoinCount(west, preds)
+                counts = IESelfJoinCount(west, preds, per_row=True)
+                self.assertCounts(west, expected, total, counts, FormatPredicates(preds))
+
+    def test_random_count(self):
+        # Few distinct values, so the Fenwick prefixes are mostly ties
+        for repeat in range(20):
+            T = [{'row': f"r{r+1}", 'x': random.randint(0, 4), 'y': random.randint(0, 4)}
+                 for r in range(random.randint(1, 60))]
+            Tr = [{'row': f"s{r+1}", 'x': random.randint(0, 4), 'y': random.randint(0, 4)}
+                  for r in range(random.randint(1, 60))]
+            for op1 in ops:
+                for op2 in ops:
+                    preds = (
+                        {'op': op1, 'lhs': 'x', 'rhs': 'x'},
+                        {'op': op2, 'lhs': 'y', 'rhs': 'y'},
+                    )
+                    expected = self.expectedPairs(T, Tr, preds)
+                    total = IEJoinCount(T, Tr, preds)
+                    counts = IEJoinCount(T, Tr, preds, per_row=True)
+                    self.assertCounts(T, expected, total, counts, FormatPredicates(preds))
+
+                    expected = self.expectedPairs(T, T, preds)
+                    total = IESelfJoinCount(T, preds)
+                    counts = IESelfJoinCount(T, preds, per_row=True)
+                    self.assertCounts(T, expected, total, counts, FormatPredicates(preds))
+
+    def test_existence(self):
+        # Q1 :  SELECT r.id FROM east r
+        #       WHERE EXISTS (SELECT * FROM west s WHERE r.dur < s.time AND r.rev > s.cost)
+        for op1 in ops:
+            for op2 in ops:
+                preds = (
+                    {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                )
+                self.assertExistence(east, west, preds)
+                self.assertExistence(west, east, [{**pred, 'lhs': pred['rhs'], 'rhs': pred['lhs']} for pred in preds])
+
+        # Q2 :  SELECT r.id FROM Events r
+        #       WHERE NOT EXISTS (SELECT * FROM Events s
+        #                         WHERE r.start ≤ s.end AND r.end ≥ s.start AND r.id ≠ s.id)
+        for repeat in range(20):
+            T = []
+            for r in range(random.randint(1, 30)):
+                start = random.randint(0, 200)
+                T.append({'row': f"e{r+1}", 'id': r, 'start': start, 'end': start + random.randint(0, 10)})
+            preds = (
+                {'op': operator.le, 'lhs': 'start', 'rhs': 'end'},
+                {'op': operator.ge, 'lhs': 'end', 'rhs': 'start'},
+                {'op': operator.ne, 'lhs': 'id', 'rhs': 'id'},
+            )
+            self.assertExistence(T, T, preds)
+
+        # NULL padding survives late materialisation
+        preds = (
+            {'op': operator.gt, 'lhs': 'dur', 'rhs': 'time'},
+            {'op': operator.lt, 'lhs': 'rev', 'rhs': 'cost'},
+        )
+        actual = IEJoinLeftOuter(east, west, preds, rowids=True)
+        self.assertEqual(len(east) - len(IEJoinSemi(east, west, preds)), list(actual.right).count(NULL_ROWID))
+        self.assertEqual([None] * len(IEJoinAnti(east, west, preds)), [r for l, r in actual.Materialize(east, west) if r is None])
+        self.assertEqual(actual.Project(east, west, rcols=('row',))[0].count(None), len(IEJoinAnti(east, west, preds)))
+
+    def test_parallel(self):
+        for op1 in ops:
+            for op2 in ops:
+                preds = (
+                    {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                )
+                expected = self.expectedPairs(east, west, preds)
+                for block_size in (1, 2, 4,):
+                    actual = self.makePairs(IEJoinParallel(east, west, preds, block_size, workers=1))
+                    self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+        actual = IEJoinParallel(east, west, preds, 2, workers=2, rowids=True)
+        self.assertRowIds(east, west, expected, actual, FormatPredicates(preds))
+
+    def test_random_parallel(self):
+        # Many blocks whose min/max summaries overlap through the duplicates
+        for repeat in range(10):
+            T = [{'row': f"r{r+1}", 'x': random.randint(0, 5), 'y': random.randint(0, 5)}
+                 for r in range(random.randint(1, 40))]
+            Tr = [{'row': f"s{r+1}", 'x': random.randint(0, 5), 'y': random.randint(0, 5)}
+                  for r in range(random.randint(1, 40))]
+            for op1 in ops:
+                for op2 in ops:
+                    preds = (
+                        {'op': op1, 'lhs': 'x', 'rhs': 'x'},
+                        {'op': op2, 'lhs': 'y', 'rhs': 'y'},
+                    )
+                    expected = self.expectedPairs(T, Tr, preds)
+                    for block_size in (3, 8,):
+                        actual = IEJoinParallel(T, Tr, preds, block_size, workers=1, rowids=True)
+                        self.assertRowIds(T, Tr, expected, actual, f"{block_size}: {FormatPredicates(preds)}")
+
+    def test_block_pruning(self):
+        T = [{'x': x, 'y': x} for x in range(8)]
+        blocks = PartitionBlocks(ColumnOf(T, 'x'), ColumnOf(T, 'y'), operator.lt, operator.lt, 2)
+        self.assertEqual(4, len(blocks))
+
+        # x < x' AND y < y' only joins blocks with blocks at or above them
+        pairs = BlockPairs(blocks, blocks, operator.lt, operator.lt)
+        self.assertEqual(10, len(pairs))
+
+        # x < x' AND y > y' can never match, but the summaries can't rule out the diagonal
+        pairs = BlockPairs(blocks, blocks, operator.lt, operator.gt)
+        self.assertEqual([(b, b,) for b in range(len(blocks))], pairs)
+
+    def test_summary_bitmap(self):
+        for levels in (1, 2, 3,):
+            for n in (1, 63, 64, 65, 200, 5000,):
+                B = SummaryBitmap(n, levels)
+                expected = bitarray(n)
+                expected.setall(False)
+                for pos in random.sample(range(n), min(n, 5)):
+                    B.Set(pos)
+                    expected[pos] = True
+
+                for off in range(0, n + 1, max(1, n // 100)):
+                    self.assertEqual(expected.find(1, off), B.Find(off), (levels, n, off))
+                    self.assertEqual(list(expected.search(1, off)), B.Search(off), (levels, n, off))
+
+        # Clusters separated by gaps longer than GAP_BITS, extracted a range at a time
+        n = 5 * GAP_BITS
+        B = SummaryBitmap(n)
+        expected = bitarray(n)
+        expected.setall(False)
+        for cluster in (0, 2 * GAP_BITS + 100, n - 300,):
+            for pos in random.sample(range(cluster, cluster + 200), 50):
+                B.Set(pos)
+                expected[pos] = True
+        for off in [0, 150, GAP_BITS, 2 * GAP_BITS + 150, 3 * GAP_BITS, n - 1] + random.sample(range(n), 20):
+            self.assertEqual(expected.find(1, off), B.Find(off), off)
+            self.assertEqual(list(expected.search(1, off)), B.Search(off), off)
+            chunks = list(B.Chunks(off, 16))
+            self.assertTrue(all(chunks), off)
+            self.assertEqual(list(expected.search(1, off)), [pos for chunk in chunks for pos in chunk], off)
+
+    def test_hybrid(self):
+        for op1 in ops:
+            preds = (
+                {'op': operator.eq, 'lhs': 'cores', 'rhs': 'cores'},
+                {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+            )
+            expected = self.expectedPairs(east, west, preds)
+            actual = self.makePairs(IEJoinHybrid(east, west, preds))
+            self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+            for op2 in ops:
+                preds = (
+                    {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                    {'op': operator.eq, 'lhs': 'cores', 'rhs': 'cores'},
+                    {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                )
+                expected = self.expectedPairs(east, west, preds)
+                actual = self.makePairs(IEJoinHybrid(east, west, preds))
+                self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+        actual = IEJoinHybrid(east, west, preds, workers=2, rowids=True)
+        self.assertRowIds(east, west, expected, actual, FormatPredicates(preds))
+
+        with self.assertRaises(ValueError):
+            IEJoinHybrid(east, west, preds[1:2])
+
+    def test_random_hybrid(self):
+        # r.Dept = s.Dept AND r.salary < s.salary AND r.tax > s.tax
+        for repeat in range(20):
+            T = []
+            for r in range(random.randint(3, 30)):
+                row = {'row': f"r{r+1}"}
+                row['dept'] = random.randint(0, 3)
+                row['salary'] = random.randint(50, 150)
+                row['tax'] = random.randint(3, 15)
+                T.append(row)
+
+            for op1 in ops:
+                for op2 in ops:
+                    preds = (
+                        {'op': operator.eq, 'lhs': 'dept', 'rhs': 'dept'},
+                        {'op': op1, 'lhs': 'salary', 'rhs': 'salary'},
+                        {'op': op2, 'lhs': 'tax', 'rhs': 'tax'},
+                    )
+                    expected = self.expectedPairs(T, T, preds)
+                    actual = self.makePairs(IEJoinHybrid(T, T, preds))
+                    self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+    def test_n_predicates(self):
+        for op1 in ops:
+            for op2 in ops:
+                for op3 in ops:
+                    preds = (
+                        {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                        {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                        {'op': op3, 'lhs': 'cores', 'rhs': 'cores'},
+                    )
+                    expected = self.expectedPairs(east, west, preds)
+                    actual = self.makePairs(IEJoinN(east, west, preds))
+                    self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+                    actual = IEJoinN(east, west, preds + ({'op': operator.eq, 'lhs': 'cores', 'rhs': 'cores'},), rowids=True)
+                    expected = self.expectedPairs(east, west, preds + ({'op': operator.eq, 'lhs': 'cores', 'rhs': 'cores'},))
+                    self.assertRowIds(east, west, expected, actual, FormatPredicates(preds))
+
+            preds = ({'op': op1, 'lhs': 'dur', 'rhs': 'time'}, )
+            expected = self.expectedPairs(east, west, preds)
+            actual = self.makePairs(IEJoinN(east, west, preds))
+            self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+        with self.assertRaises(ValueError):
+            IEJoinN(east, west, ({'op': operator.eq, 'lhs': 'cores', 'rhs': 'cores'},))
+
+    def test_selectivities(self):
+        T = [{'x': x} for x in range(100)]
+        preds = (
+            {'op': operator.lt, 'lhs': 'x', 'rhs': 'x'},
+            {'op': operator.eq, 'lhs': 'x', 'rhs': 'x'},
+            {'op': operator.le, 'lhs': 'x', 'rhs': 'x'},
+        )
+        lt, eq, le = Selectivities(T, T, preds, sample=100)
+        self.assertAlmostEqual(0.495, lt)
+        self.assertAlmostEqual(0.01, eq)
+        self.assertAlmostEqual(0.505, le)
+
+    def test_planner(self):
+        for op1 in ops:
+            preds = ({'op': op1, 'lhs': 'dur', 'rhs': 'time'}, )
+            expected = self.expectedPairs(east, west, preds)
+            join_result, plan = PlannedJoin(east, west, preds)
+            self.assertJoinPairs(expected, self.makePairs(join_result), FormatPredicates(preds))
+            self.assertIn('IESingle', plan['costs'])
+
+            for op2 in ops:
+                preds = (
+                    {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                )
+                expected = self.expectedPairs(east, west, preds)
+                join_result, plan = PlannedJoin(east, west, preds, rowids=True)
+                self.assertRowIds(east, west, expected, join_result, FormatPredicates(preds))
+                self.assertEqual({'LoopJoin', 'IEJoin', 'IEJoinUnion'}, set(plan['costs']))
+
+                # Small inputs are always cheaper to loop over
+                self.assertEqual('LoopJoin', plan['algorithm'])
+
+                preds = preds + ({'op': operator.eq, 'lhs': 'cores', 'rhs': 'cores'},)
+                expected = self.expectedPairs(east, west, preds)
+                join_result, plan = PlannedJoin(east, west, preds)
+                self.assertJoinPairs(expected, self.makePairs(join_result), FormatPredicates(preds))
+                self.assertEqual({'LoopJoin', 'IEJoinN'}, set(plan['costs']))
+
+    def test_plan_crossover(self):
+        # Qp : SELECT s1.t id, s2.t id FROM west s1, west s2
+        # WHERE s1.time > s2.time AND s1.cost < s2.cost
+        preds = (
+            {'op': operator.gt, 'lhs': 'time', 'rhs': 'time'},
+            {'op': operator.lt, 'lhs': 'cost', 'rhs': 'cost'},
+        )
+        T = [{'time': t, 'cost': t} for t in range(1000)]
+        self.assertEqual(0, PlanJoin(T, T, preds)['estimate'])
+        self.assertEqual('IEJoin', PlanJoin(T, T[:100], preds)['algorithm'])
+        self.assertEqual('IEJoinUnion', PlanJoin(T[:10], T, preds)['algorithm'])
+        self.assertEqual('LoopJoin', PlanJoin(T[:1], T, preds)['algorithm'])
+
+    def test_side_cache(self):
+        cache = SideCache()
+        T = [dict(row) for row in west]
+        side = cache.Side(T, 'time', 'cost', operator.gt, operator.lt)
+        self.assertIs(side, cache.Side(T, 'time', 'cost', operator.gt, operator.lt))
+        self.assertIsNot(side, cache.Side(T, 'time', 'cost', operator.lt, operator.lt))
+        self.assertEqual(2, len(cache))
+
+        # Appending rebuilds the side
+        T.append({'row': 's5', 't_id': 800, 'time': 120, 'cost': 7, 'cores': 2})
+        self.assertEqual(len(T), len(cache.Side(T, 'time', 'cost', operator.gt, operator.lt)))
+        self.assertEqual(2, len(cache))
+
+        cache.Invalidate(T)
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.used)
+
+        # The budget only holds one side
+        cache = SideCache(side.Bytes() * 3 // 2)
+        cache.Side(west, 'time', 'cost', operator.gt, operator.lt)
+        cache.Side(west, 'time', 'cost', operator.lt, operator.lt)
+        self.assertEqual(1, len(cache))
+        self.assertLessEqual(cache.used, cache.budget)
+
+    def test_cached_joins(self):
+        cache = SideCache()
+        for op1 in ops:
+            for op2 in ops:
+                preds = (
+                    {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                )
+                expected = self.expectedPairs(east, west, preds)
+                for repeat in range(2):
+                    actual = self.makePairs(IEJoinColumnar(east, west, preds, cache=cache))
+                    self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+                preds = (
+                    {'op': op1, 'lhs': 'time', 'rhs': 'time'},
+                    {'op': op2, 'lhs': 'cost', 'rhs': 'cost'},
+                )
+                expected = self.expectedPairs(west, west, preds)
+                for repeat in range(2):
+                    actual = self.makePairs(IESelfJoinColumnar(west, preds, cache=cache))
+                    self.assertJoinPairs(expected, actual, FormatPredicates(preds))
+
+    def test_runs(self):
+        runs = Runs(np.array([1, 1, 2, 5, 5, 5]))
+        self.assertEqual(3, len(runs))
+        self.assertEqual([1, 2, 5], runs.values.tolist())
+        self.assertEqual([0, 2, 3], runs.starts.tolist())
+        self.assertEqual([2, 1, 3], runs.lengths.tolist())
+        self.assertEqual([0, 0, 1, 2, 2, 2], runs.run_of.tolist())
+        self.assertEqual([0, 1, 2, 3], runs.RunAt([0, 2, 3, 6]).tolist())
+
+        self.assertEqual(0, len(Runs(np.array([]))))
+
+    def test_random_runs(self):
+        # Duplicate heavy inputs, like Rank100(n, p)
+        for repeat in range(20):
+            T = []
+            for r in range(random.randint(1, 20)):
+                T.append({'row': f"r{r+1}", 'a': random.randint(0, 2), 'b': random.randint(0, 3)})
+            Tr = []
+            for r in range(random.randint(1, 20)):
+                Tr.append({'row': f"s{r+1}", 'a': random.randint(0, 2), 'b': random.randint(0, 3)})
+
+            for op1 in ops:
+                for op2 in ops:
+                    preds = (
+                        {'op': op1, 'lhs': 'a', 'rhs': 'a'},
+                        {'op': op2, 'lhs': 'b', 'rhs': 'b'},
+                    )
+                    msg = FormatPredicates(preds)
+
+                    expected = self.expectedPairs(T, Tr, preds)
+                    actual = IEJoinRuns(T, Tr, preds, rowids=True)
+                    self.assertRowIds(T, Tr, expected, actual, msg)
+
+                    expected = self.expectedPairs(T, T, preds)
+                    actual = IESelfJoinRuns(T, preds, rowids=True)
+                    self.assertRowIds(T, T, expected, actual, msg)
+
+    def assertSymmetric(self, T, preds, msg=None):
+        expected = self.expectedPairs(T, T, preds)
+        actual = IESymmetricSelfJoin(T, preds, rowids=True)
+
+        # Each unordered pair once
+        unordered = {tuple(sorted(pair)) for pair in expected}
+        self.assertEqual(len(unordered), len(actual), msg)
+        self.assertEqual(unordered, {tuple(sorted(pair)) for pair in self.makePairs(actual.Materialize(T, T))}, msg)
+
+        mirrored = [(T[l]['row'], T[r]['row'],) for l, r in actual.Mirrored()]
+        self.assertEqual(len(expected), len(mirrored), msg)
+        self.assertJoinPairs(expected, mirrored, msg)
+
+    def test_symmetric(self):
+        # Q2 :  SELECT r.id, s.id
+        #       FROM Events r, Events s
+        #       WHERE r.start ≤ s.end AND r.end ≥ s.start AND r.id ≠ s.id;
+        for repeat in range(20):
+            T = []
+            for r in range(random.randint(1, 30)):
+                start = random.randint(0, 100)
+                T.append({'row': f"e{r+1}", 'id': r, 'start': start, 'end': start + random.randint(0, 20)})
+
+            for op1 in ops:
+                preds = (
+                    {'op': op1, 'lhs': 'start', 'rhs': 'end'},
+                    {'op': mirrors[op1], 'lhs': 'end', 'rhs': 'start'},
+                    {'op': operator.ne, 'lhs': 'id', 'rhs': 'id'},
+                )
+                self.assertSymmetric(T, preds, FormatPredicates(preds))
+
+                # Self pairs are kept without the exclusion
+                self.assertSymmetric(T, preds[:2], FormatPredicates(preds[:2]))
+
+        with self.assertRaises(ValueError):
+            IESymmetricSelfJoin(T, ({'op': operator.le, 'lhs': 'start', 'rhs': 'end'},
+                                    {'op': operator.le, 'lhs': 'end', 'rhs': 'start'},))
+
+    def test_external(self):
+        for repeat in range(3):
+            T = [{'x': random.randint(0, 20), 'y': random.randint(0, 20)} for _ in range(random.randint(1, 40))]
+            Tr = [{'x': random.randint(0, 20), 'y': random.randint(0, 20)} for _ in range(random.randint(1, 40))]
+            for op1 in ops:
+                for op2 in ops:
+                    preds = (
+                        {'op': op1, 'lhs': 'x', 'rhs': 'x'},
+                        {'op': op2, 'lhs': 'y', 'rhs': 'y'},
+                    )
+                    expected = set(IEJoinColumnar(T, Tr, preds, rowids=True))
+                    # Runs of 3 rows merged from blocks of 64
+                    actual = IEJoinExternal(iter(T), iter(Tr), preds, budget=64 * 3)
+                    self.assertEqual(len(expected), len(actual), FormatPredicates(preds))
+                    self.assertEqual(expected, set(actual), FormatPredicates(preds))
+
+        # Text values from a CSV reader
+        preds = (
+            {'op': operator.lt, 'lhs': 'dur', 'rhs': 'time'},
+            {'op': operator.gt, 'lhs': 'rev', 'rhs': 'cost'},
+        )
+        expected = set(IEJoinColumnar(east, west, preds, rowids=True))
+        text = lambda T: ({C: str(value) for C, value in row.items()} for row in T)
+        dtypes = {'dur': np.int64, 'time': np.int64, 'rev': np.int64, 'cost': np.int64}
+        actual = IEJoinExternal(text(east), text(west), preds, budget=64, dtypes=dtypes)
+        self.assertEqual(expected, set(actual))
+
+        # Nothing to join
+        self.assertEqual(0, len(IEJoinExternal([], west, preds)))
+
+        # Later chunks with longer strings or floats widen the earlier ones
+        for values in (['a', 'b', 'c', 'abcdef', 'abcdefghijklm', 'ab'], [1, 2, 3, 1.5, 2.5, 0.5],):
+            T = [{'x': value, 'y': r} for r, value in enumerate(values)]
+            preds = (
+                {'op': operator.lt, 'lhs': 'x', 'rhs': 'x'},
+                {'op': operator.lt, 'lhs': 'y', 'rhs': 'y'},
+            )
+            expected = set(IEJoinColumnar(T, T, preds, rowids=True))
+            actual = IEJoinExternal(iter(T), iter(T), preds, budget=64)
+            self.assertEqual(expected, set(actual), values)
+
+    def test_external_sort(self):
+        store = ExternalStore()
+        values = store.Create('values', np.int64, 100)
+        values[:] = [random.randint(0, 10) for _ in range(100)]
+        for descending in (False, True,):
+            L, rids = ExternalSort(store, 'L', values, descending, 7, 8)
+            order = ArgSort(np.asarray(values), descending)
+            self.assertEqual(order.tolist(), rids.tolist())
+            self.assertEqual(np.asarray(values)[order].tolist(), L.tolist())
+
+        # Presorted and reverse-sorted runs, where one run supplies the whole merge at a time
+        n = 2000
+        for presorted in (np.arange(n), np.arange(n)[::-1], np.arange(n) // 3, np.arange(n)[::-1] // 3,):
+            values = store.Create('values', np.int64, n)
+            values[:] = presorted
+            for descending in (False, True,):
+                L, rids = ExternalSort(store, 'L', values, descending, 16, 16)
+                order = ArgSort(np.asarray(values), descending)
+                self.assertEqual(order.tolist(), rids.tolist())
+                self.assertEqual(np.asarray(values)[order].tolist(), L.tolist())
+
+        # Rising salaries, as in salary.py, with a small budget
+        T = [{'id': r, 'salary': 1000 + 100 * r, 'tax': 10 * r} for r in range(500)]
+        preds = (
+            {'op': operator.gt, 'lhs': 'salary', 'rhs': 'salary'},
+            {'op': operator.lt, 'lhs': 'tax', 'rhs': 'tax'},
+        )
+        expected = set(IEJoinColumnar(T, T, preds, rowids=True))
+        self.assertEqual(expected, set(IEJoinExternal(iter(T), iter(T), preds, budget=64 * 4)))
+        preds[1]['op'] = operator.gt
+        expected = set(IEJoinColumnar(T, T, preds, rowids=True))
+        self.assertEqual(expected, set(IEJoinExternal(iter(T), iter(T), preds, budget=64 * 4)))
+
+    def test_sort_order(self):
+        for repeat in range(20):
+            rows = [(random.randint(-5, 5), random.choice((-1.5, -0.0, 0.0, 2.25)), random.choice('abc'), r)
+                    for r in range(random.randint(0, 50))]
+            for desc in itertools.product((False, True,), repeat=3):
+                order = (
+                    (lambda r: r[0], desc[0]),
+                    (lambda r: r[1], desc[1]),
+                    (lambda r: r[2], desc[2]),
+                )
+                # Successive stable sorts, last key first
+                expected = list(rows)
+                for key, reverse in reversed(order):
+                    expected.sort(key=key, reverse=reverse)
+                self.assertEqual(expected, order_by(rows, *order), desc)
+
+            # Ties on the key fields fall back to the row id in the same direction
+            for descending in (False, True,):
+                expected = sorted(rows, key=lambda r: (r[0], r[3],), reverse=descending)
+                self.assertEqual(expected, SortRows(list(rows), (0, 3,), descending))
+
+        # Datetimes and timedeltas sort on their integer ticks, NaT last
+        for unit in ('datetime64[s]', 'timedelta64[ms]',):
+            ticks = [random.randint(-5, 5) * 10**9 for _ in range(50)]
+            for r in range(0, len(ticks), 7): ticks[r] = None
+            values = np.array([np.iinfo(np.int64).min if t is None else t for t in ticks]).view(unit)
+            for descending in (False, True,):
+                sign = -1 if descending else 1
+                expected = sorted(range(len(ticks)), key=lambda i: (sign * (ticks[i] is None), sign * (ticks[i] or 0)))
+                self.assertEqual(expected, ArgSort(values, descending).tolist(), (unit, descending))
+
+        # Too wide to pack
+        big = [random.randint(-2**62, 2**62) for _ in range(20)]
+        order = SortOrder((big, big[::-1],), (False, True,))
+        self.assertEqual(sorted(range(20), key=lambda i: (big[i], -big[19 - i])), order.tolist())
+
+        # Integers that float64 would round, mixed with floats
+        values = [2**53 + 1, 2**53, 1.5, 2**53 + 3]
+        self.assertEqual([2, 1, 0, 3], ArgSort(values).tolist())
+        self.assertEqual([3, 0, 1, 2], ArgSort(values, True).tolist())
+        values = [2**53 + 1, float(2**53), 2**53, -2**60 - 1, -2**60, float('-inf')]
+        self.assertEqual([5, 3, 4, 1, 2, 0], ArgSort(values).tolist())
+
+    def test_profile(self):
+        preds = (
+            {'op': operator.gt, 'lhs': 'dur', 'rhs': 'time'},
+            {'op': operator.lt, 'lhs': 'rev', 'rhs': 'cost'},
+        )
+        with Profile() as profile:
+            actual = IEJoinColumnar(east, west, preds, rowids=True, profile=profile)
+        self.assertIsInstance(actual, RowIdPairs)
+        self.assertEqual(len(IEJoinColumnar(east, west, preds)), len(actual))
+
+        phases = ('projection', 'sort 1', 'sort 2', 'permutation', 'offset array', 'scan',)
+        for phase in phases:
+            self.assertIn(phase, profile.phases)
+        self.assertEqual(2, profile.phases['sort 1']['calls'])
+        self.assertEqual(len(actual), profile.counters['matches'])
+        self.assertLessEqual(profile.counters['bits set'], len(west))
+        self.assertGreaterEqual(profile.counters['find calls'], len(east))
+
+        profile = Profile()
+        preds = (
+            {'op': operator.gt, 'lhs': 'time', 'rhs': 'time'},
+            {'op': operator.lt, 'lhs': 'cost', 'rhs': 'cost'},
+        )
+        actual = IESelfJoinColumnar(west, preds, profile=profile)
+        self.assertEqual(len(actual), profile.counters['matches'])
+        self.assertEqual(0, profile.phases['scan']['peak'])
+
+        exported = json.loads(profile.Json())
+        self.assertEqual(profile.counters['matches'], exported['counters']['matches'])
+        self.assertEqual(set(phases) | {'emit'}, set(exported['phases']))
+
+    def test_incremental(self):
+        for repeat in range(10):
+            T = []
+            for op1 in ops:
+                for op2 in ops:
+                    preds = (
+                        {'op': op1, 'lhs': 'time', 'rhs': 'time'},
+                        {'op': op2, 'lhs': 'cost', 'rhs': 'cost'},
+                    )
+                    T.clear()
+                    join = IncrementalSelfJoin(preds)
+                    seen = set()
+                    for refresh in range(4):
+                        T.extend({'time': random.randint(0, 20), 'cost': random.randint(0, 10)}
+                                 for _ in range(random.randint(0, 10)))
+                        delta = set(join.Refresh(T, rowids=True))
+                        self.assertFalse(delta & seen, FormatPredicates(preds))
+                        seen |= delta
+                        expected = set(IESelfJoinColumnar(T, preds, rowids=True))
+                        self.assertEqual(expected, seen, FormatPredicates(preds))
+                        self.assertEqual(len(T), len(join))
+
+        # Rows can only be appended
+        join = IncrementalSelfJoin(preds)
+        join.Refresh(west)
+        with self.assertRaises(ValueError):
+            join.Refresh(west[:-1])
+
+    def test_band(self):
+        # east.dur BETWEEN west.time - 10 AND west.time + 40
+        preds = BandPredicates('dur', 'time', -10, 40)
+        self.assertEqual("dur ≥ time - 10 AND dur ≤ time + 40", FormatPredicates(preds))
+        expected = self.expectedPairs(east, west, preds)
+        self.assertJoinPairs(expected, self.makePairs(BandJoin(east, west, preds)))
+
+        # Detected from ordinary predicates, in either order
+        preds = (
+            {'op': operator.lt, 'lhs': 'dur', 'rhs': 'time'},
+            {'op': operator.gt, 'lhs': 'dur', 'rhs': 'time', 'offset': -50},
+        )
+        expected = self.expectedPairs(east, west, preds)
+        self.assertRowIds(east, west, expected, BandJoin(east, west, preds, rowids=True))
+
+        with self.assertRaises(ValueError):
+            BandJoin(east, west, ({'op': operator.lt, 'lhs': 'dur', 'rhs': 'time'},
+                                  {'op': operator.gt, 'lhs': 'rev', 'rhs': 'cost'},))
+
+    def test_random_band(self):
+        for repeat in range(50):
+            T = [{'row': f"r{r+1}", 'x': random.randint(0, 50)} for r in range(random.randint(1, 20))]
+            Tr = [{'row': f"s{r+1}", 'y': random.randint(0, 50)} for r in range(random.randint(1, 20))]
+
+            lo = random.randint(-10, 5)
+            hi = lo + random.randint(-2, 10)
+            for strict in (False, True,):
+                preds = BandPredicates('x', 'y', lo, hi, strict)
+                expected = self.expectedPairs(T, Tr, preds)
+                actual = BandJoin(T, Tr, preds, rowids=True)
+                self.assertRowIds(T, Tr, expected, actual, FormatPredicates(preds))
+
+    def test_offsets(self):
+        # Every two table join adds the offsets to its right hand side
+        bands = (
+            BandPredicates('dur', 'time', -10, 40),
+            ({'op': operator.gt, 'lhs': 'dur', 'rhs': 'time', 'offset': -50},
+             {'op': operator.lt, 'lhs': 'rev', 'rhs': 'cost', 'offset': 10000},),
+        )
+        for preds in bands:
+            msg = FormatPredicates(preds)
+            expected = self.expectedPairs(east, west, preds)
+            self.assertGreater(len(expected), 0, msg)
+            for join in (IEJoin, IEJoinUnion, IEJoinColumnar, IEJoinUnionColumnar, IEJoinN, IEJoinRuns,):
+                self.assertRowIds(east, west, expected, join(east, west, preds, rowids=True), f"{join.__name__}: {msg}")
+            self.assertRowIds(east, west, expected, IEJoinParallel(east, west, preds, 2, workers=1, rowids=True), msg)
+            self.assertRowIds(east, west, expected, IEJoinHybrid(east, west, preds, rowids=True), msg)
+            self.assertRowIds(east, west, expected, PlannedJoin(east, west, preds, rowids=True)[0], msg)
+            self.assertRowIds(east, west, expected, IEJoinColumnar(east, west, preds, rowids=True, cache=SideCache()), msg)
+            self.assertRowIds(east, west, self.expectedPairs(east, west, preds[:1]),
+                              IESingle(east, west, preds[0], rowids=True), msg)
+            self.assertCounts(east, expected, IEJoinCount(east, west, preds),
+                              IEJoinCount(east, west, preds, per_row=True), msg)
+            self.assertEqual(len(expected), len(IEJoinExternal(iter(east), iter(west), preds, budget=64)), msg)
+
+            # As residuals and equality keys
+            residual = preds + ({'op': operator.lt, 'lhs': 'cores', 'rhs': 'cores', 'offset': 1},)
+            expected = self.expectedPairs(east, west, residual)
+            self.assertRowIds(east, west, expected, IEJoinN(east, west, residual, rowids=True), msg)
+            matched = {l for l, r in expected}
+            self.assertEqual(sorted(matched), [row['row'] for row in IEJoinSemi(east, west, residual)], msg)
+
+            keyed = preds + ({'op': operator.eq, 'lhs': 'cores', 'rhs': 'cores', 'offset': -2},)
+            expected = self.expectedPairs(east, west, keyed)
+            self.assertRowIds(east, west, expected, IEJoinHybrid(east, west, keyed, rowids=True), msg)
+
+        # Self-joins compare a column with itself
+        preds = BandPredicates('time', 'time', -10, 40)
+        for join in (IESelfJoin, IESelfJoinColumnar, IESelfJoinRuns, IESymmetricSelfJoin,):
+            with self.assertRaises(ValueError, msg=join.__name__):
+                join(west, preds)
+        with self.assertRaises(ValueError):
+            IESelfJoinCount(west, preds)
+        with self.assertRaises(ValueError):
+            IESingleSelf(west, preds[0])
+        with self.assertRaises(ValueError):
+            IncrementalSelfJoin(preds)
+
+    def test_random(self):
+        for repeat in range(100):
+            # Left table
+            m = random.randint(3,20)
+            T = []
+            id_ = 100
+            for r in range(m):
+                row = {'row': f"r{r+1}", 'id': id_}
+                row['dur'] = random.randint(50, 150)
+                row['rev'] = random.randint(3, 15)
+                row['cores'] = 2 ** random.randint(0,5)
+                T.append(row)
+                id_ += random.randint(1,3)
+
+            # Right table
+            n = random.randint(3, 20)
+            Tr = []
+            id_ = 400
+            for r in range(n):
+                row = {'row': f"s{r+1}", 't_id': id_}
+                row['time'] = random.randint(50, 150)
+                row['cost'] = random.randint(3, 15)
+                row['cores'] = 2 ** random.randint(0,5)
+                Tr.append(row)
+                id_ += random.randint(50, 150)
+
+            for op1 in ops:
+                for op2 in ops:
+                    preds = (
+                        {'op': op1, 'lhs': 'dur', 'rhs': 'time'},
+                        {'op': op2, 'lhs': 'rev', 'rhs': 'cost'},
+                    )
+                    self.assertIEJoin(T, Tr, preds)
+
+    def test_random_self(self):
+        for repeat in range(20):
+            n = random.randint(3, 20)
+            T = []
+            for r in range(n):
+                row = {'row': f"s{r+1}"}
+                row['time'] = random.randint(50, 150)
+                row['cost'] = random.randint(3, 15)
+                T.append(row)
+
+            for op1 in ops:
+                for op2 in ops:
+                    preds = (
+                        {'op': op1, 'lhs': 'time', 'rhs': 'time'},
+                        {'op': op2, 'lhs': 'cost', 'rhs': 'cost'},
+                    )
+                    self.assertIESelfJoin(T, preds)
 
     def test_debug(self):
         self.assertWest(operator.gt, operator.lt)
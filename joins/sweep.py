@@ -1,12 +1,17 @@
 # encoding=utf8
 
-import copy
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import itertools
 import operator
+import os
 import random
 import sys
 import unittest
 
-from bitarray import bitarray
+import numpy as np
+
+from iejoin import ExpandWindows, ExtractColumn, FormatPredicates, JoinResult, LoopJoin, NoOffsets
 
 ops = {
     operator.lt: "<",
@@ -15,24 +20,103 @@ ops = {
     operator.ge: "≥",
 }
 
+# Interval joins
+# The plane sweep algorithms join two collections of intervals on the overlap predicates
+#     r.start op1 s.end AND r.end op2 s.start
+# where op1 is < or ≤ and op2 is > or ≥, in either order.
+# Both inputs are sorted by start and swept together;
+# whichever current interval starts first scans forward through the other input
+# while the intervals still overlap.
+# The intervals are assumed to be well formed (start ≤ end).
+
+def IntervalOf(preds):
+    # The (before, after) predicates if preds describe an interval overlap
+    if len(preds) != 2:
+        raise ValueError(f"Interval joins need exactly two predicates: {FormatPredicates(preds)}")
+
+    before = [pred for pred in preds if pred['op'] in (operator.lt, operator.le,)]
+    after = [pred for pred in preds if pred['op'] in (operator.gt, operator.ge,)]
+    if len(before) != 1 or len(after) != 1:
+        raise ValueError(f"Interval joins need one start ≤ end and one end ≥ start predicate: {FormatPredicates(preds)}")
+    NoOffsets('Interval joins', preds)
+
+    return before[0], after[0]
+
+class Intervals:
+    """One input of a sweep: the row ids, starts and ends in start order."""
+    def __init__(self, T, start, end):
+        self.rids = sorted(range(len(T)), key=lambda rid: T[rid][start])
+        self.starts = [T[rid][start] for rid in self.rids]
+        self.ends = [T[rid][end] for rid in self.rids]
+
+    def __len__(self):
+        return len(self.rids)
+
+epoch = datetime.datetime(1970, 1, 1)
+microsecond = datetime.timedelta(microseconds=1)
+
+def Endpoints(values):
+    # Endpoint values as a typed array; datetimes become datetime64
+    # so that sorting and searching them stays out of the interpreter.
+    # (Subtracting the epoch is several times faster than numpy's own conversion.)
+    if len(values) and isinstance(values[0], datetime.datetime):
+        micros = ((value - epoch) // microsecond for value in values)
+        return np.fromiter(micros, dtype=np.int64, count=len(values)).view('datetime64[us]')
+    return np.array(values)
+
+def Keys(A):
+    # Order preserving numeric keys for bucketing
+    if A.dtype.kind == 'M': A = A.view(np.int64)
+    return A.astype(np.float64)
+
+class BucketIndex:
+    """Equi-width buckets over the sorted starts of one input.
+
+    first[b] is the position of the first interval starting in bucket b or later,
+    so every interval before Bound(v) starts strictly before v
+    and can be reported without comparing it.
+    """
+    def __init__(self, starts, buckets=1024):
+        keys = Keys(Endpoints(starts))
+        self.buckets = buckets
+        self.lo = keys[0] if len(keys) else 0.0
+        self.width = (keys[-1] - self.lo) / buckets if len(keys) else 0.0
+        self.first = np.searchsorted(self.Buckets(keys), np.arange(buckets + 1), side='left')
+
+    def Buckets(self, keys):
+        if not self.width:
+            return np.where(keys > self.lo, self.buckets, 0)
+        return np.clip(np.floor((keys - self.lo) / self.width), 0, self.buckets).astype(np.int64)
+
+    def Bounds(self, values):
+        # The bound of each value as a list
+        keys = Keys(Endpoints(values))
+        if not len(keys): return []
+        return np.where(keys > self.lo, self.first[self.Buckets(keys)], 0).tolist()
+
+def IntervalSides(R, S, preds):
+    before, after = IntervalOf(preds)
+    Rs = Intervals(R, before['lhs'], after['lhs'])
+    Ss = Intervals(S, after['rhs'], before['rhs'])
+    return Rs, Ss, before['op'], after['op']
+
 # ALGORITHM 2: Forward Scan based Plane Sweep (FS)
-def FS(R, S, preds):
+def FS(R, S, preds, trace=0, rowids=False):
     # Input: collections of intervals R and S
     # Output: set J of all intersecting interval pairs (r, s) ∈ R × S
-    op1 = preds[0]['op']
-    r_start = preds[0]['lhs']
-    s_end = preds[0]['rhs']
-
-    op2 = preds[1]['op']
-    r_end = preds[1]['lhs']
-    s_start = preds[1]['rhs']
+    if trace: print("FS:", len(R), len(S), FormatPredicates(preds))
 
     # 1. J←∅;
-    J = []
+    J = JoinResult(R, S, rowids)
 
     # 2. sort R and S by start endpoint;
-    R = sorted(R, key=lambda x: x[r_start])
-    S = sorted(S, key=lambda x: x[s_start])
+    R, S, op1, op2 = IntervalSides(R, S, preds)
+    m = len(R)
+    n = len(S)
+
+    # When s starts first, r′.end ≥ s.start follows from the sort,
+    # but r′.end > s.start still has to be checked
+    exact = (op2 == operator.ge)
 
     # 3. r ← first interval in R;
     r = 0
@@ -41,27 +125,31 @@ def FS(R, S, preds):
     s = 0
 
     # 5. while R and S not depleted do
-    while r < len(R) and s < len(S):
+    while r < m and s < n:
         # 6. if r.start < s.start then
-        if R[r].start < S[s].start:
+        if R.starts[r] < S.starts[s]:
             # 7. s′ ← s;
             s1 = s
             # 8. while s′ ≠ null and r.end ≥ s′.start do
-            while s1 < len(S) and op2(R[r][r_end], S[s1][s_start]):
+            end = R.ends[r]
+            while s1 < n and op2(end, S.starts[s1]):
                 # 9. J ← J U {(r,s′)};          ◃ add result
-                J.append((R[r], S[s1],))
+                J.Emit(R.rids[r], S.rids[s1])
                 # 10. s′ ← next interval in S;  ◃ scan forward
                 s1 += 1
             # 11. r ← next interval in R;
             r += 1
         # 12. else
         else:
-            # 13. r ←r;
+            # 13. r′ ← r;
             r1 = r
             # 14. while r′ ≠ null and s.end ≥ r′.start do
-            while r1 < len(R) and op1(S[s][s_end] >= R[r1][r_start]):
+            start = S.starts[s]
+            end = S.ends[s]
+            while r1 < m and op1(R.starts[r1], end):
                 # 15. J ← J U {(r′,s)};         ◃ add result
-                J.append((R[r1], S[s],))
+                if exact or op2(R.ends[r1], start):
+                    J.Emit(R.rids[r1], S.rids[s])
                 # 16. r′ ← next interval in R;  ◃ scan forward
                 r1 += 1
             # 17. s ← next interval in S;
@@ -70,5 +158,324 @@ def FS(R, S, preds):
     # 18. return J
     return J
 
+def EmitGroup(J, members, others, lo, hi, flip):
+    # Report every member of a group with the intervals [lo, hi) of the other input
+    if len(members) * (hi - lo) < 64:
+        for member in members:
+            for other in others[lo:hi]:
+                if flip: J.Emit(other, member)
+                else: J.Emit(member, other)
+        return
+
+    members = np.asarray(members, dtype=np.int64)
+    others = np.asarray(others[lo:hi], dtype=np.int64)
+    if flip: J.EmitBlock(np.tile(others, len(members)), np.repeat(members, len(others)))
+    else: J.EmitBlock(np.repeat(members, len(others)), np.tile(others, len(members)))
+
+def GroupedSweep(R, S, op1, op2, J, bounds_r=None, bounds_s=None):
+    # The shared loop of gFS and bgFS.
+    # Consecutive intervals of one input that start before the current interval
+    # of the other input form a group that scans forward together.
+    # The group is visited in end order, so each interval of the other input
+    # is compared once: if it overlaps the i-th shortest member,
+    # it overlaps every longer member too.
+    # The bounds of the bucket index let a scan jump over the intervals
+    # that certainly overlap the current member.
+    m = len(R)
+    n = len(S)
+    exact = (op2 == operator.ge)
+
+    r = 0
+    s = 0
+    while r < m and s < n:
+        if R.starts[r] < S.starts[s]:
+            # The group of r′ with r′.start < s.start
+            first = S.starts[s]
+            g = r
+            while g < m and R.starts[g] < first: g += 1
+            group = sorted(range(r, g), key=R.ends.__getitem__)
+
+            # S[lo:s1] overlaps group[i:]
+            lo = s1 = s
+            for i, pos in enumerate(group):
+                end = R.ends[pos]
+                if bounds_s and bounds_s[pos] > s1: s1 = bounds_s[pos]
+                while s1 < n and op2(end, S.starts[s1]): s1 += 1
+                if s1 > lo:
+                    EmitGroup(J, [R.rids[member] for member in group[i:]], S.rids, lo, s1, False)
+                    lo = s1
+            r = g
+        else:
+            # The group of s′ with s′.start ≤ r.start
+            first = R.starts[r]
+            g = s
+            while g < n and S.starts[g] <= first: g += 1
+            group = sorted(range(s, g), key=S.ends.__getitem__)
+
+            # R[lo:r1] overlaps group[i:]
+            lo = r1 = r
+            for i, pos in enumerate(group):
+                end = S.ends[pos]
+                if bounds_r and bounds_r[pos] > r1: r1 = bounds_r[pos]
+                while r1 < m and op1(R.starts[r1], end): r1 += 1
+                if r1 > lo:
+                    if exact:
+                        EmitGroup(J, [S.rids[member] for member in group[i:]], R.rids, lo, r1, True)
+                    else:
+                        # r′.end > s′.start can fail when both equal r.start
+                        for member in group[i:]:
+                            start = S.starts[member]
+                            for r2 in range(lo, r1):
+                                if op2(R.ends[r2], start):
+                                    J.Emit(R.rids[r2], S.rids[member])
+                    lo = r1
+            s = g
+
+    return J
+
+# Grouped Forward Scan (gFS)
+def gFS(R, S, preds, trace=0, rowids=False):
+    if trace: print("gFS:", len(R), len(S), FormatPredicates(preds))
+
+    J = JoinResult(R, S, rowids)
+    R, S, op1, op2 = IntervalSides(R, S, preds)
+    return GroupedSweep(R, S, op1, op2, J)
+
+# Bucket indexed Grouped Forward Scan (bgFS)
+def bgFS(R, S, preds, buckets=1024, trace=0, rowids=False):
+    if trace: print("bgFS:", len(R), len(S), buckets, FormatPredicates(preds))
+
+    J = JoinResult(R, S, rowids)
+    R, S, op1, op2 = IntervalSides(R, S, preds)
+
+    # The bound of each interval's end in the other input
+    bounds_r = BucketIndex(R.starts, buckets).Bounds(S.ends)
+    bounds_s = BucketIndex(S.starts, buckets).Bounds(R.ends)
+    return GroupedSweep(R, S, op1, op2, J, bounds_r, bounds_s)
+
+# Columnar Forward Scan
+# Every forward scan stops at the first interval of the other input
+# that starts after the scanning interval ends,
+# so the scan of each interval is a window of the other input's sorted starts
+# and both ends of all the windows come from searchsorted.
+
+def SweepArrays(op1, op2, Rstarts, Rends, Sstarts, Sends):
+    # The forward scan windows of two sets of endpoint arrays,
+    # returned as positions into the (unsorted) input arrays.
+    # 2. sort R and S by start endpoint;
+    Rorder = np.argsort(Rstarts, kind='stable')
+    Rstarts = Rstarts[Rorder]
+    Rends = Rends[Rorder]
+
+    Sorder = np.argsort(Sstarts, kind='stable')
+    Sstarts = Sstarts[Sorder]
+    Sends = Sends[Sorder]
+
+    # 6-11. r.start < s′.start and r.end op2 s′.start
+    begin = np.searchsorted(Sstarts, Rstarts, side='right')
+    end = np.searchsorted(Sstarts, Rends, side='right' if op2 == operator.ge else 'left')
+    left1, right1 = ExpandWindows(begin, end)
+
+    # 12-17. s.start ≤ r′.start and r′.start op1 s.end
+    begin = np.searchsorted(Rstarts, Sstarts, side='left')
+    end = np.searchsorted(Rstarts, Sends, side='right' if op1 == operator.le else 'left')
+    right2, left2 = ExpandWindows(begin, end)
+    if op2 == operator.gt and len(left2):
+        keep = (Rends[left2] > Sstarts[right2])
+        left2 = left2[keep]
+        right2 = right2[keep]
+
+    return Rorder[np.concatenate((left1, left2,))], Sorder[np.concatenate((right1, right2,))]
+
+def FSColumnar(R, S, preds, trace=0, rowids=False):
+    if trace: print("FSColumnar:", len(R), len(S), FormatPredicates(preds))
+
+    before, after = IntervalOf(preds)
+
+    J = JoinResult(R, S, rowids)
+    if not len(R) or not len(S): return J
+
+    left, right = SweepArrays(before['op'], after['op'],
+                              Endpoints(ExtractColumn(R, before['lhs'])), Endpoints(ExtractColumn(R, after['lhs'])),
+                              Endpoints(ExtractColumn(S, after['rhs'])), Endpoints(ExtractColumn(S, before['rhs'])))
+    J.EmitBlock(left, right)
+
+    return J
+
+# Parallel Forward Scan
+# The time domain is cut into as many ranges as there are partitions,
+# each holding the same number of endpoints from both inputs.
+# Intervals are replicated into every range they cross,
+# and a pair is only reported by the range holding the later of the two starts,
+# which lies inside both intervals whenever they overlap.
+# The ranges are swept independently in a process pool.
+
+def DomainBounds(endpoints, partitions):
+    # The partitions - 1 boundaries splitting the endpoints into equal ranges
+    endpoints = np.sort(endpoints)
+    return endpoints[[len(endpoints) * p // partitions for p in range(1, partitions)]]
+
+def Replicate(bounds, starts, ends):
+    # The first and last range each interval touches
+    return np.searchsorted(bounds, starts, side='right'), np.searchsorted(bounds, ends, side='right')
+
+def SweepPartition(op1, op2, bounds, p, Rrids, Rstarts, Rends, Srids, Sstarts, Sends):
+    # Sweep one range and keep the pairs whose later start falls inside it
+    left, right = SweepArrays(op1, op2, Rstarts, Rends, Sstarts, Sends)
+    later = np.maximum(Rstarts[left], Sstarts[right])
+    keep = (np.searchsorted(bounds, later, side='right') == p)
+    return Rrids[left[keep]], Srids[right[keep]]
+
+def FSParallel(R, S, preds, partitions=None, workers=None, trace=0, rowids=False):
+    # workers=None uses every core; workers=1 sweeps the ranges in this process
+    if partitions is None: partitions = workers or os.cpu_count()
+    if trace: print("FSParallel:", len(R), len(S), partitions, FormatPredicates(preds))
+
+    before, after = IntervalOf(preds)
+    op1 = before['op']
+    op2 = after['op']
+
+    J = JoinResult(R, S, rowids)
+    if not len(R) or not len(S): return J
+
+    Rstarts = Endpoints(ExtractColumn(R, before['lhs']))
+    Rends = Endpoints(ExtractColumn(R, after['lhs']))
+    Sstarts = Endpoints(ExtractColumn(S, after['rhs']))
+    Sends = Endpoints(ExtractColumn(S, before['rhs']))
+
+    bounds = DomainBounds(np.concatenate((Rstarts, Rends, Sstarts, Sends,)), partitions)
+    Rfirst, Rlast = Replicate(bounds, Rstarts, Rends)
+    Sfirst, Slast = Replicate(bounds, Sstarts, Sends)
+
+    args = []
+    for p in range(partitions):
+        Rrids = np.flatnonzero((Rfirst <= p) & (p <= Rlast))
+        Srids = np.flatnonzero((Sfirst <= p) & (p <= Slast))
+        if trace: print("Partition:", p, len(Rrids), len(Srids), file=sys.stderr)
+        if len(Rrids) and len(Srids):
+            args.append((op1, op2, bounds, p,
+                         Rrids, Rstarts[Rrids], Rends[Rrids],
+                         Srids, Sstarts[Srids], Sends[Srids],))
+
+    if workers == 1:
+        for left, right in itertools.starmap(SweepPartition, args):
+            J.EmitBlock(left, right)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for left, right in executor.map(SweepPartition, *zip(*args)):
+                J.EmitBlock(left, right)
+
+    return J
+
+class TestSweep(unittest.TestCase):
+
+    algorithms = (FS, gFS, bgFS, FSColumnar,)
+
+    def makeIntervals(self, n, domain, length, prefix):
+        T = []
+        for rid in range(n):
+            start = random.randint(0, domain)
+            T.append({'row': f"{prefix}{rid+1}", 'start': start, 'end': start + random.randint(0, length)})
+        return T
+
+    def overlaps(self, op1=operator.le, op2=operator.ge):
+        return (
+            {'op': op1, 'lhs': 'start', 'rhs': 'end'},
+            {'op': op2, 'lhs': 'end', 'rhs': 'start'},
+        )
+
+    def assertSweep(self, R, S, preds, msg=None):
+        expected = set(LoopJoin(R, S, preds, rowids=True))
+        for algorithm in self.algorithms:
+            actual = algorithm(R, S, preds, rowids=True)
+            self.assertEqual(len(expected), len(actual), f"{algorithm.__name__} {msg}")
+            self.assertEqual(expected, set(actual), f"{algorithm.__name__} {msg}")
+
+            # Materialised rows
+            actual = algorithm(R, S, preds)
+            self.assertEqual({(R[l]['row'], S[r]['row'],) for l, r in expected},
+                             {(r['row'], s['row'],) for r, s in actual}, f"{algorithm.__name__} {msg}")
+
+    def test_interval_of(self):
+        before, after = IntervalOf(tuple(reversed(self.overlaps())))
+        self.assertEqual(operator.le, before['op'])
+        self.assertEqual(operator.ge, after['op'])
+
+        with self.assertRaises(ValueError):
+            IntervalOf(self.overlaps(operator.le, operator.le))
+        with self.assertRaises(ValueError):
+            IntervalOf(self.overlaps()[:1])
+        with self.assertRaises(ValueError):
+            IntervalOf(({**self.overlaps()[0], 'offset': 1}, self.overlaps()[1],))
+
+    def test_bucket_index(self):
+        starts = sorted(random.randint(0, 1000) for _ in range(500))
+        values = list(range(-10, 1020))
+        for value, bound in zip(values, BucketIndex(starts, 16).Bounds(values)):
+            self.assertTrue(all(start < value for start in starts[:bound]), value)
+            self.assertTrue(bound >= sum(start < value - 63 for start in starts), value)
+
+        self.assertEqual([0], BucketIndex([], 16).Bounds([5]))
+        self.assertEqual([0, 0, 3], BucketIndex([5, 5, 5], 16).Bounds([4, 5, 6]))
+
+        # Datetimes
+        day = datetime.datetime(1992, 1, 1)
+        starts = [day + datetime.timedelta(hours=h) for h in range(100)]
+        bounds = BucketIndex(starts, 10).Bounds([day + datetime.timedelta(hours=50, minutes=1)])
+        self.assertEqual([50], bounds)
+
+    def test_empty(self):
+        R = self.makeIntervals(10, 100, 10, 'r')
+        for algorithm in self.algorithms:
+            self.assertEqual(0, len(algorithm(R, [], self.overlaps(), rowids=True)))
+            self.assertEqual(0, len(algorithm([], R, self.overlaps(), rowids=True)))
+
+    def test_random(self):
+        for repeat in range(100):
+            R = self.makeIntervals(random.randint(1, 30), 50, 10, 'r')
+            S = self.makeIntervals(random.randint(1, 30), 50, 10, 's')
+            for op1 in (operator.lt, operator.le,):
+                for op2 in (operator.gt, operator.ge,):
+                    preds = self.overlaps(op1, op2)
+                    self.assertSweep(R, S, preds, FormatPredicates(preds))
+
+    def test_parallel(self):
+        preds = self.overlaps()
+        for repeat in range(20):
+            R = self.makeIntervals(random.randint(1, 40), 100, 30, 'r')
+            S = self.makeIntervals(random.randint(1, 40), 100, 30, 's')
+            for op1 in (operator.lt, operator.le,):
+                for op2 in (operator.gt, operator.ge,):
+                    preds = self.overlaps(op1, op2)
+                    expected = set(LoopJoin(R, S, preds, rowids=True))
+                    for partitions in (1, 2, 3, 7,):
+                        actual = FSParallel(R, S, preds, partitions, workers=1, rowids=True)
+                        # Each pair is reported exactly once
+                        self.assertEqual(len(expected), len(actual), FormatPredicates(preds))
+                        self.assertEqual(expected, set(actual), FormatPredicates(preds))
+
+        actual = FSParallel(R, S, preds, 3, workers=2, rowids=True)
+        self.assertEqual(expected, set(actual))
+        self.assertEqual(len(expected), len(actual))
+
+    def test_domain_bounds(self):
+        endpoints = np.arange(100)
+        bounds = DomainBounds(endpoints, 4)
+        self.assertEqual([25, 50, 75], bounds.tolist())
+
+        # [10, 60] crosses into the third range
+        first, last = Replicate(bounds, np.array([10]), np.array([60]))
+        self.assertEqual(([0], [2],), (first.tolist(), last.tolist(),))
+
+    def test_events(self):
+        # Q2: overlapping events
+        day = datetime.datetime(1992, 1, 1)
+        events = []
+        for eid in range(300):
+            start = day + datetime.timedelta(days=random.randint(0, 30), hours=random.randint(0, 23))
+            minutes = 120 if random.random() < 0.1 else random.randint(5, 55)
+            events.append({'row': eid, 'start': start, 'end': start + datetime.timedelta(minutes=minutes)})
+        self.assertSweep(events, events, self.overlaps())
+
 if __name__ == '__main__':
     unittest.main()